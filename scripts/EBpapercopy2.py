@@ -21,20 +21,24 @@ Multi 保持串接測試的方式不變；
 """
 
 import os
+import io
+import sys
 import math
 import struct
 import csv
 import time
-import heapq
 import zlib
+import bz2
+import lzma
+import contextlib
 import numpy as np
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, NamedTuple
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from bitarray import bitarray
 from scipy.spatial import cKDTree
 import numba
 from numba import njit
-from numba.typed import List as NumbaList
 import argparse
 
 ###############################################################################
@@ -79,329 +83,1313 @@ def write_results_to_csv(results: List[dict], csv_path: str, fieldnames: List[st
         cw.writerows(results)
     print(f"[INFO] => CSV written: {csv_path}, rows={len(results)}")
 
+def aabb_bounds(aabb):
+    """
+    查詢框 ((xmin,ymin,zmin),(xmax,ymax,zmax)) => (lo, hi) 兩個 float64 陣列
+    """
+    box = np.asarray(aabb, dtype=np.float64).reshape(2, 3)
+    return box[0], box[1]
+
+def crop_to_aabb(points: np.ndarray, aabb) -> np.ndarray:
+    """
+    只保留落在查詢框內 (含邊界) 的點
+    """
+    lo, hi = aabb_bounds(aabb)
+    inside = np.all((points >= lo) & (points <= hi), axis=1)
+    return points[inside]
+
 
 ###############################################################################
-# (2) Huffman (Method 1) - 無誤差
+# (1a) Canonical Huffman 共用核心 (計數、碼長、打包、查表解碼)
 ###############################################################################
-class HuffmanNodeTree:
-    def __init__(self, char=None, freq=0, left=None, right=None):
-        self.char = char
-        self.freq = freq
-        self.left = left
-        self.right = right
-    def __lt__(self, other):
-        return self.freq < other.freq
-
-def build_frequency_dict(data_bytes: bytes) -> Dict[int,int]:
-    freq={}
-    for b in data_bytes:
-        freq[b] = freq.get(b, 0) + 1
-    return freq
-
-def build_huffman_tree(freq_dict: Dict[int,int]) -> Optional[HuffmanNodeTree]:
-    if not freq_dict:
-        return None
-    heap=[]
-    for c,f in freq_dict.items():
-        heapq.heappush(heap, HuffmanNodeTree(c, f))
-    while len(heap) > 1:
-        n1= heapq.heappop(heap)
-        n2= heapq.heappop(heap)
-        merged= HuffmanNodeTree(None, n1.freq+n2.freq, n1, n2)
-        heapq.heappush(heap, merged)
-    return heapq.heappop(heap) if heap else None
-
-def build_encoding_dict(huffman_tree: HuffmanNodeTree, prefix="", edict=None) -> Dict[int,str]:
-    if edict is None:
-        edict={}
-    if (huffman_tree.left is None) and (huffman_tree.right is None):
-        edict[huffman_tree.char] = prefix if prefix else "0"
-        return edict
-    if huffman_tree.left:
-        build_encoding_dict(huffman_tree.left, prefix + "0", edict)
-    if huffman_tree.right:
-        build_encoding_dict(huffman_tree.right, prefix + "1", edict)
-    return edict
+HUFF_LUT_BITS = 12      # 一級查表寬度: 碼長 <= 12 者一次查表即解出
+HUFF_MAX_CODE_LEN = 54  # int64 位元視窗可容納的最長碼長
 
-def huffman_encoding(data_bytes: bytes):
-    freq= build_frequency_dict(data_bytes)
-    total= sum(freq.values())
+@njit(nogil=True)
+def _canonical_codes_kernel(lengths: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """
+    依 canonical 順序 (order: 碼長遞增、同碼長 symbol 遞增) 指派碼值，
+    回傳與 lengths 對齊的 int64 碼值。
+    """
+    codes = np.zeros(lengths.shape[0], dtype=np.int64)
+    code = 0
+    prev_len = 0
+    for k in range(order.shape[0]):
+        i = order[k]
+        l = lengths[i]
+        code <<= (l - prev_len)
+        codes[i] = code
+        code += 1
+        prev_len = l
+    return codes
+
+@njit(nogil=True)
+def _build_huffman_lut(lengths: np.ndarray, codes: np.ndarray, lut_bits: int) -> np.ndarray:
+    """
+    建立 2^lut_bits 的一級查表，每格為 (symbol index << 8) | 碼長；
+    碼長 > lut_bits 的格子維持 -1，交由長碼路徑處理。
+    """
+    lut = np.full(1 << lut_bits, -1, dtype=np.int64)
+    for i in range(lengths.shape[0]):
+        l = lengths[i]
+        if l == 0 or l > lut_bits:
+            continue
+        shift = lut_bits - l
+        start = codes[i] << shift
+        entry = (i << 8) | l
+        for j in range(start, start + (1 << shift)):
+            lut[j] = entry
+    return lut
+
+@njit(nogil=True)
+def _huffman_decode_kernel(data: np.ndarray, nbits: int,
+                           lut: np.ndarray, lut_bits: int,
+                           first_code: np.ndarray, first_rank: np.ndarray,
+                           len_count: np.ndarray, order: np.ndarray,
+                           max_len: int, out: np.ndarray) -> int:
+    """
+    MSB-first 位元流解碼：每步以 lut_bits 位元查表；查無 (長碼) 時
+    依 canonical first_code/count 逐長度比對。回傳解出的 symbol 數。
+    """
+    nbytes = data.shape[0]
+    lut_mask = (1 << lut_bits) - 1
+    max_out = out.shape[0]
+    nout = 0
+    pos = 0
+    byte_pos = 0
+    bitbuf = 0
+    bitcnt = 0
+    while pos < nbits and nout < max_out:
+        while bitcnt <= 54:
+            b = 0
+            if byte_pos < nbytes:
+                b = data[byte_pos]
+            bitbuf = (bitbuf << 8) | b
+            byte_pos += 1
+            bitcnt += 8
+        e = lut[(bitbuf >> (bitcnt - lut_bits)) & lut_mask]
+        if e >= 0:
+            idx = e >> 8
+            l = e & 0xFF
+        else:
+            idx = -1
+            l = lut_bits + 1
+            while l <= max_len:
+                off = ((bitbuf >> (bitcnt - l)) & ((1 << l) - 1)) - first_code[l]
+                if off >= 0 and off < len_count[l]:
+                    idx = order[first_rank[l] + off]
+                    break
+                l += 1
+            if idx < 0:
+                break  # 非法碼 => 停止
+        if pos + l > nbits:
+            break
+        out[nout] = idx
+        nout += 1
+        pos += l
+        bitcnt -= l
+        bitbuf &= (1 << bitcnt) - 1
+    return nout
+
+def canonical_huffman_codes(symbols: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    給定 symbols 與對應碼長，回傳 canonical Huffman 碼值 (int64, 與輸入對齊)。
+    解碼端只需碼長即可重建同一組碼。
+    """
+    symbols = np.asarray(symbols, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    used = np.nonzero(lengths)[0]
+    order = used[np.lexsort((symbols[used], lengths[used]))]
+    return _canonical_codes_kernel(lengths, order)
+
+@njit(nogil=True)
+def _huffman_pack_range(sym_idx: np.ndarray, lo: int, hi: int,
+                        codes: np.ndarray, lengths: np.ndarray, out: np.ndarray, p: int):
+    """
+    把 sym_idx[lo:hi] 依 (code, length) 打包進 out[p:] (MSB-first，結尾補 0 至整 byte)
+    """
+    acc = 0
+    accbits = 0
+    for i in range(lo, hi):
+        k = sym_idx[i]
+        l = lengths[k]
+        acc = (acc << l) | codes[k]
+        accbits += l
+        while accbits >= 8:
+            accbits -= 8
+            out[p] = (acc >> accbits) & 0xFF
+            p += 1
+        acc &= (1 << accbits) - 1
+    if accbits > 0:
+        out[p] = (acc << (8 - accbits)) & 0xFF
+
+@njit(nogil=True)
+def _huffman_pack_kernel(sym_idx: np.ndarray, codes: np.ndarray, lengths: np.ndarray):
+    """
+    依 (code, length) 陣列把 symbol index 串接成 MSB-first 位元流，
+    回傳 (uint8 buffer, 總位元數)。
+    """
+    n = sym_idx.shape[0]
+    total = 0
+    for i in range(n):
+        total += lengths[sym_idx[i]]
+    out = np.zeros((total + 7) >> 3, dtype=np.uint8)
+    _huffman_pack_range(sym_idx, 0, n, codes, lengths, out, 0)
+    return out, total
+
+@njit(nogil=True)
+def _huffman_pack_blocks_kernel(sym_idx: np.ndarray, codes: np.ndarray,
+                                lengths: np.ndarray, block_size: int):
+    """
+    每 block_size 個 symbol 為一個 block，各 block 從整 byte 開始，
+    回傳 (uint8 buffer, 各 block 起始 byte offset，長度 nblocks+1)。
+    """
+    n = sym_idx.shape[0]
+    nblocks = (n + block_size - 1) // block_size
+    offsets = np.zeros(nblocks + 1, dtype=np.int64)
+    for b in range(nblocks):
+        bits = 0
+        for i in range(b*block_size, min(n, (b + 1)*block_size)):
+            bits += lengths[sym_idx[i]]
+        offsets[b+1] = offsets[b] + ((bits + 7) >> 3)
+    out = np.zeros(offsets[nblocks], dtype=np.uint8)
+    for b in range(nblocks):
+        _huffman_pack_range(sym_idx, b*block_size, min(n, (b + 1)*block_size),
+                            codes, lengths, out, offsets[b])
+    return out, offsets
+
+def bitarray_from_buffer(buf: np.ndarray, nbits: int) -> bitarray:
+    """
+    uint8 buffer (MSB-first) => 長度為 nbits 的 bitarray
+    """
+    bits = bitarray()
+    bits.frombytes(buf.tobytes())
+    del bits[nbits:]
+    return bits
+
+class CanonicalHuffmanEncoder:
+    """
+    Canonical Huffman 陣列式編碼器 (Huffman / EB-HC / EB-HC-3D 共用)。
+    symbol => (code, length) 以陣列查表，整段資料一次在 JIT kernel 內打包。
+    """
+    DIRECT_SPAN = 1 << 16   # symbol 值域小於此值時用直接索引表取代 searchsorted
+
+    def __init__(self, symbols: np.ndarray, lengths: np.ndarray):
+        symbols = np.asarray(symbols, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        srt = np.argsort(symbols, kind='stable')
+        self.symbols = symbols[srt]
+        self.lengths = lengths[srt]
+        if self.lengths.size and int(self.lengths.max()) > HUFF_MAX_CODE_LEN:
+            raise ValueError(f"Huffman code length {int(self.lengths.max())} exceeds {HUFF_MAX_CODE_LEN}")
+        self.codes = canonical_huffman_codes(self.symbols, self.lengths)
+        self.index_lut = None
+        if self.symbols.size:
+            self.lo = int(self.symbols[0])
+            span = int(self.symbols[-1]) - self.lo + 1
+            if span <= self.DIRECT_SPAN:
+                self.index_lut = np.full(span, -1, dtype=np.int64)
+                self.index_lut[self.symbols - self.lo] = np.arange(self.symbols.size)
+
+    def symbol_index(self, values: np.ndarray) -> np.ndarray:
+        """
+        values => 在 self.symbols 中的位置；碼表外的值丟出 ValueError。
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size == 0:
+            return np.empty(0, dtype=np.int64)
+        if self.index_lut is not None:
+            off = values - self.lo
+            ok = (off >= 0) & (off < self.index_lut.shape[0])
+            idx = self.index_lut[np.where(ok, off, 0)]
+            ok &= (idx >= 0)
+        else:
+            idx = np.searchsorted(self.symbols, values)
+            idx[idx >= self.symbols.size] = 0
+            ok = (self.symbols[idx] == values)
+        if not ok.all():
+            raise ValueError("symbol not in Huffman code table")
+        return idx
+
+    def encode(self, values: np.ndarray):
+        """
+        回傳 (uint8 buffer, 總位元數)
+        """
+        return _huffman_pack_kernel(self.symbol_index(values), self.codes, self.lengths)
+
+    def encode_blocks(self, values: np.ndarray, block_size: int):
+        """
+        分 block 編碼，回傳 (uint8 buffer, 各 block 起始 byte offset)
+        """
+        return _huffman_pack_blocks_kernel(self.symbol_index(values), self.codes,
+                                           self.lengths, block_size)
+
+def pack_uint_bits(values: np.ndarray, width: int) -> bytes:
+    """
+    非負整數陣列以固定 width 位元 (MSB-first) 緊密打包
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if width == 0 or values.size == 0:
+        return b""
+    shifts = np.arange(width - 1, -1, -1, dtype=np.int64)
+    bits = ((values[:, None] >> shifts) & 1).astype(np.uint8)
+    return np.packbits(bits.ravel()).tobytes()
+
+def unpack_uint_bits(data, count: int, width: int) -> np.ndarray:
+    """
+    pack_uint_bits 的反向操作，回傳 int64 陣列
+    """
+    if width == 0 or count == 0:
+        return np.zeros(count, dtype=np.int64)
+    nbytes = (count*width + 7) // 8
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=nbytes))[:count*width]
+    weights = (1 << np.arange(width - 1, -1, -1, dtype=np.int64))
+    return bits.reshape(count, width).astype(np.int64) @ weights
+
+CODE_LEN_DENSE = 0   # 連續值域: 每個 symbol 一個碼長 (0 = 未使用)
+CODE_LEN_SPARSE = 1  # 稀疏值域: symbol 差值 + 碼長
+CODE_LEN_WIDE = 2    # mode 旗標: 最小 symbol 超出 int32 => 以 int64 存放
+
+def _code_len_head(mode: int, len_w: int, lo: int, count: int) -> bytes:
+    """
+    碼表標頭 '<BBiI'；最小 symbol 超出 int32 時改為 '<BBqI' 並設 CODE_LEN_WIDE 旗標
+    """
+    if -2**31 <= lo < 2**31:
+        return struct.pack('<BBiI', mode, len_w, lo, count)
+    return struct.pack('<BBqI', mode | CODE_LEN_WIDE, len_w, lo, count)
+
+def pack_code_lengths(symbols: np.ndarray, lengths: np.ndarray) -> bytes:
+    """
+    Canonical Huffman 碼表標頭：只存碼長 (bit-packed)，碼值由解碼端重建。
+      header = '<BBiI' (mode, 碼長位元寬, 最小 symbol, 個數)；最小 symbol 超出 int32 時為 '<BBqI'
+      dense  : 值域內每個 symbol 的碼長
+      sparse : 'B' 差值位元寬 + 相鄰 symbol 差值 + 碼長
+    兩種格式取較小者。
+    """
+    symbols = np.asarray(symbols, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if symbols.size == 0:
+        return struct.pack('<BBiI', CODE_LEN_DENSE, 0, 0, 0)
+    srt = np.argsort(symbols, kind='stable')
+    symbols = symbols[srt]
+    lengths = lengths[srt]
+    lo = int(symbols[0])
+    span = int(symbols[-1]) - lo + 1
+    len_w = int(lengths.max()).bit_length()
+    deltas = np.diff(symbols)
+    delta_w = int(deltas.max()).bit_length() if deltas.size else 0
+
+    dense_bits = span*len_w
+    sparse_bits = 8 + deltas.size*delta_w + symbols.size*len_w
+    if dense_bits <= sparse_bits:
+        dense = np.zeros(span, dtype=np.int64)
+        dense[symbols - lo] = lengths
+        return _code_len_head(CODE_LEN_DENSE, len_w, lo, span) + pack_uint_bits(dense, len_w)
+    return (_code_len_head(CODE_LEN_SPARSE, len_w, lo, symbols.size) + struct.pack('B', delta_w)
+            + pack_uint_bits(deltas, delta_w) + pack_uint_bits(lengths, len_w))
+
+def unpack_code_lengths(data: bytes, pos: int = 0):
+    """
+    解析 pack_code_lengths 標頭，回傳 (symbols, lengths, 新 pos)；
+    只回傳碼長 > 0 的 symbol。
+    """
+    fmt = '<BBqI' if data[pos] & CODE_LEN_WIDE else '<BBiI'
+    hs = struct.calcsize(fmt)
+    mode, len_w, lo, count = struct.unpack(fmt, data[pos:pos+hs])
+    mode &= ~CODE_LEN_WIDE
+    pos += hs
+    if mode == CODE_LEN_DENSE:
+        nbytes = (count*len_w + 7) // 8
+        lengths = unpack_uint_bits(data[pos:pos+nbytes], count, len_w)
+        pos += nbytes
+        symbols = np.arange(lo, lo + count, dtype=np.int64)
+        used = lengths > 0
+        return symbols[used], lengths[used], pos
+    delta_w = data[pos]
+    pos += 1
+    nbytes = ((count - 1)*delta_w + 7) // 8
+    deltas = unpack_uint_bits(data[pos:pos+nbytes], count - 1, delta_w)
+    pos += nbytes
+    symbols = np.empty(count, dtype=np.int64)
+    symbols[0] = lo
+    np.cumsum(deltas, out=symbols[1:])
+    symbols[1:] += lo
+    nbytes = (count*len_w + 7) // 8
+    lengths = unpack_uint_bits(data[pos:pos+nbytes], count, len_w)
+    pos += nbytes
+    return symbols, lengths, pos
+
+class CanonicalHuffmanDecoder:
+    """
+    Canonical Huffman 查表解碼器 (Huffman / EB-HC / EB-HC-3D 共用)。
+    只需 (symbol, 碼長) 即可建表；解碼在 JIT kernel 內一次查 lut_bits 位元。
+    """
+    def __init__(self, symbols: np.ndarray, lengths: np.ndarray, lut_bits: int = HUFF_LUT_BITS):
+        symbols = np.asarray(symbols, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        srt = np.argsort(symbols, kind='stable')
+        self.symbols = symbols[srt]
+        self.lengths = lengths[srt]
+        self.max_len = int(self.lengths.max()) if self.lengths.size else 0
+        if self.max_len > HUFF_MAX_CODE_LEN:
+            raise ValueError(f"Huffman code length {self.max_len} exceeds {HUFF_MAX_CODE_LEN}")
+        self.min_len = int(self.lengths[self.lengths > 0].min()) if self.max_len > 0 else 0
+        self.lut_bits = max(1, min(lut_bits, self.max_len))
+
+        used = np.nonzero(self.lengths)[0]
+        self.order = used[np.lexsort((self.symbols[used], self.lengths[used]))]
+        codes = _canonical_codes_kernel(self.lengths, self.order)
+        self.lut = _build_huffman_lut(self.lengths, codes, self.lut_bits)
+
+        # 長碼路徑: 每個碼長的 first_code / 起始 rank / 個數
+        self.len_count = np.bincount(self.lengths[used], minlength=self.max_len + 2).astype(np.int64)
+        self.len_count[0] = 0
+        self.first_rank = np.zeros_like(self.len_count)
+        self.first_code = np.zeros_like(self.len_count)
+        code = 0
+        for l in range(1, self.max_len + 1):
+            code = (code + self.len_count[l-1]) << 1
+            self.first_code[l] = code
+            self.first_rank[l] = self.first_rank[l-1] + self.len_count[l-1]
+
+    def decode(self, data, nbits: int, max_syms: Optional[int] = None) -> np.ndarray:
+        """
+        解碼 data 前 nbits 位元 (MSB-first)，回傳 symbol 陣列 (int64)。
+        max_syms 未給時以 nbits/最短碼長 作為上限。
+        """
+        if nbits <= 0 or self.max_len == 0:
+            return np.empty(0, dtype=np.int64)
+        buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+        if max_syms is None:
+            max_syms = nbits // self.min_len
+        out = np.empty(max_syms, dtype=np.int64)
+        n = _huffman_decode_kernel(buf, int(nbits), self.lut, self.lut_bits,
+                                   self.first_code, self.first_rank, self.len_count,
+                                   self.order, self.max_len, out)
+        return self.symbols[out[:n]]
+
+    def decode_blocks(self, data, offsets: np.ndarray, count: int, block_size: int,
+                      workers: Optional[int] = None) -> np.ndarray:
+        """
+        依 block offset 索引平行解碼 (decode kernel 為 nogil，可用 thread pool)，
+        每個 block 直接寫入共用輸出陣列的對應區段。
+        """
+        buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+        out = np.empty(count, dtype=np.int64)
+        nblocks = offsets.shape[0] - 1
+
+        def decode_one(b):
+            lo = b*block_size
+            hi = min(count, lo + block_size)
+            seg = buf[offsets[b]:offsets[b+1]]
+            return _huffman_decode_kernel(seg, seg.shape[0]*8, self.lut, self.lut_bits,
+                                          self.first_code, self.first_rank, self.len_count,
+                                          self.order, self.max_len, out[lo:hi])
+        if workers == 1 or nblocks <= 1:
+            for b in range(nblocks):
+                decode_one(b)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                list(ex.map(decode_one, range(nblocks)))
+        return self.symbols[out]
+
+
+@njit(nogil=True)
+def _huffman_lengths_inplace(A: np.ndarray):
+    """
+    Moffat-Katajainen in-place 演算法：A 為遞增排序的頻率，
+    結束時 A[i] 即為第 i 個 symbol 的碼長 (不配置任何節點物件)。
+    """
+    n = A.shape[0]
+    A[0] += A[1]
+    root = 0
+    leaf = 2
+    for nxt in range(1, n - 1):
+        if leaf >= n or A[root] < A[leaf]:
+            A[nxt] = A[root]
+            A[root] = nxt
+            root += 1
+        else:
+            A[nxt] = A[leaf]
+            leaf += 1
+        if leaf >= n or (root < nxt and A[root] < A[leaf]):
+            A[nxt] += A[root]
+            A[root] = nxt
+            root += 1
+        else:
+            A[nxt] += A[leaf]
+            leaf += 1
+    A[n - 2] = 0
+    for nxt in range(n - 3, -1, -1):
+        A[nxt] = A[A[nxt]] + 1
+    avbl = 1
+    used = 0
+    dpth = 0
+    root = n - 2
+    nxt = n - 1
+    while avbl > 0:
+        while root >= 0 and A[root] == dpth:
+            used += 1
+            root -= 1
+        while avbl > used:
+            A[nxt] = dpth
+            nxt -= 1
+            avbl -= 1
+        avbl = 2*used
+        dpth += 1
+        used = 0
+
+def huffman_code_lengths(counts: np.ndarray, max_len: int = HUFF_MAX_CODE_LEN) -> np.ndarray:
+    """
+    由各 symbol 出現次數計算 Huffman 碼長 (與 counts 對齊)。
+    超過 max_len 時將次數減半後重算 (極端偏斜分佈才會發生)。
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    n = counts.size
+    if n <= 1:
+        return np.ones(n, dtype=np.int64)
+    order = np.argsort(counts, kind='stable')
+    while True:
+        A = counts[order].copy()
+        _huffman_lengths_inplace(A)
+        if A[0] <= max_len:
+            break
+        counts = (counts + 1) >> 1
+    lengths = np.empty(n, dtype=np.int64)
+    lengths[order] = A
+    return lengths
+
+def symbol_frequencies(values: np.ndarray):
+    """
+    整數陣列 => (遞增 symbols, 出現次數)。值域小時用 bincount，否則用 unique。
+    """
+    values = np.asarray(values).ravel()
+    if values.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    lo = int(values.min())
+    hi = int(values.max())
+    if hi - lo < (1 << 20):
+        counts = np.bincount((values.astype(np.int64) - lo))
+        syms = np.nonzero(counts)[0]
+        return syms + lo, counts[syms]
+    syms, counts = np.unique(values, return_counts=True)
+    return syms.astype(np.int64), counts.astype(np.int64)
+
+class HuffmanCodeTable(NamedTuple):
+    """
+    Canonical Huffman 碼表：只需 (遞增 symbols, 碼長) 即可重建編/解碼器
+    """
+    symbols: np.ndarray
+    lengths: np.ndarray
+    counts: Optional[np.ndarray] = None
+
+def build_huffman_table(values: np.ndarray) -> HuffmanCodeTable:
+    """
+    計數 + 碼長 kernel => HuffmanCodeTable (不建立任何樹節點)
+    """
+    syms, counts = symbol_frequencies(values)
+    return HuffmanCodeTable(syms, huffman_code_lengths(counts), counts)
+
+def print_huffman_stats(label: str, table: HuffmanCodeTable):
+    """
+    印出 entropy / 平均碼長 / 效率 (沿用原本的輸出格式)
+    """
+    total = int(table.counts.sum())
     if total == 0:
+        return
+    p = table.counts / total
+    entropy = float(-(p*np.log2(p)).sum())
+    avg_len = float((table.lengths*table.counts).sum()) / total
+    comp_eff = (entropy/avg_len) if avg_len > 0 else 0
+    print(f"    {label} entropy={entropy:.3f}, avgLen={avg_len:.3f}, eff={comp_eff:.3f}")
+
+HUFF_BLOCK_SYMBOLS = 1 << 16   # 分 block 模式下每個 block 的 symbol 數
+
+def huffman_stream_pack(values: np.ndarray, table: Optional["HuffmanCodeTable"] = None,
+                        block_size: int = 0, sym_idx: Optional[np.ndarray] = None) -> bytes:
+    """
+    自含式 Huffman 串流:
+      碼長標頭 + '<IQI' (symbol 數, 資料 byte 數, block_size)
+      [+ block_size > 0 時: '<I' block 數 + 各 block 結尾 byte offset (uint32)]
+      + 位元資料
+    解碼端只需此 bytes 即可還原；分 block 時各 block 可平行解碼。
+    sym_idx: 已知每個值在 table.symbols (遞增) 中的位置時直接使用，省去查表。
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if table is None:
+        table = build_huffman_table(values)
+    enc = CanonicalHuffmanEncoder(table.symbols, table.lengths)
+    if sym_idx is None:
+        sym_idx = enc.symbol_index(values)
+    if block_size > 0 and values.size > 0:
+        payload, offsets = _huffman_pack_blocks_kernel(sym_idx, enc.codes, enc.lengths, block_size)
+        index = (struct.pack('<I', offsets.size - 1)
+                 + offsets[1:].astype('<u4').tobytes())
+    else:
+        block_size = 0
+        payload, _ = _huffman_pack_kernel(sym_idx, enc.codes, enc.lengths)
+        index = b""
+    return (pack_code_lengths(table.symbols, table.lengths)
+            + struct.pack('<IQI', values.size, payload.size, block_size)
+            + index + payload.tobytes())
+
+def huffman_stream_unpack(data: bytes, pos: int = 0, workers: Optional[int] = None):
+    """
+    解析 huffman_stream_pack 的串流，回傳 (symbols 陣列, 新 pos)
+    """
+    code_syms, code_lens, pos = unpack_code_lengths(data, pos)
+    hs = struct.calcsize('<IQI')
+    count, nbytes, block_size = struct.unpack('<IQI', data[pos:pos+hs])
+    pos += hs
+    offsets = None
+    if block_size > 0:
+        nblocks = struct.unpack('<I', data[pos:pos+4])[0]
+        pos += 4
+        offsets = np.zeros(nblocks + 1, dtype=np.int64)
+        offsets[1:] = np.frombuffer(data, dtype='<u4', count=nblocks, offset=pos)
+        pos += 4*nblocks
+    payload = np.frombuffer(data, dtype=np.uint8, count=nbytes, offset=pos)
+    pos += nbytes
+    if count == 0:
+        return np.empty(0, dtype=np.int64), pos
+    dec = CanonicalHuffmanDecoder(code_syms, code_lens)
+    if offsets is not None:
+        return dec.decode_blocks(payload, offsets, count, block_size, workers), pos
+    return dec.decode(payload, nbytes*8, max_syms=count), pos
+
+
+###############################################################################
+# (1b) rANS 熵編碼 + 可抽換的熵編碼階段
+###############################################################################
+RANS_BYTE_L = 1 << 23   # rANS 狀態下界 (32-bit 狀態、逐 byte renormalize)
+RANS_SCALE_BITS = 15    # 機率精度 (頻率總和 = 2^15)
+RANS_MAX_SCALE_BITS = 16
+RANS_LANES = 4          # 交錯狀態數: 解碼時 4 條相依鏈可平行執行
+
+@njit
+def _rans_encode_kernel(sym_idx: np.ndarray, freqs: np.ndarray, starts: np.ndarray,
+                        scale_bits: int, lanes: int) -> np.ndarray:
+    """
+    交錯 rANS 編碼：第 i 個 symbol 使用狀態 i % lanes，由尾到頭編碼、
+    byte 由 buffer 尾端往前寫；最後依 lanes-1..0 順序 flush 各狀態。
+    """
+    n = sym_idx.shape[0]
+    cap = 2*n + 4*lanes
+    out = np.empty(cap, dtype=np.uint8)
+    ptr = cap
+    states = np.full(lanes, RANS_BYTE_L, dtype=np.int64)
+    x_max_base = (RANS_BYTE_L >> scale_bits) << 8
+    for i in range(n - 1, -1, -1):
+        k = i % lanes
+        s = sym_idx[i]
+        f = freqs[s]
+        x = states[k]
+        x_max = x_max_base*f
+        while x >= x_max:
+            ptr -= 1
+            out[ptr] = x & 0xFF
+            x >>= 8
+        states[k] = ((x // f) << scale_bits) + (x % f) + starts[s]
+    for k in range(lanes - 1, -1, -1):
+        x = states[k]
+        ptr -= 4
+        out[ptr] = x & 0xFF
+        out[ptr+1] = (x >> 8) & 0xFF
+        out[ptr+2] = (x >> 16) & 0xFF
+        out[ptr+3] = (x >> 24) & 0xFF
+    return out[ptr:].copy()
+
+@njit
+def _rans_decode_step(x, freqs, starts, slot2sym, scale_bits, mask, data, p):
+    """
+    單一狀態解一個 symbol 並 renormalize，回傳 (symbol index, 新狀態, 新讀取位置)
+    """
+    slot = x & mask
+    s = np.int64(slot2sym[slot])
+    x = freqs[s]*(x >> scale_bits) + slot - starts[s]
+    nbytes = data.shape[0]
+    while x < RANS_BYTE_L:
+        b = 0
+        if p < nbytes:
+            b = data[p]
+        x = (x << 8) | b
+        p += 1
+    return s, x, p
+
+@njit
+def _rans_decode_kernel(data: np.ndarray, count: int, freqs: np.ndarray, starts: np.ndarray,
+                        slot2sym: np.ndarray, scale_bits: int, lanes: int) -> np.ndarray:
+    """
+    交錯 rANS 解碼：slot (x 的低 scale_bits 位元) 直接查表得 symbol index。
+    lanes == 4 時四個狀態放在區域變數中展開，讓相依鏈彼此重疊。
+    """
+    nbytes = data.shape[0]
+    mask = (1 << scale_bits) - 1
+    out = np.empty(count, dtype=np.int64)
+    states = np.zeros(lanes, dtype=np.int64)
+    p = 0
+    for k in range(lanes):
+        x = 0
+        for j in range(4):
+            if p < nbytes:
+                x |= np.int64(data[p]) << (8*j)
+            p += 1
+        states[k] = x
+    i = 0
+    if lanes == 4:
+        x0 = states[0]
+        x1 = states[1]
+        x2 = states[2]
+        x3 = states[3]
+        while i + 4 <= count:
+            out[i], x0, p = _rans_decode_step(x0, freqs, starts, slot2sym, scale_bits, mask, data, p)
+            out[i+1], x1, p = _rans_decode_step(x1, freqs, starts, slot2sym, scale_bits, mask, data, p)
+            out[i+2], x2, p = _rans_decode_step(x2, freqs, starts, slot2sym, scale_bits, mask, data, p)
+            out[i+3], x3, p = _rans_decode_step(x3, freqs, starts, slot2sym, scale_bits, mask, data, p)
+            i += 4
+        states[0] = x0
+        states[1] = x1
+        states[2] = x2
+        states[3] = x3
+    while i < count:
+        k = i % lanes
+        out[i], states[k], p = _rans_decode_step(states[k], freqs, starts, slot2sym, scale_bits, mask, data, p)
+        i += 1
+    return out
+
+def rans_normalize_freqs(counts: np.ndarray, scale_bits: int) -> np.ndarray:
+    """
+    將出現次數正規化為總和 2^scale_bits 的頻率 (每個出現過的 symbol 至少 1)
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    M = 1 << scale_bits
+    freqs = np.maximum(1, (counts*M) // int(counts.sum()))
+    diff = M - int(freqs.sum())
+    if diff > 0:
+        freqs[np.argmax(counts)] += diff
+    while diff < 0:
+        j = int(np.argmax(freqs))
+        take = min(-diff, int(freqs[j]) - 1)
+        freqs[j] -= take
+        diff += take
+    return freqs
+
+def rans_stream_pack(values: np.ndarray) -> bytes:
+    """
+    自含式 rANS 串流:
+      'BB' (scale_bits, lanes) + 頻率表 (pack_code_lengths 格式) + '<II' (symbol 數, byte 數) + 資料
+    """
+    values = np.asarray(values, dtype=np.int64)
+    syms, counts = symbol_frequencies(values)
+    if syms.size == 0:
+        return (struct.pack('BB', RANS_SCALE_BITS, RANS_LANES)
+                + pack_code_lengths(syms, counts) + struct.pack('<II', 0, 0))
+    scale_bits = max(RANS_SCALE_BITS, int(syms.size).bit_length() + 1)
+    if scale_bits > RANS_MAX_SCALE_BITS:
+        raise ValueError(f"rANS alphabet too large ({syms.size} symbols)")
+    freqs = rans_normalize_freqs(counts, scale_bits)
+    starts = np.concatenate(([0], np.cumsum(freqs)[:-1])).astype(np.int64)
+    sym_idx = np.searchsorted(syms, values)
+    payload = _rans_encode_kernel(sym_idx, freqs, starts, scale_bits, RANS_LANES)
+    return (struct.pack('BB', scale_bits, RANS_LANES)
+            + pack_code_lengths(syms, freqs)
+            + struct.pack('<II', values.size, payload.size)
+            + payload.tobytes())
+
+def rans_stream_unpack(data: bytes, pos: int = 0):
+    """
+    解析 rans_stream_pack 的串流，回傳 (symbols 陣列, 新 pos)
+    """
+    scale_bits, lanes = struct.unpack('BB', data[pos:pos+2])
+    pos += 2
+    syms, freqs, pos = unpack_code_lengths(data, pos)
+    count, nbytes = struct.unpack('<II', data[pos:pos+8])
+    pos += 8
+    payload = np.frombuffer(data, dtype=np.uint8, count=nbytes, offset=pos)
+    pos += nbytes
+    if count == 0:
+        return np.empty(0, dtype=np.int64), pos
+    starts = np.concatenate(([0], np.cumsum(freqs)[:-1])).astype(np.int64)
+    slot2sym = np.repeat(np.arange(syms.size, dtype=np.uint16), freqs)
+    idx = _rans_decode_kernel(payload, count, freqs, starts, slot2sym, scale_bits, lanes)
+    return syms[idx], pos
+
+ENTROPY_HUFFMAN = 0
+ENTROPY_RANS = 1
+ENTROPY_CODERS = {"huffman": ENTROPY_HUFFMAN, "rans": ENTROPY_RANS}
+
+def pack_symbol_stream(values: np.ndarray, entropy: str = "huffman", block_size: int = 0,
+                       codebook: Optional["HuffmanCodebook"] = None) -> bytes:
+    """
+    可抽換的熵編碼階段: 'B' 編碼器 ID + 該編碼器的自含式串流
+    block_size > 0 時 Huffman 串流分 block 並附 offset 索引
+    給定 codebook 時改用共用碼表 (串流只帶 codebook ID，見 (1c))
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if codebook is not None:
+        return struct.pack('B', ENTROPY_CODEBOOK) + codebook_stream_pack(values, codebook)
+    if entropy not in ENTROPY_CODERS:
+        raise ValueError(f"unknown entropy coder: {entropy}")
+    coder_id = ENTROPY_CODERS[entropy]
+    if coder_id == ENTROPY_RANS:
+        return struct.pack('B', coder_id) + rans_stream_pack(values)
+    return struct.pack('B', coder_id) + huffman_stream_pack(values, block_size=block_size)
+
+def unpack_symbol_stream(data: bytes, pos: int = 0, workers: Optional[int] = None,
+                         codebooks: Optional["CodebookCache"] = None):
+    """
+    依串流內的編碼器 ID 解碼，回傳 (symbols 陣列, 新 pos)
+    codebook 串流需由 codebooks (CodebookCache) 依 ID 取回碼表
+    """
+    coder_id = data[pos]
+    pos += 1
+    if coder_id == ENTROPY_RANS:
+        return rans_stream_unpack(data, pos)
+    if coder_id == ENTROPY_HUFFMAN:
+        return huffman_stream_unpack(data, pos, workers)
+    if coder_id == ENTROPY_CODEBOOK:
+        return codebook_stream_unpack(data, pos, codebooks)
+    raise ValueError(f"unknown entropy coder id: {coder_id}")
+
+
+###############################################################################
+# (1c) 共用 codebook: 以訓練幀建立靜態碼表，跨幀/跨場景重用
+###############################################################################
+ENTROPY_CODEBOOK = 2   # 串流只帶 codebook ID，碼表由 CodebookCache 提供
+
+class HuffmanCodebook:
+    """
+    訓練好的靜態 canonical Huffman 碼表。
+    escape 為訓練集外的保留 symbol：未見過的值編成 escape，實際值另存於 escape 子串流。
+    編/解碼器在建立時即準備好，逐幀編碼不再需要計數與建碼長。
+    """
+    def __init__(self, symbols: np.ndarray, lengths: np.ndarray, escape: int):
+        self.symbols = np.asarray(symbols, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.escape = int(escape)
+        self.known = self.symbols[self.symbols != self.escape]
+        self.encoder = CanonicalHuffmanEncoder(self.symbols, self.lengths)
+        self.decoder = CanonicalHuffmanDecoder(self.symbols, self.lengths)
+        self.cb_id = zlib.crc32(self.to_bytes())
+
+    def to_bytes(self) -> bytes:
+        return pack_code_lengths(self.symbols, self.lengths) + struct.pack('<q', self.escape)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HuffmanCodebook":
+        syms, lens, pos = unpack_code_lengths(data, 0)
+        escape = struct.unpack('<q', data[pos:pos+8])[0]
+        return cls(syms, lens, escape)
+
+def train_codebook(samples: List[np.ndarray]) -> HuffmanCodebook:
+    """
+    合併多幀訓練資料計數 => 靜態碼表。
+    escape 取 (最大 symbol + 1)，權重設為訓練集中相異 symbol 數 (至少 1)。
+    """
+    values = (np.concatenate([np.asarray(v, dtype=np.int64).ravel() for v in samples])
+              if samples else np.empty(0, dtype=np.int64))
+    syms, counts = symbol_frequencies(values)
+    escape = int(syms[-1]) + 1 if syms.size else 0
+    syms = np.append(syms, escape)
+    counts = np.append(counts, max(1, syms.size - 1))
+    return HuffmanCodebook(syms, huffman_code_lengths(counts), escape)
+
+def codebook_stream_pack(values: np.ndarray, codebook: HuffmanCodebook) -> bytes:
+    """
+    '<III' (codebook ID, symbol 數, escape 數) + '<Q' 資料 byte 數 + 位元資料
+    [+ escape 數 > 0 時: 未見過的值以自含式 Huffman 串流附加]
+    """
+    values = np.asarray(values, dtype=np.int64)
+    unseen = ~np.isin(values, codebook.known)
+    escaped = values[unseen]
+    if escaped.size:
+        values = np.where(unseen, codebook.escape, values)
+    buf, _ = codebook.encoder.encode(values)
+    out = (struct.pack('<IIIQ', codebook.cb_id, values.size, escaped.size, buf.size)
+           + buf.tobytes())
+    if escaped.size:
+        out += huffman_stream_pack(escaped)
+    return out
+
+def codebook_stream_unpack(data: bytes, pos: int = 0,
+                           codebooks: Optional["CodebookCache"] = None):
+    """
+    解析 codebook_stream_pack 的串流，回傳 (symbols 陣列, 新 pos)
+    """
+    hs = struct.calcsize('<IIIQ')
+    cb_id, count, n_escape, nbytes = struct.unpack('<IIIQ', data[pos:pos+hs])
+    pos += hs
+    codebook = codebooks.by_id(cb_id) if codebooks is not None else None
+    if codebook is None:
+        raise ValueError(f"codebook {cb_id:08x} not available")
+    payload = np.frombuffer(data, dtype=np.uint8, count=nbytes, offset=pos)
+    pos += nbytes
+    if count == 0:
+        return np.empty(0, dtype=np.int64), pos
+    values = codebook.decoder.decode(payload, nbytes*8, max_syms=count)
+    if n_escape:
+        escaped, pos = huffman_stream_unpack(data, pos)
+        values[values == codebook.escape] = escaped
+    return values, pos
+
+class CodebookCache:
+    """
+    以 (method, BE, 子串流名稱) 為 key 的共用 codebook 快取。
+    directory 給定時可 save()/load()：每個碼表存成 <ID>.cb，key 對照表存成 CSV。
+    編碼端與解碼端載入同一份目錄即可只以 ID 互相參照。
+    """
+    INDEX_FILE = "codebooks.csv"
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._by_key: Dict[Tuple[str, float, str], HuffmanCodebook] = {}
+        self._by_id: Dict[int, HuffmanCodebook] = {}
+        if directory and os.path.isfile(os.path.join(directory, self.INDEX_FILE)):
+            self.load()
+
+    @staticmethod
+    def _key(method: str, be_cm: float, stream: str):
+        return (method, round(float(be_cm), 6), stream)
+
+    def put(self, method: str, be_cm: float, stream: str, codebook: HuffmanCodebook):
+        self._by_key[self._key(method, be_cm, stream)] = codebook
+        self._by_id[codebook.cb_id] = codebook
+
+    def get(self, method: str, be_cm: float, stream: str) -> Optional[HuffmanCodebook]:
+        return self._by_key.get(self._key(method, be_cm, stream))
+
+    def get_streams(self, method: str, be_cm: float, streams) -> Optional[List[HuffmanCodebook]]:
+        """
+        一次取回多個子串流的 codebook；任一缺少則回傳 None (退回逐幀建表)
+        """
+        cbs = [self.get(method, be_cm, s) for s in streams]
+        return None if any(cb is None for cb in cbs) else cbs
+
+    def by_id(self, cb_id: int) -> Optional[HuffmanCodebook]:
+        return self._by_id.get(cb_id)
+
+    def train(self, method: str, be_cm: float, streams, frames) -> List[HuffmanCodebook]:
+        """
+        frames: 每幀一個 tuple，依 streams 順序放各子串流的 symbols
+        """
+        cbs = []
+        for i, stream in enumerate(streams):
+            cb = train_codebook([f[i] for f in frames])
+            self.put(method, be_cm, stream, cb)
+            cbs.append(cb)
+        return cbs
+
+    def save(self, directory: Optional[str] = None):
+        directory = directory or self.directory
+        os.makedirs(directory, exist_ok=True)
+        for cb_id, cb in self._by_id.items():
+            with open(os.path.join(directory, f"{cb_id:08x}.cb"), 'wb') as f:
+                f.write(cb.to_bytes())
+        with open(os.path.join(directory, self.INDEX_FILE), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['method', 'be_cm', 'stream', 'id'])
+            for (method, be_cm, stream), cb in self._by_key.items():
+                writer.writerow([method, be_cm, stream, f"{cb.cb_id:08x}"])
+
+    def load(self, directory: Optional[str] = None):
+        directory = directory or self.directory
+        with open(os.path.join(directory, self.INDEX_FILE), newline='') as f:
+            for row in csv.DictReader(f):
+                cb_id = int(row['id'], 16)
+                cb = self._by_id.get(cb_id)
+                if cb is None:
+                    with open(os.path.join(directory, f"{row['id']}.cb"), 'rb') as g:
+                        cb = HuffmanCodebook.from_bytes(g.read())
+                self.put(row['method'], float(row['be_cm']), row['stream'], cb)
+
+
+###############################################################################
+# (1d) 分段串流: 整幀共用碼表 + 區塊 offset 索引 (ROI 隨機存取用)
+###############################################################################
+ROI_INDEX_LEVELS = 2   # 區塊索引切在第 2 層: 最多 64 棵子樹各自成一個可跳過的區塊
+
+def check_indexed_entropy(entropy: str):
+    """
+    區塊索引格式的各區塊固定使用整幀 canonical Huffman 碼表；指定其他編碼器時直接報錯，
+    不默默改用 Huffman
+    """
+    if entropy != "huffman":
+        raise ValueError(f"indexed block streams only support entropy='huffman', got {entropy!r}")
+
+def pack_indexed_blocks(blocks: List[Tuple[np.ndarray, ...]], n_streams: int) -> bytes:
+    """
+    多個區塊 (例如各子樹)，每個區塊有 n_streams 個整數串流:
+      'BI' (串流數, 區塊數) + 每個串流一張整幀 canonical Huffman 碼表 (pack_code_lengths)
+      + 各區塊結尾 byte offset (uint32)
+      + 各區塊: 每個串流 '<II' (symbol 數, 位元數) + 位元資料
+    碼表只存一次；每個區塊可單獨定位、單獨解碼
+    """
+    encoders = []
+    header = bytearray(struct.pack('<BI', n_streams, len(blocks)))
+    for k in range(n_streams):
+        vals = [np.asarray(b[k], dtype=np.int64) for b in blocks]
+        table = build_huffman_table(np.concatenate(vals) if vals else np.empty(0, dtype=np.int64))
+        header.extend(pack_code_lengths(table.symbols, table.lengths))
+        encoders.append(CanonicalHuffmanEncoder(table.symbols, table.lengths)
+                        if table.symbols.size else None)
+    body = bytearray()
+    ends = np.empty(len(blocks), dtype='<u4')
+    for j, blk in enumerate(blocks):
+        for k in range(n_streams):
+            vals = np.asarray(blk[k], dtype=np.int64)
+            if vals.size == 0:
+                body.extend(struct.pack('<II', 0, 0))
+                continue
+            payload, nbits = encoders[k].encode(vals)
+            body.extend(struct.pack('<II', vals.size, nbits) + payload.tobytes())
+        ends[j] = len(body)
+    return bytes(header) + ends.tobytes() + bytes(body)
+
+class IndexedBlockReader:
+    """
+    pack_indexed_blocks 的讀取端: 只解析碼表與 offset 索引，block(j) 時才解碼該區塊
+    """
+    def __init__(self, data: bytes, pos: int = 0):
+        n_streams, n_blocks = struct.unpack('<BI', data[pos:pos+5])
+        pos += 5
+        self.decoders = []
+        for _ in range(n_streams):
+            syms, lens, pos = unpack_code_lengths(data, pos)
+            self.decoders.append(CanonicalHuffmanDecoder(syms, lens) if syms.size else None)
+        ends = np.frombuffer(data, dtype='<u4', count=n_blocks, offset=pos).astype(np.int64)
+        pos += 4*n_blocks
+        self.data = data
+        self.starts = pos + np.concatenate(([0], ends[:-1])) if n_blocks else ends
+        self.end = pos + (int(ends[-1]) if n_blocks else 0)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def block(self, j: int) -> List[np.ndarray]:
+        pos = int(self.starts[j])
+        out = []
+        for dec in self.decoders:
+            count, nbits = struct.unpack('<II', self.data[pos:pos+8])
+            pos += 8
+            nbytes = (nbits + 7) >> 3
+            if count == 0:
+                out.append(np.empty(0, dtype=np.int64))
+                continue
+            payload = np.frombuffer(self.data, dtype=np.uint8, count=nbytes, offset=pos)
+            pos += nbytes
+            out.append(dec.decode(payload, nbits, max_syms=count))
+        return out
+
+
+###############################################################################
+# (2) Huffman (Method 1) - 無誤差
+###############################################################################
+def huffman_encoding(data_bytes: bytes):
+    data= np.frombuffer(data_bytes, dtype=np.uint8)
+    if data.size == 0:
         bits= bitarray()
         return bits, None
-    entropy= -sum((v/total)* math.log2(v/total) for v in freq.values())
-    tree= build_huffman_tree(freq)
-    code_dict= build_encoding_dict(tree)
-    avg_len= sum(len(code_dict[b])*freq[b] for b in freq)/ total
-    comp_eff= (entropy/avg_len) if avg_len>0 else 0
-    print(f"    Huffman entropy={entropy:.3f}, avgLen={avg_len:.3f}, eff={comp_eff:.3f}")
-
-    bits= bitarray()
-    for b in data_bytes:
-        bits.extend(code_dict[b])
-    return bits, tree
-
-def huffman_decoding(encoded_bits: bitarray, tree: Optional[HuffmanNodeTree])-> bytes:
-    if (not encoded_bits) or (not tree):
+    table= build_huffman_table(data)
+    print_huffman_stats("Huffman", table)
+
+    enc= CanonicalHuffmanEncoder(table.symbols, table.lengths)
+    buf, nbits= enc.encode(data)
+    return bitarray_from_buffer(buf, nbits), table
+
+def huffman_decoding(encoded_bits: bitarray, table: Optional[HuffmanCodeTable])-> bytes:
+    if (not encoded_bits) or (table is None):
         return b""
-    # 如果只有單一節點
-    if (tree.left is None) and (tree.right is None):
-        return bytes([tree.char]* len(encoded_bits))
-    out= bytearray()
-    node= tree
-    for bit in encoded_bits:
-        node= node.left if bit==0 else node.right
-        if not node:
-            break
-        if (node.left is None) and (node.right is None):
-            out.append(node.char)
-            node= tree
-            if not node:
-                break
-    return bytes(out)
+    # canonical 查表解碼 (單一 symbol 時碼為 '0'，同樣適用)
+    dec= CanonicalHuffmanDecoder(table.symbols, table.lengths)
+    syms= dec.decode(encoded_bits.tobytes(), len(encoded_bits))
+    return syms.astype(np.uint8).tobytes()
+
+HUFFMAN_STREAMS = ("bytes",)   # Method 1 在 CodebookCache 中的子串流名稱 (BE 固定為 0)
+
+def huffman_encoding_stream(data_bytes: bytes, block_size: int = 0,
+                            codebook: Optional[HuffmanCodebook] = None) -> bytes:
+    """
+    自含式 Huffman bytes ('B' 編碼器 ID + 碼長表 + 資料)；
+    block_size > 0 時分 block 並附 offset 索引；給定 codebook 時只帶 codebook ID
+    """
+    data= np.frombuffer(data_bytes, dtype=np.uint8)
+    if codebook is not None:
+        return pack_symbol_stream(data, codebook=codebook)
+    table= build_huffman_table(data)
+    if data.size:
+        print_huffman_stats("Huffman", table)
+    return struct.pack('B', ENTROPY_HUFFMAN)+ huffman_stream_pack(data, table, block_size)
+
+def huffman_decoding_stream(data: bytes, workers: Optional[int] = None,
+                            codebooks: Optional[CodebookCache] = None) -> bytes:
+    syms, _= unpack_symbol_stream(data, 0, workers, codebooks)
+    return syms.astype(np.uint8).tobytes()
 
 
 ###############################################################################
 # (3) EB-HC(Axis/L2) => 1D threshold + Huffman
 ###############################################################################
+@njit(nogil=True)
+def _merge_sorted_kernel(idx_s: np.ndarray, svals: np.ndarray, threshold_int: int):
+    """
+    已排序的值依序合併: 與目前代表值相差 <= threshold_int 者沿用代表值，否則自成新代表值。
+    結果直接依 idx_s 寫回原點順序，回傳
+      (每點代表值, 每點群組編號, 相異代表值, 各群點數)
+    """
+    n = svals.shape[0]
+    rep = np.empty(n, dtype=svals.dtype)
+    gid = np.empty(n, dtype=np.int64)
+    uniq = np.empty(n, dtype=svals.dtype)
+    counts = np.zeros(n, dtype=np.int64)
+    curr = svals[0]
+    g = 0
+    uniq[0] = curr
+    for i in range(n):
+        v = svals[i]
+        if abs(v - curr) > threshold_int:
+            curr = v
+            g += 1
+            uniq[g] = curr
+        j = idx_s[i]
+        rep[j] = curr
+        gid[j] = g
+        counts[g] += 1
+    return rep, gid, uniq[:g+1], counts[:g+1]
+
+def merge_sorted_by_threshold(idx_s: np.ndarray, svals: np.ndarray, threshold_int: int,
+                              return_index: bool = False):
+    """
+    在已排序的 (argsort 索引, 排序後值) 上合併，回傳同 merge_ints_by_threshold。
+    同一軸的排序可供多個 threshold 重複使用 (kernel 為 nogil，可在 thread pool 上平行)。
+    return_index=True 時另回傳每點的群組編號 (= 代表值在相異代表值中的位置)。
+    """
+    if svals.size==0:
+        empty= (svals.copy(), svals.copy(), np.empty(0, dtype=np.int64))
+        return empty+ (np.empty(0, dtype=np.int64),) if return_index else empty
+    rep, gid, reps, counts= _merge_sorted_kernel(idx_s, svals, threshold_int)
+    if not return_index:
+        return rep, reps, counts
+    return rep, reps, counts, gid
+
 def merge_ints_by_threshold(arr: np.ndarray, threshold_int: int):
     """
     將 arr 中值 (int) 依 threshold_int 相近合併
+    回傳 (每點代表值陣列, 相異代表值 (遞增), 各代表值點數)
+    (相同值必落在同一群，與原 dict 版 val2rep 的對應一致)
     """
-    if len(arr)==0:
-        return {}, {}
-    idx_s= np.argsort(arr)
-    svals= arr[idx_s]
-    freq={}
-    map_dict={}
-    curr= svals[0]
-    freq[curr]=1
-    map_dict[idx_s[0]]= curr
-    for i in range(1, len(svals)):
-        v= svals[i]
-        idx= idx_s[i]
-        if abs(v - curr) <= threshold_int:
-            freq[curr]+=1
-            map_dict[idx]= curr
-        else:
-            curr= v
-            freq[curr]=1
-            map_dict[idx]= curr
-    val2rep={}
-    for i in range(len(arr)):
-        orgv= arr[i]
-        rep= map_dict[i]
-        val2rep[orgv]= rep
-    return freq, val2rep
-
-def build_huffman_encode_1d(data_list: List[int]):
-    """
-    對 1D 資料列表 (int) 做 Huffman 編碼
-    回傳編碼後 bits 及 Huffman 樹
-    """
-    freq={}
-    for v in data_list:
-        freq[v]= freq.get(v,0)+1
-    total= sum(freq.values())
-    if total==0:
-        from bitarray import bitarray
-        return bitarray(), None
-    entropy= -sum((v/total)* math.log2(v/total) for v in freq.values())
-    tree= build_huffman_tree(freq)
-    code_dict= build_encoding_dict(tree)
-    avg_len= sum(len(code_dict[v])*freq[v] for v in freq)/ total
-    comp_eff= (entropy/avg_len) if avg_len>0 else 0
-    print(f"    Huffman(EB-HC) Entropy={entropy:.3f}, avgLen={avg_len:.3f}, eff={comp_eff:.3f}")
-
-    from bitarray import bitarray
-    bits= bitarray()
-    for v in data_list:
-        bits.extend(code_dict[v])
-    return bits, tree
-
-def ebhc_encode_axis(qpts: np.ndarray, be_cm=10.0, scale_factor=1000):
+    arr= np.asarray(arr)
+    idx_s= np.argsort(arr, kind='stable')
+    return merge_sorted_by_threshold(idx_s, arr[idx_s], threshold_int)
+
+EBHC_STREAMS = ("x", "y", "z")   # EB-HC 各軸子串流名稱
+
+def ebhc_axis_threshold(be_cm: float, scale_factor=1000) -> int:
     """
-    EB-HC(Axis) 實作：
-      - threshold_int = floor((be_cm*scale_factor)/100.0) / 1.65
-      - 分別對 X, Y, Z 合併後 Huffman
+    EB-HC(Axis): threshold_int = floor((be_cm*scale_factor)/100.0) / 1.65
     """
     k=1.65  # 原程式中用於縮小 threshold
-    thresh= int(math.floor(be_cm*scale_factor /(100.0*k)))
+    return int(math.floor(be_cm*scale_factor /(100.0*k)))
+
+def ebhc_l2_threshold(be_cm: float, scale_factor=1000) -> int:
+    """
+    EB-HC(L2): threshold_int = floor((be_cm*scale_factor)/(100*sqrt(3)))
+    """
+    return int(math.floor(be_cm*scale_factor /100.0 /math.sqrt(3)))
+
+# bound => (threshold 函式, CodebookCache 中的 method 名稱)
+EBHC_BOUNDS = {
+    "axis": (ebhc_axis_threshold, "EB-HC(Axis)"),
+    "l2": (ebhc_l2_threshold, "EB-HC(L2)"),
+}
+
+def ebhc_axis_symbols(qpts: np.ndarray, be_cm=10.0, scale_factor=1000):
+    """
+    EB-HC(Axis) 各軸合併後的 symbols (x_syms, y_syms, z_syms)
+    """
+    thresh= ebhc_axis_threshold(be_cm, scale_factor)
     arrX= qpts[:,0]
     arrY= qpts[:,1]
     arrZ= qpts[:,2]
     # X
-    xfreq, xmap= merge_ints_by_threshold(arrX, thresh)
-    x_syms= [xmap[v] for v in arrX]
-    x_enc, x_tree= build_huffman_encode_1d(x_syms)
+    x_syms, _, _= merge_ints_by_threshold(arrX, thresh)
     # Y
-    yfreq, ymap= merge_ints_by_threshold(arrY, thresh)
-    y_syms= [ymap[v] for v in arrY]
-    y_enc, y_tree= build_huffman_encode_1d(y_syms)
+    y_syms, _, _= merge_ints_by_threshold(arrY, thresh)
     # Z
-    zfreq, zmap= merge_ints_by_threshold(arrZ, thresh)
-    z_syms= [zmap[v] for v in arrZ]
-    z_enc, z_tree= build_huffman_encode_1d(z_syms)
+    z_syms, _, _= merge_ints_by_threshold(arrZ, thresh)
+    return x_syms, y_syms, z_syms
+
+def ebhc_encode_axis(qpts: np.ndarray, be_cm=10.0, scale_factor=1000, block_size: int = 0):
+    """
+    EB-HC(Axis) 實作：
+      - 分別對 X, Y, Z 合併後 Huffman (見 ebhc_axis_symbols)
+      - 回傳自含式 bytes (含碼長表)，ebhc_decode_axis 只需此 bytes
+      - block_size > 0 時各軸 Huffman 串流分 block，解碼可平行
+    """
+    return ebhc_encode_batch(qpts, [be_cm], scale_factor, "axis", block_size)[0]
+
+EBHC_AXIS_WORKERS = 3   # X/Y/Z 三條管線各一個 thread
 
-    hdr= struct.pack('III', len(x_enc), len(y_enc), len(z_enc))
-    from bitarray import bitarray
-    bits= bitarray()
-    bits.extend(x_enc)
-    bits.extend(y_enc)
-    bits.extend(z_enc)
-    return hdr+ bits.tobytes(), (x_tree,y_tree,z_tree)
+EBHC_LAYOUT_VALUE = 0   # 每點直接編代表值 (碼表含所有相異的大整數)
+EBHC_LAYOUT_DICT = 1    # 相異代表值 delta 字典 + 每點字典索引 (字母表 0..K-1)
+EBHC_LAYOUTS = {"value": EBHC_LAYOUT_VALUE, "dict": EBHC_LAYOUT_DICT}
 
-def decode_1d_axis(bits: bitarray, tree: Optional[HuffmanNodeTree]) -> List[int]:
+def _ebhc_axis_map(fn, items, workers: Optional[int]):
     """
-    用 HuffmanNodeTree 解碼 1D 資料 (bits)
+    對 X/Y/Z 三軸平行執行 fn (主要工作在 nogil kernel 內)；workers == 1 時逐軸執行
     """
-    if (not bits) or (not tree):
-        return []
-    if (tree.left is None) and (tree.right is None):
-        return [tree.char]* len(bits)
-    out=[]
-    node= tree
-    for b in bits:
-        node= node.left if b==0 else node.right
-        if (node.left is None) and (node.right is None):
-            out.append(node.char)
-            node= tree
-    return out
+    if workers == 1:
+        return [fn(*it) for it in items]
+    with ThreadPoolExecutor(max_workers=min(EBHC_AXIS_WORKERS, workers or EBHC_AXIS_WORKERS)) as ex:
+        return list(ex.map(lambda it: fn(*it), items))
 
-def ebhc_decode_axis(encoded_data: bytes, trees, N:int)-> np.ndarray:
-    x_tree,y_tree,z_tree= trees
-    hs= struct.calcsize('III')
-    x_len, y_len, z_len= struct.unpack('III', encoded_data[:hs])
-    data_bits= encoded_data[hs:]
-    from bitarray import bitarray
-    bits= bitarray()
-    bits.frombytes(data_bits)
-
-    x_bits= bits[:x_len]
-    y_bits= bits[x_len:x_len+y_len]
-    z_bits= bits[x_len+y_len:x_len+y_len+z_len]
-
-    x_ids= decode_1d_axis(x_bits, x_tree)
-    y_ids= decode_1d_axis(y_bits, y_tree)
-    z_ids= decode_1d_axis(z_bits, z_tree)
-    out= np.zeros((N,3), dtype=np.int32)
-    for i in range(N):
-        out[i,0]= x_ids[i] if i<len(x_ids) else 0
-        out[i,1]= y_ids[i] if i<len(y_ids) else 0
-        out[i,2]= z_ids[i] if i<len(z_ids) else 0
+def _ebhc_axis_stream(syms, block_size: int, table: Optional[HuffmanCodeTable],
+                      sym_idx: Optional[np.ndarray]):
+    """
+    單軸 symbol stream => ('B' 編碼器 ID + 自含式 Huffman 串流, 碼表)
+    """
+    syms= np.asarray(syms, dtype=np.int64)
+    if table is None:
+        table= build_huffman_table(syms)
+    return (struct.pack('B', ENTROPY_HUFFMAN)
+            + huffman_stream_pack(syms, table, block_size, sym_idx)), table
+
+def _ebhc_join_axes(N: int, parts, layout: int = EBHC_LAYOUT_VALUE) -> bytes:
+    """
+    'B' layout + '<I' N + '<III' 三軸串流長度 + X/Y/Z 串流 (解碼端可依長度直接跳到各軸起點)
+    """
+    for _, table in parts:
+        if table is not None and table.counts is not None and table.counts.size:
+            print_huffman_stats("Huffman(EB-HC)", table)
+    return (struct.pack('<BIIII', layout, N, *(len(p) for p, _ in parts))
+            + b"".join(p for p, _ in parts))
+
+def _ebhc_merge_axis_job(idx_s: np.ndarray, svals: np.ndarray, thresh: int, block_size: int,
+                         layout: int = EBHC_LAYOUT_VALUE):
+    """
+    單軸合併 + 編碼:
+      value: 每點代表值的 symbol stream
+      dict : 代表值 delta 字典 (第一項為代表值本身) 的 symbol stream + 每點字典索引的 symbol stream
+    """
+    rep, reps, counts, gid= merge_sorted_by_threshold(idx_s, svals, thresh, True)
+    if layout == EBHC_LAYOUT_DICT:
+        reps= reps.astype(np.int64)
+        deltas= np.diff(reps, prepend=np.int64(0))
+        table= HuffmanCodeTable(np.arange(reps.size, dtype=np.int64),
+                                huffman_code_lengths(counts), counts)
+        stream, table= _ebhc_axis_stream(gid, block_size, table, gid)
+        return pack_symbol_stream(deltas)+ stream, table
+    table= HuffmanCodeTable(reps.astype(np.int64), huffman_code_lengths(counts), counts)
+    return _ebhc_axis_stream(rep, block_size, table, gid)
+
+def _argsort_axis(col: np.ndarray):
+    idx_s= np.argsort(col, kind='stable')
+    return idx_s, col[idx_s]
+
+def ebhc_encode_batch(qpts: np.ndarray, be_list, scale_factor=1000, bound: str = "axis",
+                      block_size: int = 0, workers: Optional[int] = None,
+                      layout: str = "value") -> List[bytes]:
+    """
+    批次 EB-HC (sort once, sweep many):
+      - X/Y/Z 各只 argsort 一次，be_list 中每個 BE 的合併都在同一排序上完成
+      - 合併結果直接給出相異代表值與點數 => 碼表不必再計數
+      - threshold_int 相同的 BE 直接共用同一串流
+      - 三軸的排序 / 合併 / 編碼在 thread pool 上平行 (workers=1 則逐軸)
+    bound : "axis" 或 "l2"；回傳與 be_list 一一對應的 bytes (格式同 ebhc_encode_axis/l2)
+    layout: "value" (每點代表值) 或 "dict" (delta 字典 + 每點索引，方法名稱 EB-HC-Dict(...))
+    各軸一律逐幀建表 (不用共用 codebook): value 的字母表是絕對座標 (mm)、dict 的索引
+    對應每幀不同的字典，幀間統計都不穩定，共用碼表會讓大多數 symbol 走 escape
+    """
+    if layout not in EBHC_LAYOUTS:
+        raise ValueError(f"unknown EB-HC layout: {layout}")
+    layout_id= EBHC_LAYOUTS[layout]
+    thresh_fn, _= EBHC_BOUNDS[bound]
+    sorted_axes= _ebhc_axis_map(_argsort_axis, [(qpts[:,c],) for c in range(3)], workers)
+    streams= []
+    done= {}
+    for be_cm in be_list:
+        thresh= thresh_fn(be_cm, scale_factor)
+        if thresh not in done:
+            items= [(idx_s, svals, thresh, block_size, layout_id) for idx_s, svals in sorted_axes]
+            done[thresh]= _ebhc_join_axes(len(qpts), _ebhc_axis_map(_ebhc_merge_axis_job, items, workers),
+                                          layout_id)
+        streams.append(done[thresh])
+    return streams
+
+def ebhc_unpack_axes(encoded_data: bytes, workers: Optional[int] = None,
+                     codebooks: Optional[CodebookCache] = None):
+    """
+    解析 ebhc_encode_batch 串流 => (N, x_ids, y_ids, z_ids)，只需 bytes (與共用 codebook)
+    依標頭中的三軸長度算出各軸起點，三軸平行解碼 (workers=1 則逐軸)
+    dict layout 先解 delta 字典再以每點索引查表
+    """
+    hs= struct.calcsize('<BIIII')
+    layout, N, *lens= struct.unpack('<BIIII', encoded_data[:hs])
+    starts= np.cumsum([hs]+ lens[:2]).tolist()
+
+    def decode_axis(pos):
+        if layout == EBHC_LAYOUT_DICT:
+            deltas, pos= unpack_symbol_stream(encoded_data, pos)
+            gid, _= unpack_symbol_stream(encoded_data, pos, workers, codebooks)
+            return np.cumsum(deltas)[gid]
+        return unpack_symbol_stream(encoded_data, pos, workers, codebooks)[0]
+    x_ids, y_ids, z_ids= _ebhc_axis_map(decode_axis, [(p,) for p in starts], workers)
+    return N, x_ids, y_ids, z_ids
+
+def ebhc_assemble_points(N: int, x_ids: np.ndarray, y_ids: np.ndarray, z_ids: np.ndarray) -> np.ndarray:
+    """
+    三軸解碼結果直接寫入 (N,3) int32 陣列 (Axis/L2 共用)。
+    長度不符時: 較長的軸截到 N，較短的軸不足部分補 0 (與原逐點版本相同)。
+    """
+    out= np.empty((N,3), dtype=np.int32)
+    for col, ids in enumerate((x_ids, y_ids, z_ids)):
+        m= min(N, len(ids))
+        out[:m,col]= ids[:m]
+        if m<N:
+            out[m:,col]= 0
     return out
 
-def ebhc_encode_l2(qpts: np.ndarray, be_cm=10.0, scale_factor=1000):
+def ebhc_decode_axis(encoded_data: bytes, workers: Optional[int] = None,
+                     codebooks: Optional[CodebookCache] = None)-> np.ndarray:
+    N, x_ids, y_ids, z_ids= ebhc_unpack_axes(encoded_data, workers, codebooks)
+    return ebhc_assemble_points(N, x_ids, y_ids, z_ids)
+
+def ebhc_l2_symbols(qpts: np.ndarray, be_cm=10.0, scale_factor=1000):
     """
-    EB-HC(L2) 實作:
-      - threshold_int = floor((be_cm*scale_factor)/(100*sqrt(3)))
-      - 同樣對 X,Y,Z 分別 Huffman
+    EB-HC(L2) 各軸合併後的 symbols (x_syms, y_syms, z_syms)
     """
-    thresh= int(math.floor(be_cm*scale_factor /100.0 /math.sqrt(3)))
+    thresh= ebhc_l2_threshold(be_cm, scale_factor)
     arrX= qpts[:,0]
     arrY= qpts[:,1]
     arrZ= qpts[:,2]
-    xfreq, xmap= merge_ints_by_threshold(arrX, thresh)
-    x_syms= [xmap[v] for v in arrX]
-    x_enc, x_tree= build_huffman_encode_1d(x_syms)
-
-    yfreq, ymap= merge_ints_by_threshold(arrY, thresh)
-    y_syms= [ymap[v] for v in arrY]
-    y_enc, y_tree= build_huffman_encode_1d(y_syms)
-
-    zfreq, zmap= merge_ints_by_threshold(arrZ, thresh)
-    z_syms= [zmap[v] for v in arrZ]
-    z_enc, z_tree= build_huffman_encode_1d(z_syms)
-
-    hdr= struct.pack('III', len(x_enc), len(y_enc), len(z_enc))
-    from bitarray import bitarray
-    bits= bitarray()
-    bits.extend(x_enc)
-    bits.extend(y_enc)
-    bits.extend(z_enc)
-    return hdr+ bits.tobytes(), (x_tree,y_tree,z_tree)
-
-def ebhc_decode_l2(encoded_data: bytes, trees, N:int)-> np.ndarray:
-    x_tree,y_tree,z_tree= trees
-    hs= struct.calcsize('III')
-    x_len, y_len, z_len= struct.unpack('III', encoded_data[:hs])
-    data_bits= encoded_data[hs:]
-    from bitarray import bitarray
-    bits= bitarray()
-    bits.frombytes(data_bits)
-
-    x_bits= bits[:x_len]
-    y_bits= bits[x_len:x_len+y_len]
-    z_bits= bits[x_len+y_len:x_len+y_len+z_len]
-
-    x_ids= decode_1d_axis(x_bits, x_tree)
-    y_ids= decode_1d_axis(y_bits, y_tree)
-    z_ids= decode_1d_axis(z_bits, z_tree)
-    out= np.zeros((N,3), dtype=np.int32)
-    for i in range(N):
-        out[i,0]= x_ids[i] if i<len(x_ids) else 0
-        out[i,1]= y_ids[i] if i<len(y_ids) else 0
-        out[i,2]= z_ids[i] if i<len(z_ids) else 0
-    return out
+    x_syms, _, _= merge_ints_by_threshold(arrX, thresh)
+    y_syms, _, _= merge_ints_by_threshold(arrY, thresh)
+    z_syms, _, _= merge_ints_by_threshold(arrZ, thresh)
+    return x_syms, y_syms, z_syms
+
+def ebhc_encode_l2(qpts: np.ndarray, be_cm=10.0, scale_factor=1000, block_size: int = 0):
+    """
+    EB-HC(L2) 實作:
+      - 同樣對 X,Y,Z 分別 Huffman (見 ebhc_l2_symbols)
+      - 回傳自含式 bytes (含碼長表)，ebhc_decode_l2 只需此 bytes
+      - block_size > 0 時各軸 Huffman 串流分 block，解碼可平行
+    """
+    return ebhc_encode_batch(qpts, [be_cm], scale_factor, "l2", block_size)[0]
+
+def ebhc_decode_l2(encoded_data: bytes, workers: Optional[int] = None,
+                   codebooks: Optional[CodebookCache] = None)-> np.ndarray:
+    N, x_ids, y_ids, z_ids= ebhc_unpack_axes(encoded_data, workers, codebooks)
+    return ebhc_assemble_points(N, x_ids, y_ids, z_ids)
 
 
 ###############################################################################
 # (4) EB-Octree(Axis)/(L2)
 ###############################################################################
-@njit
-def partition_points(points: np.ndarray, cx: float, cy: float, cz: float):
-    """
-    將 points 按 xyz 與 (cx,cy,cz) 比較拆成 8 個子集合 => octree
-    回傳 out0~out7 (8個子集合)
-    """
-    n= points.shape[0]
-    counts= np.zeros(8, dtype=numba.int32)
-    for i in range(n):
-        px= points[i,0]
-        py= points[i,1]
-        pz= points[i,2]
-        idx=0
-        if px>=cx: idx|=1
-        if py>=cy: idx|=2
-        if pz>=cz: idx|=4
-        counts[idx]+=1
-
-    out0= np.empty((counts[0],3), dtype=numba.float64)
-    out1= np.empty((counts[1],3), dtype=numba.float64)
-    out2= np.empty((counts[2],3), dtype=numba.float64)
-    out3= np.empty((counts[3],3), dtype=numba.float64)
-    out4= np.empty((counts[4],3), dtype=numba.float64)
-    out5= np.empty((counts[5],3), dtype=numba.float64)
-    out6= np.empty((counts[6],3), dtype=numba.float64)
-    out7= np.empty((counts[7],3), dtype=numba.float64)
-
-    ptr= np.zeros(8, dtype=numba.int32)
-    for i in range(n):
-        px= points[i,0]
-        py= points[i,1]
-        pz= points[i,2]
-        idx=0
-        if px>=cx: idx|=1
-        if py>=cy: idx|=2
-        if pz>=cz: idx|=4
-        c= ptr[idx]
-        if idx==0: out0[c,0]= px; out0[c,1]= py; out0[c,2]= pz
-        elif idx==1: out1[c,0]= px; out1[c,1]= py; out1[c,2]= pz
-        elif idx==2: out2[c,0]= px; out2[c,1]= py; out2[c,2]= pz
-        elif idx==3: out3[c,0]= px; out3[c,1]= py; out3[c,2]= pz
-        elif idx==4: out4[c,0]= px; out4[c,1]= py; out4[c,2]= pz
-        elif idx==5: out5[c,0]= px; out5[c,1]= py; out5[c,2]= pz
-        elif idx==6: out6[c,0]= px; out6[c,1]= py; out6[c,2]= pz
-        else:        out7[c,0]= px; out7[c,1]= py; out7[c,2]= pz
-        ptr[idx]+=1
-    return out0,out1,out2,out3,out4,out5,out6,out7
-
 class EntropyCompressor:
     """
-    簡易 zlib + struct.pack, 用於將 int list 壓縮 / 解壓
+    簡易 zlib + int32 bytes, 用於將 int list 壓縮 / 解壓
     """
     def encode(self, arr: List[int])-> bytes:
-        raw= struct.pack(f"{len(arr)}i", *arr)
+        raw= np.asarray(arr, dtype=np.int32).tobytes()
         return zlib.compress(raw)
 
     def decode(self, data: bytes)-> List[int]:
@@ -411,243 +1399,549 @@ class EntropyCompressor:
         n= len(d)//4
         return list(struct.unpack(f"{n}i", d))
 
+    def decode_array(self, data: bytes)-> np.ndarray:
+        """
+        同 decode，但直接回傳 int32 陣列 (不產生 Python int 物件)
+        """
+        if not data:
+            return np.empty(0, dtype=np.int32)
+        d= zlib.decompress(data)
+        return np.frombuffer(d, dtype=np.int32, count=len(d)//4)
+
 @njit
-def min_per_axis(pts: np.ndarray):
+def _eb_octree_count_leaves(tree_blocks: np.ndarray, n_center: int) -> int:
     """
-    返回 (minx, miny, minz)
+    驗證前序 mask 串流並計算可還原的葉數 (與原 stack 走訪的停止條件相同):
+      - 待走訪節點數歸零、tree_blocks 用完、或 center 不足 3 個時停止
+    葉依串流順序對應 center_blocks 的連續三元組
     """
-    n= pts.shape[0]
-    if n==0:
-        return (0.0,0.0,0.0)
-    m0=1e30
-    m1=1e30
-    m2=1e30
-    for i in range(n):
-        px= pts[i,0]
-        py= pts[i,1]
-        pz= pts[i,2]
-        if px<m0: m0=px
-        if py<m1: m1=py
-        if pz<m2: m2=pz
-    return (m0,m1,m2)
+    pending= 1
+    leaves= 0
+    for iT in range(tree_blocks.shape[0]):
+        if pending==0:
+            break
+        pending-= 1
+        v= tree_blocks[iT]
+        if v==0:
+            if 3*(leaves+1)> n_center:
+                break
+            leaves+= 1
+        else:
+            for c in range(8):
+                if (v>>c)&1:
+                    pending+= 1
+    return leaves
 
-@njit
-def max_per_axis(pts: np.ndarray):
+def eb_octree_leaf_centers(tree_blocks: np.ndarray, center_blocks: np.ndarray,
+                           scale_factor: float) -> np.ndarray:
     """
-    返回 (maxx, maxy, maxz)
+    EB-Octree 解壓只需葉 center: 以 kernel 驗證 mask 串流後，center 區塊直接 reshape 成 (N,3)
     """
-    n= pts.shape[0]
-    if n==0:
-        return (0.0,0.0,0.0)
-    m0=-1e30
-    m1=-1e30
-    m2=-1e30
-    for i in range(n):
-        px= pts[i,0]
-        py= pts[i,1]
-        pz= pts[i,2]
-        if px>m0: m0=px
-        if py>m1: m1=py
-        if pz>m2: m2=pz
-    return (m0,m1,m2)
+    leaves= _eb_octree_count_leaves(tree_blocks, center_blocks.shape[0])
+    cen= center_blocks[:3*leaves].reshape(-1,3)
+    return (cen/ scale_factor).astype(np.float32)
+
+EB_OCTREE_PAYLOAD_ZLIB = 0
+EB_OCTREE_PAYLOAD_PREDICTIVE = 1
+EB_OCTREE_PAYLOAD_INDEXED = 2   # predictive + 子樹區塊索引 (可只解 ROI 內的子樹)
+EB_OCTREE_PAYLOADS = {"zlib": EB_OCTREE_PAYLOAD_ZLIB, "predictive": EB_OCTREE_PAYLOAD_PREDICTIVE,
+                      "indexed": EB_OCTREE_PAYLOAD_INDEXED}
+
+def eb_octree_pack_payload(tree_blocks, center_blocks, payload: str = "predictive",
+                           entropy: str = "huffman") -> bytes:
+    """
+    EB-Octree 串流本體: 'B' payload ID +
+      - zlib      : 'QQ' (兩段長度) + zlib(int32 masks) + zlib(int32 centers)   (原格式)
+      - predictive: masks 以 uint8 symbol 串流熵編碼；
+                    葉 center 以前序的前一個葉 (兄弟或相鄰子樹) 預測，
+                    各軸殘差各自以 pack_symbol_stream 熵編碼
+      - indexed   : predictive 的預測方式，但依子樹切成區塊並附 bbox 索引 (見 eb_octree_pack_indexed)；
+                    區塊固定為 canonical Huffman，entropy 只接受 "huffman"
+    """
+    if payload not in EB_OCTREE_PAYLOADS:
+        raise ValueError(f"unknown EB-Octree payload: {payload}")
+    pid= EB_OCTREE_PAYLOADS[payload]
+    if pid== EB_OCTREE_PAYLOAD_ZLIB:
+        ec= EntropyCompressor()
+        tb_enc= ec.encode(tree_blocks)
+        cb_enc= ec.encode(center_blocks)
+        return struct.pack('<BQQ', pid, len(tb_enc), len(cb_enc))+ tb_enc+ cb_enc
+    if pid== EB_OCTREE_PAYLOAD_INDEXED:
+        check_indexed_entropy(entropy)
+        return struct.pack('B', pid)+ eb_octree_pack_indexed(tree_blocks, center_blocks)
+    masks= np.asarray(tree_blocks, dtype=np.uint8)
+    cen= np.asarray(center_blocks, dtype=np.int64).reshape(-1,3)
+    res= np.diff(cen, axis=0, prepend=np.zeros((1,3), dtype=np.int64))
+    parts= [struct.pack('B', pid), pack_symbol_stream(masks, entropy)]
+    for k in range(3):
+        parts.append(pack_symbol_stream(res[:,k], entropy))
+    return b"".join(parts)
+
+def eb_octree_unpack_payload(data: bytes, pos: int = 0):
+    """
+    解析 eb_octree_pack_payload => (tree_blocks, center_blocks) 兩個整數陣列
+    """
+    pid= data[pos]
+    pos+= 1
+    if pid== EB_OCTREE_PAYLOAD_ZLIB:
+        t_size, c_size= struct.unpack('<QQ', data[pos:pos+16])
+        pos+= 16
+        dec= EntropyCompressor()
+        tree_blocks= dec.decode_array(data[pos:pos+t_size])
+        pos+= t_size
+        center_blocks= dec.decode_array(data[pos:pos+c_size])
+        return tree_blocks, center_blocks
+    if pid== EB_OCTREE_PAYLOAD_INDEXED:
+        return eb_octree_unpack_indexed(data, pos)
+    if pid!= EB_OCTREE_PAYLOAD_PREDICTIVE:
+        raise ValueError(f"unknown EB-Octree payload id: {pid}")
+    tree_blocks, pos= unpack_symbol_stream(data, pos)
+    axes=[]
+    for _ in range(3):
+        res, pos= unpack_symbol_stream(data, pos)
+        axes.append(np.cumsum(res))
+    n= min(a.size for a in axes)
+    center_blocks= np.empty((n,3), dtype=np.int64)
+    for k in range(3):
+        center_blocks[:,k]= axes[k][:n]
+    return tree_blocks, center_blocks.ravel()
 
 @njit
-def sum_per_axis(pts: np.ndarray):
+def _eb_octree_node_info(tree: np.ndarray):
     """
-    返回 (sumx, sumy, sumz)
+    前序 mask 串流 => 各節點 depth、其前的葉數、總葉數
     """
-    n= pts.shape[0]
-    s0=0.0
-    s1=0.0
-    s2=0.0
-    for i in range(n):
-        s0+= pts[i,0]
-        s1+= pts[i,1]
-        s2+= pts[i,2]
-    return (s0,s1,s2)
+    n= tree.shape[0]
+    depth= np.empty(n, dtype=np.int64)
+    leaves_before= np.empty(n, dtype=np.int64)
+    st= np.empty(64, dtype=np.int64)
+    st[0]= 0
+    sp= 1
+    m= 0
+    leaves= 0
+    while sp> 0 and m< n:
+        sp-= 1
+        d= st[sp]
+        depth[m]= d
+        leaves_before[m]= leaves
+        v= tree[m]& 0xFF
+        m+= 1
+        if v== 0:
+            leaves+= 1
+            continue
+        st= grow_int_buffer(st, sp, 8)
+        for c in range(8):
+            if (v>>c)&1:
+                st[sp]= d+ 1
+                sp+= 1
+    return depth[:m], leaves_before[:m], leaves
+
+def _eb_octree_insert_points(top_masks: np.ndarray, level: int):
+    """
+    走訪去掉子樹後的上層 mask 串流，回傳各子樹 (深度 == level) 應插回的 (mask 位置, center 位置)
+    """
+    t_offs, c_offs= [], []
+    st= [0]
+    i= 0
+    leaves= 0
+    while st:
+        d= st.pop()
+        if d== level:
+            t_offs.append(i)
+            c_offs.append(3*leaves)
+            continue
+        if i>= len(top_masks):
+            break
+        v= int(top_masks[i])& 0xFF
+        i+= 1
+        if v== 0:
+            leaves+= 1
+        else:
+            st.extend([d+ 1]* bin(v).count("1"))
+    return t_offs, c_offs
+
+def _eb_octree_block_streams(masks: np.ndarray, centers: np.ndarray):
+    """
+    區塊 => (masks, rx, ry, rz) 與葉 center 的 bbox；殘差以前一個葉預測，第一個葉以 bbox min 預測
+    """
+    centers= centers.reshape(-1,3)
+    if centers.shape[0]== 0:
+        bbox= np.zeros(6, dtype=np.int64)
+    else:
+        bbox= np.concatenate((centers.min(axis=0), centers.max(axis=0)))
+    res= np.diff(centers, axis=0, prepend=bbox[None,:3])
+    return (masks, res[:,0], res[:,1], res[:,2]), bbox
+
+def eb_octree_pack_indexed(tree_blocks, center_blocks, level: int = ROI_INDEX_LEVELS) -> bytes:
+    """
+    EB-Octree indexed payload:
+      '<BI' (level, 區塊數) + 各區塊葉 center bbox (int32 x6, 同 center 單位)
+      + pack_indexed_blocks: 區塊 0 = 去掉子樹後的上層，其後為深度 == level 的各子樹 (前序)
+    每個區塊: masks + 各軸殘差 (區塊內以前一個葉預測)；碼表整幀共用
+    解碼端依 bbox 只解與查詢框相交的子樹
+    """
+    tree= np.asarray(tree_blocks, dtype=np.int64)
+    cen= np.asarray(center_blocks, dtype=np.int64).reshape(-1,3)
+    depth, leaves_before, total= _eb_octree_node_info(tree)
+    at= np.nonzero(depth== level)[0]
+    shallow= np.nonzero(depth<= level)[0]
+    nxt= np.searchsorted(shallow, at, side='right')
+    t_end= np.where(nxt< shallow.size, shallow[np.minimum(nxt, shallow.size- 1)], depth.size)
+    c_end= np.where(t_end< depth.size, leaves_before[np.minimum(t_end, depth.size- 1)], total)
+    keep_t= np.ones(tree.size, dtype=bool)
+    keep_c= np.ones(cen.shape[0], dtype=bool)
+    subs= []
+    for a, b, ca, cb in zip(at, t_end, leaves_before[at], c_end):
+        keep_t[a:b]= False
+        keep_c[ca:cb]= False
+        subs.append(_eb_octree_block_streams(tree[a:b], cen[ca:cb]))
+    blocks= [_eb_octree_block_streams(tree[keep_t], cen[keep_c])]+ subs
+    bboxes= np.array([bb for _, bb in blocks], dtype='<i4').reshape(-1,6)
+    return (struct.pack('<BI', level, len(blocks))+ bboxes.tobytes()
+            + pack_indexed_blocks([st for st, _ in blocks], 4))
+
+def _eb_octree_indexed_header(data: bytes, pos: int):
+    """
+    => (level, bboxes (n,6), IndexedBlockReader)
+    """
+    level, n_blocks= struct.unpack('<BI', data[pos:pos+5])
+    pos+= 5
+    bboxes= np.frombuffer(data, dtype='<i4', count=6*n_blocks, offset=pos).reshape(-1,6).astype(np.int64)
+    pos+= 24*n_blocks
+    return level, bboxes, IndexedBlockReader(data, pos)
+
+def _eb_octree_read_block(reader: IndexedBlockReader, j: int, bbox: np.ndarray):
+    """
+    解一個區塊 => (masks, (k,3) 葉 center)
+    """
+    masks, rx, ry, rz= reader.block(j)
+    res= np.stack((rx, ry, rz), axis=1)
+    if res.shape[0]:
+        res[0]+= bbox[:3]
+    return masks, np.cumsum(res, axis=0)
+
+def eb_octree_unpack_indexed(data: bytes, pos: int):
+    """
+    完整解 indexed payload => (tree_blocks, center_blocks)，子樹依前序插回上層
+    """
+    level, bboxes, reader= _eb_octree_indexed_header(data, pos)
+    top_masks, top_cen= _eb_octree_read_block(reader, 0, bboxes[0])
+    t_offs, c_offs= _eb_octree_insert_points(top_masks, level)
+    subs= [_eb_octree_read_block(reader, j, bboxes[j]) for j in range(1, len(reader))]
+    k= min(len(t_offs), len(subs))
+    tree_blocks= splice_subtree_streams(top_masks, t_offs[:k], [m for m, _ in subs[:k]])
+    center_blocks= splice_subtree_streams(top_cen.ravel(), c_offs[:k], [c.ravel() for _, c in subs[:k]])
+    return tree_blocks, center_blocks
+
+def eb_octree_decode_region(data: bytes, pos: int, aabb, scale_factor: float) -> np.ndarray:
+    """
+    indexed payload 的 ROI 解碼: 只解上層區塊與葉 center bbox 和查詢框相交的子樹，結果再裁切到查詢框
+    """
+    _, bboxes, reader= _eb_octree_indexed_header(data, pos)
+    lo, hi= aabb_bounds(aabb)
+    parts= [_eb_octree_read_block(reader, 0, bboxes[0])[1]]
+    for j in range(1, len(reader)):
+        bb= bboxes[j]/ scale_factor
+        if np.all(bb[:3]<= hi) and np.all(bb[3:]>= lo):
+            parts.append(_eb_octree_read_block(reader, j, bboxes[j])[1])
+    cen= np.concatenate(parts)
+    return crop_to_aabb((cen/ scale_factor).astype(np.float32), aabb)
 
 
 ###############################################################################
 # (4a) EB-Octree(Axis) / EB-Octree(L2) => flatten
 ###############################################################################
 @njit
-def flatten_eb_octree_axis(points: np.ndarray,
-                           be_m: float,
-                           min_points: int,
-                           scale_factor: float,
-                           max_depth: int,
-                           depth: int,
-                           tree_list,  # typed list[int]
-                           center_list # typed list[int]
-                           ):
-    """
-    EB-Octree(Axis) => 遞迴
+def octree_index_buffers(n: int):
     """
-    n= points.shape[0]
-    if n==0:
-        return
+    就地分割用的 index 排列與暫存區 (每點 4+4+1 bytes，與樹深無關)
+    """
+    return np.arange(n, dtype=np.int32), np.empty(n, dtype=np.uint8), np.empty(n, dtype=np.int32)
 
-    s0,s1,s2= sum_per_axis(points)
-    cx= s0/n
-    cy= s1/n
-    cz= s2/n
+@njit
+def grow_int_buffer(buf: np.ndarray, n: int, extra: int) -> np.ndarray:
+    """
+    預先配置的整數輸出緩衝: 已寫入 n 個，尚需 extra 個空間；不足時容量加倍 (攤銷 O(1))
+    """
+    if n+ extra<= buf.shape[0]:
+        return buf
+    cap= max(2*buf.shape[0], n+ extra)
+    out= np.empty(cap, dtype=buf.dtype)
+    out[:n]= buf[:n]
+    return out
 
-    c_intx= int(round(cx* scale_factor))
-    c_inty= int(round(cy* scale_factor))
-    c_intz= int(round(cz* scale_factor))
-    repx= c_intx/ scale_factor
-    repy= c_inty/ scale_factor
-    repz= c_intz/ scale_factor
+@njit
+def _partition_index_range(points: np.ndarray, idx: np.ndarray, lo: int, hi: int,
+                           cx: float, cy: float, cz: float,
+                           octs: np.ndarray, tmp: np.ndarray, starts: np.ndarray):
+    """
+    idx[lo:hi] 依 xyz 與 (cx,cy,cz) 比較做穩定的 8 路 counting sort (就地改寫 idx)，
+    子節點 c 的範圍為 idx[starts[c]:starts[c+1]]；各子集合內保持原本點序
+    """
+    counts= np.zeros(8, dtype=np.int64)
+    for i in range(lo, hi):
+        p= idx[i]
+        o=0
+        if points[p,0]>=cx: o|=1
+        if points[p,1]>=cy: o|=2
+        if points[p,2]>=cz: o|=4
+        octs[i]= o
+        counts[o]+=1
+    starts[0]= lo
+    for c in range(8):
+        starts[c+1]= starts[c]+ counts[c]
+    ptr= starts[:8].copy()
+    for i in range(lo, hi):
+        o= octs[i]
+        tmp[ptr[o]]= idx[i]
+        ptr[o]+=1
+    for i in range(lo, hi):
+        idx[i]= tmp[i]
+
+@njit(nogil=True)
+def _eb_octree_build_range(points: np.ndarray, idx: np.ndarray, lo0: int, hi0: int, depth0: int,
+                           be_m: float, min_points: int, scale_factor: float, max_depth: int,
+                           use_l2: bool, stop_depth: int, octs: np.ndarray, tmp: np.ndarray):
+    """
+    EB-Octree 迭代式建樹 (Axis/L2 共用)，建 idx[lo0:hi0] 這棵子樹 (根位於 depth0):
+      - 整棵樹只用一個 index 排列 idx；每個節點是 idx 的一段連續範圍
+      - 分割時就地把範圍穩定地分成 8 段，不複製點座標
+      - 以顯式 stack 走前序 (子節點 0..7)，輸出與遞迴版本相同的 tree / center 串流
+      - points 可直接是呼叫端的 float32 陣列 (累加 / 比較皆以 float64 進行，結果不變)
+      - 輸出寫入預先配置的 int32 陣列: 每葉至少一點 => center 最多 3N 個；
+        mask 串流先配 2N + max_depth，不足時由 grow_int_buffer 擴充
+      - stop_depth >= 0 時，深度為 stop_depth 的節點不展開，只記錄為 job
+        (lo, hi, 該處 tree 位置, 該處 center 位置)，供平行建樹後依序拼回
+    只寫 idx/octs/tmp 的 [lo0, hi0) 區段 => 不相交的範圍可在不同 thread 同時建
+    回傳 (tree, center, jobs (k,4))
+    """
+    n_all= hi0- lo0
+    tree= np.empty(2*n_all+ max_depth+ 8, dtype=np.int32)
+    centers= np.empty(3*n_all, dtype=np.int32)
+    jobs= np.empty(64, dtype=np.int64)
+    nt= 0
+    nc= 0
+    nj= 0
+    if n_all==0:
+        return tree[:0], centers[:0], jobs[:0].reshape(-1,4)
+    starts= np.empty(9, dtype=np.int64)
+
+    cap= 256
+    st_lo= np.empty(cap, dtype=np.int64)
+    st_hi= np.empty(cap, dtype=np.int64)
+    st_d= np.empty(cap, dtype=np.int64)
+    st_lo[0]= lo0
+    st_hi[0]= hi0
+    st_d[0]= depth0
+    sp= 1
+    while sp>0:
+        sp-=1
+        lo= st_lo[sp]
+        hi= st_hi[sp]
+        depth= st_d[sp]
+        n= hi- lo
+        if depth== stop_depth:
+            jobs= grow_int_buffer(jobs, 4*nj, 4)
+            jobs[4*nj]= lo
+            jobs[4*nj+1]= hi
+            jobs[4*nj+2]= nt
+            jobs[4*nj+3]= nc
+            nj+= 1
+            continue
 
-    # 計算 axis-wise 誤差
-    max1d=0.0
-    for i in range(n):
-        dx= abs(points[i,0]- repx)
-        dy= abs(points[i,1]- repy)
-        dz= abs(points[i,2]- repz)
-        local_max= dx if dx>dy else dy
-        if dz> local_max:
-            local_max= dz
-        if local_max> max1d:
-            max1d= local_max
-    if (max1d <= be_m) or (n<=min_points) or (depth>=max_depth):
-        # 先檢查 bounding box
-        mnx,mny,mnz = min_per_axis(points)
-        mxx,mxy,mxz = max_per_axis(points)
-        len_x = (mxx - mnx)
-        len_y = (mxy - mny)
-        len_z = (mxz - mnz)
-        half_x = 0.5*len_x
-        half_y = 0.5*len_y
-        half_z = 0.5*len_z
-        fix_x = 0.75*len_x
-        fix_y = 0.75*len_y
-        fix_z = 0.75*len_z
-        if max(fix_x, fix_y,fix_z) <= be_m:
-            tree_list.append(0)
-            center_list.append(c_intx)
-            center_list.append(c_inty) 
-            center_list.append(c_intz)
-            return
+        s0=0.0
+        s1=0.0
+        s2=0.0
+        for i in range(lo, hi):
+            p= idx[i]
+            s0+= points[p,0]
+            s1+= points[p,1]
+            s2+= points[p,2]
+        cix= int(round((s0/n)* scale_factor))
+        ciy= int(round((s1/n)* scale_factor))
+        ciz= int(round((s2/n)* scale_factor))
+        rx= cix/ scale_factor
+        ry= ciy/ scale_factor
+        rz= ciz/ scale_factor
+
+        mnx=1e30
+        mny=1e30
+        mnz=1e30
+        mxx=-1e30
+        mxy=-1e30
+        mxz=-1e30
+        maxe=0.0
+        for i in range(lo, hi):
+            p= idx[i]
+            px= points[p,0]
+            py= points[p,1]
+            pz= points[p,2]
+            if px<mnx: mnx=px
+            if py<mny: mny=py
+            if pz<mnz: mnz=pz
+            if px>mxx: mxx=px
+            if py>mxy: mxy=py
+            if pz>mxz: mxz=pz
+            if use_l2:
+                dx= px- rx
+                dy= py- ry
+                dz= pz- rz
+                dd= dx*dx+ dy*dy+ dz*dz
+                if dd> maxe:
+                    maxe= dd
+            else:
+                dx= abs(px- rx)
+                dy= abs(py- ry)
+                dz= abs(pz- rz)
+                local_max= dx if dx>dy else dy
+                if dz> local_max:
+                    local_max= dz
+                if local_max> maxe:
+                    maxe= local_max
+        if use_l2:
+            maxe= math.sqrt(maxe)
+
+        if (maxe<= be_m) or (n<= min_points) or (depth>= max_depth):
+            # Axis 另需 bounding box 0.75*邊長 <= be_m 才可成為葉
+            if use_l2 or max(0.75*(mxx- mnx), 0.75*(mxy- mny), 0.75*(mxz- mnz))<= be_m:
+                tree= grow_int_buffer(tree, nt, 1)
+                tree[nt]= 0
+                nt+= 1
+                centers[nc]= cix
+                centers[nc+1]= ciy
+                centers[nc+2]= ciz
+                nc+= 3
+                continue
 
-    mask_pos= len(tree_list)
-    tree_list.append(-1) # placeholder
-
-    mnx,mny,mnz= min_per_axis(points)
-    mxx,mxy,mxz= max_per_axis(points)
-    cxx= 0.5*(mnx+ mxx)
-    cyy= 0.5*(mny+ mxy)
-    czz= 0.5*(mnz+ mxz)
-    outs= partition_points(points, cxx, cyy, czz)
-    mask_val=0
-    for iChild in range(8):
-        child= outs[iChild]
-        if child.shape[0]>0:
-            mask_val|= (1<< iChild)
-            flatten_eb_octree_axis(child, be_m, min_points, scale_factor,
-                                   max_depth, depth+1,
-                                   tree_list, center_list)
-    tree_list[mask_pos]= mask_val
+        _partition_index_range(points, idx, lo, hi,
+                               0.5*(mnx+ mxx), 0.5*(mny+ mxy), 0.5*(mnz+ mxz),
+                               octs, tmp, starts)
+        if sp+ 8> cap:
+            cap*= 2
+            st_lo= np.concatenate((st_lo, np.empty(cap- st_lo.shape[0], dtype=np.int64)))
+            st_hi= np.concatenate((st_hi, np.empty(cap- st_hi.shape[0], dtype=np.int64)))
+            st_d= np.concatenate((st_d, np.empty(cap- st_d.shape[0], dtype=np.int64)))
+        mask_val=0
+        for c in range(7, -1, -1):
+            if starts[c+1]> starts[c]:
+                mask_val|= (1<< c)
+                st_lo[sp]= starts[c]
+                st_hi[sp]= starts[c+1]
+                st_d[sp]= depth+ 1
+                sp+=1
+        tree= grow_int_buffer(tree, nt, 1)
+        tree[nt]= mask_val
+        nt+= 1
+    return tree[:nt], centers[:nc], jobs[:4*nj].reshape(-1,4)
 
 @njit
-def flatten_eb_octree_l2(points: np.ndarray,
-                         be_m: float,
-                         min_points: int,
-                         scale_factor: float,
-                         max_depth: int,
-                         depth: int,
-                         tree_list,
-                         center_list):
+def _flatten_eb_octree(points: np.ndarray,
+                       be_m: float,
+                       min_points: int,
+                       scale_factor: float,
+                       max_depth: int,
+                       use_l2: bool):
+    """
+    EB-Octree 單執行緒建樹 => (tree, center) 兩個 int32 陣列 (見 _eb_octree_build_range)
+    """
+    idx, octs, tmp= octree_index_buffers(points.shape[0])
+    tree, centers, _= _eb_octree_build_range(points, idx, 0, points.shape[0], 0,
+                                             be_m, min_points, scale_factor, max_depth,
+                                             use_l2, -1, octs, tmp)
+    return tree, centers
+
+OCTREE_SPLIT_LEVELS = 2   # 平行建樹: 前 2 層在主執行緒展開，最多 64 棵子樹分給 worker
+
+def splice_subtree_streams(top: np.ndarray, offsets, parts) -> np.ndarray:
+    """
+    把各子樹的前序串流依序插回上層串流的 offsets 位置 (offsets 遞增)
     """
-    EB-Octree(L2) => 遞迴
+    out= []
+    prev= 0
+    for off, part in zip(offsets, parts):
+        out.append(top[prev:off])
+        out.append(part)
+        prev= off
+    out.append(top[prev:])
+    return np.concatenate(out)
+
+def flatten_eb_octree_parallel(points: np.ndarray, be_m: float, min_points: int,
+                               scale_factor: float, max_depth: int, use_l2: bool,
+                               workers: Optional[int] = None,
+                               split_levels: int = OCTREE_SPLIT_LEVELS):
+    """
+    平行建 EB-Octree: 前 split_levels 層照常展開，其下各子樹 (互不相交的 idx 範圍)
+    交給 thread pool 上的 nogil kernel 建樹，再依前序拼回 => 與單執行緒版本逐位元相同
     """
     n= points.shape[0]
-    if n==0:
-        return
-    s0,s1,s2= sum_per_axis(points)
-    cx= s0/n
-    cy= s1/n
-    cz= s2/n
-
-    cix= int(round(cx* scale_factor))
-    ciy= int(round(cy* scale_factor))
-    ciz= int(round(cz* scale_factor))
-    rx= cix/ scale_factor
-    ry= ciy/ scale_factor
-    rz= ciz/ scale_factor
-
-    # L2
-    maxd=0.0
-    for i in range(n):
-        dx= points[i,0]- rx
-        dy= points[i,1]- ry
-        dz= points[i,2]- rz
-        dd= dx*dx+ dy*dy+ dz*dz
-        if dd> maxd:
-            maxd= dd
-    maxd= math.sqrt(maxd)
-
-    if (maxd<= be_m) or (n<= min_points) or (depth>= max_depth):
-        tree_list.append(0)
-        center_list.append(cix)
-        center_list.append(ciy)
-        center_list.append(ciz)
-        return
+    idx, octs, tmp= octree_index_buffers(n)
+    top_tree, top_cen, jobs= _eb_octree_build_range(points, idx, 0, n, 0,
+                                                    be_m, min_points, scale_factor, max_depth,
+                                                    use_l2, split_levels, octs, tmp)
+    if jobs.shape[0]==0:
+        return top_tree, top_cen
+
+    def build(job):
+        tree, centers, _= _eb_octree_build_range(points, idx, job[0], job[1], split_levels,
+                                                 be_m, min_points, scale_factor, max_depth,
+                                                 use_l2, -1, octs, tmp)
+        return tree, centers
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        parts= list(ex.map(build, jobs))
+    return (splice_subtree_streams(top_tree, jobs[:,2], [t for t,_ in parts]),
+            splice_subtree_streams(top_cen, jobs[:,3], [c for _,c in parts]))
+
+def flatten_eb_octree_axis(points: np.ndarray, be_m: float, min_points: int,
+                           scale_factor: float, max_depth: int):
+    """
+    EB-Octree(Axis) => 迭代式建樹 (見 _flatten_eb_octree)，回傳 (tree, center) 陣列
+    """
+    return _flatten_eb_octree(points, be_m, min_points, scale_factor, max_depth, False)
 
-    mask_pos= len(tree_list)
-    tree_list.append(-1)
-
-    mnx,mny,mnz= min_per_axis(points)
-    mxx,mxy,mxz= max_per_axis(points)
-    cxx= 0.5*(mnx+ mxx)
-    cyy= 0.5*(mny+ mxy)
-    czz= 0.5*(mnz+ mxz)
-    outs= partition_points(points, cxx, cyy, czz)
-    mask_val=0
-    for iChild in range(8):
-        child= outs[iChild]
-        if child.shape[0]>0:
-            mask_val|= (1<< iChild)
-            flatten_eb_octree_l2(child, be_m, min_points, scale_factor,
-                                 max_depth, depth+1,
-                                 tree_list, center_list)
-    tree_list[mask_pos]= mask_val
+def flatten_eb_octree_l2(points: np.ndarray, be_m: float, min_points: int,
+                         scale_factor: float, max_depth: int):
+    """
+    EB-Octree(L2) => 迭代式建樹 (見 _flatten_eb_octree)，回傳 (tree, center) 陣列
+    """
+    return _flatten_eb_octree(points, be_m, min_points, scale_factor, max_depth, True)
 
 
 ###############################################################################
 # (4b) EBOctreeAxisCompressor, EBOctreeL2Compressor
 ###############################################################################
 class EBOctreeAxisCompressor:
-    def __init__(self, be_m=0.1, min_points=1, scale_factor=1000.0, max_depth=32):
+    def __init__(self, be_m=0.1, min_points=1, scale_factor=1000.0, max_depth=32,
+                 payload: str = "predictive", entropy: str = "huffman", workers: Optional[int] = 1):
         self.be_m= be_m
         self.min_points= min_points
         self.scale_factor= scale_factor
         self.max_depth= max_depth
+        self.payload= payload
+        self.entropy= entropy
+        self.workers= workers   # != 1 => 依頂層子樹平行建樹 (None = ThreadPoolExecutor 預設)
+
+    def flatten(self, points: np.ndarray):
+        """
+        建 EB-Octree => (tree, center) 兩個 int32 陣列 (熵編碼前的中間串流)
+        """
+        if self.workers!= 1:
+            return flatten_eb_octree_parallel(points, self.be_m, self.min_points,
+                                              self.scale_factor, self.max_depth, False,
+                                              self.workers)
+        return flatten_eb_octree_axis(points,
+                                      self.be_m,
+                                      self.min_points,
+                                      self.scale_factor,
+                                      self.max_depth)
 
     def compress(self, points: np.ndarray)-> bytes:
         if len(points)==0:
             return b""
-        from numba.typed import List as NumbaList
-        tree_list= NumbaList.empty_list(numba.int32)
-        center_list= NumbaList.empty_list(numba.int32)
-
-        flatten_eb_octree_axis(points.astype(np.float64),
-                               self.be_m,
-                               self.min_points,
-                               self.scale_factor,
-                               self.max_depth,
-                               0,
-                               tree_list,
-                               center_list)
-        tb= list(tree_list)
-        cb= list(center_list)
-        ec= EntropyCompressor()
-        tb_enc= ec.encode(tb)
-        cb_enc= ec.encode(cb)
+        tb, cb= self.flatten(points)
         be_int= int(round(self.be_m*100))
         hdr= struct.pack('iiii', be_int, self.min_points, int(self.scale_factor), self.max_depth)
-        sz= struct.pack('QQ', len(tb_enc), len(cb_enc))
-        return hdr+ sz+ tb_enc+ cb_enc
+        return hdr+ eb_octree_pack_payload(tb, cb, self.payload, self.entropy)
 
     def decompress(self, data: bytes)-> np.ndarray:
         if not data:
@@ -660,79 +1954,59 @@ class EBOctreeAxisCompressor:
         self.min_points= mp
         self.scale_factor= float(scf)
         self.max_depth= md
-        s2= struct.calcsize('QQ')
-        t_size, c_size= struct.unpack('QQ', data[pos:pos+s2])
-        pos+= s2
-        tb_enc= data[pos:pos+t_size]
-        pos+= t_size
-        cb_enc= data[pos:pos+c_size]
-        pos+= c_size
-        dec= EntropyCompressor()
-        tree_blocks= dec.decode(tb_enc)
-        center_blocks= dec.decode(cb_enc)
-
-        # BFS decode => 只還原葉 center
-        rec_pts=[]
-        st= [(0, 0)]  # (iT, iC)
-        iT=0
-        iC=0
-        while len(st)>0:
-            (curT,curC)= st.pop()
-            if iT>= len(tree_blocks):
-                break
-            nodeVal= tree_blocks[iT]
-            iT+=1
-            if nodeVal==0:
-                if iC+3> len(center_blocks):
-                    break
-                cx_i= center_blocks[iC]
-                cy_i= center_blocks[iC+1]
-                cz_i= center_blocks[iC+2]
-                iC+=3
-                cx= cx_i/self.scale_factor
-                cy= cy_i/self.scale_factor
-                cz= cz_i/self.scale_factor
-                rec_pts.append((cx,cy,cz))
-            else:
-                mask= nodeVal
-                for cID in range(7,-1,-1):
-                    if (mask>>cID)&1:
-                        st.append((iT,iC))
+        tree_blocks, center_blocks= eb_octree_unpack_payload(data, pos)
 
-        return np.array(rec_pts, dtype=np.float32)
+        # mask 串流驗證 + 葉 center 直接 reshape
+        return eb_octree_leaf_centers(tree_blocks, center_blocks, self.scale_factor)
+
+    def decompress_region(self, data: bytes, aabb)-> np.ndarray:
+        """
+        只還原查詢框 aabb ((xmin,ymin,zmin),(xmax,ymax,zmax)) 內的點；
+        payload="indexed" 時跳過不相交子樹的熵解碼，其他 payload 完整解壓後裁切
+        """
+        hdsize= struct.calcsize('iiii')
+        if len(data)<= hdsize or data[hdsize]!= EB_OCTREE_PAYLOAD_INDEXED:
+            return crop_to_aabb(self.decompress(data), aabb)
+        be_int, mp, scf, md= struct.unpack('iiii', data[:hdsize])
+        self.be_m= be_int/100.0
+        self.min_points= mp
+        self.scale_factor= float(scf)
+        self.max_depth= md
+        return eb_octree_decode_region(data, hdsize+ 1, aabb, self.scale_factor)
 
 
 class EBOctreeL2Compressor:
-    def __init__(self, be_m=0.1, min_points=1, scale_factor=1000.0, max_depth=32):
+    def __init__(self, be_m=0.1, min_points=1, scale_factor=1000.0, max_depth=32,
+                 payload: str = "predictive", entropy: str = "huffman", workers: Optional[int] = 1):
         self.be_m= be_m
         self.min_points= min_points
         self.scale_factor= scale_factor
         self.max_depth= max_depth
+        self.payload= payload
+        self.entropy= entropy
+        self.workers= workers   # != 1 => 依頂層子樹平行建樹 (None = ThreadPoolExecutor 預設)
+
+    def flatten(self, points: np.ndarray):
+        """
+        建 EB-Octree => (tree, center) 兩個 int32 陣列 (熵編碼前的中間串流)
+        """
+        if self.workers!= 1:
+            return flatten_eb_octree_parallel(points, self.be_m, self.min_points,
+                                              self.scale_factor, self.max_depth, True,
+                                              self.workers)
+        return flatten_eb_octree_l2(points,
+                                    self.be_m,
+                                    self.min_points,
+                                    self.scale_factor,
+                                    self.max_depth)
 
     def compress(self, points: np.ndarray)-> bytes:
         if len(points)==0:
             return b""
-        from numba.typed import List as NumbaList
-        tree_list= NumbaList.empty_list(numba.int32)
-        center_list= NumbaList.empty_list(numba.int32)
-
-        flatten_eb_octree_l2(points.astype(np.float64),
-                             self.be_m,
-                             self.min_points,
-                             self.scale_factor,
-                             self.max_depth,
-                             0,
-                             tree_list,
-                             center_list)
-        tb= list(tree_list)
-        cb= list(center_list)
-        ec= EntropyCompressor()
-        tb_enc= ec.encode(tb)
-        cb_enc= ec.encode(cb)
+        tb, cb= self.flatten(points)
         be_int= int(round(self.be_m*100))
         hdr= struct.pack('iiii', be_int, self.min_points, int(self.scale_factor), self.max_depth)
-        sz= struct.pack('QQ', len(tb_enc), len(cb_enc))
-        return hdr+ sz+ tb_enc+ cb_enc
+        return hdr+ eb_octree_pack_payload(tb, cb, self.payload, self.entropy)
 
     def decompress(self, data: bytes)-> np.ndarray:
         if not data:
@@ -745,143 +2019,73 @@ class EBOctreeL2Compressor:
         self.min_points= mp
         self.scale_factor= float(scf)
         self.max_depth= md
-        s2= struct.calcsize('QQ')
-        t_size, c_size= struct.unpack('QQ', data[pos:pos+s2])
-        pos+= s2
-        tb_enc= data[pos:pos+t_size]
-        pos+= t_size
-        cb_enc= data[pos:pos+c_size]
-        pos+= c_size
-        dec= EntropyCompressor()
-        tree_blocks= dec.decode(tb_enc)
-        center_blocks= dec.decode(cb_enc)
-
-        rec_pts=[]
-        st= [(0,0)]
-        iT=0
-        iC=0
-        while len(st)>0:
-            (curT,curC)= st.pop()
-            if iT>= len(tree_blocks):
-                break
-            nodeVal= tree_blocks[iT]
-            iT+=1
-            if nodeVal==0:
-                if iC+3> len(center_blocks):
-                    break
-                cx_i= center_blocks[iC]
-                cy_i= center_blocks[iC+1]
-                cz_i= center_blocks[iC+2]
-                iC+=3
-                cx= cx_i/self.scale_factor
-                cy= cy_i/self.scale_factor
-                cz= cz_i/self.scale_factor
-                rec_pts.append((cx,cy,cz))
-            else:
-                mask= nodeVal
-                for cID in range(7,-1,-1):
-                    if (mask>>cID)&1:
-                        st.append((iT,iC))
+        tree_blocks, center_blocks= eb_octree_unpack_payload(data, pos)
 
-        return np.array(rec_pts, dtype=np.float32)
+        # mask 串流驗證 + 葉 center 直接 reshape
+        return eb_octree_leaf_centers(tree_blocks, center_blocks, self.scale_factor)
+
+    def decompress_region(self, data: bytes, aabb)-> np.ndarray:
+        """
+        只還原查詢框 aabb ((xmin,ymin,zmin),(xmax,ymax,zmax)) 內的點；
+        payload="indexed" 時跳過不相交子樹的熵解碼，其他 payload 完整解壓後裁切
+        """
+        hdsize= struct.calcsize('iiii')
+        if len(data)<= hdsize or data[hdsize]!= EB_OCTREE_PAYLOAD_INDEXED:
+            return crop_to_aabb(self.decompress(data), aabb)
+        be_int, mp, scf, md= struct.unpack('iiii', data[:hdsize])
+        self.be_m= be_int/100.0
+        self.min_points= mp
+        self.scale_factor= float(scf)
+        self.max_depth= md
+        return eb_octree_decode_region(data, hdsize+ 1, aabb, self.scale_factor)
 
 
 ###############################################################################
 # (5) EB-HC-3D(Axis)/(L2)
 ###############################################################################
-class HuffmanNode:
-    def __init__(self, symbol=None, freq=0):
-        self.symbol = symbol
-        self.freq = freq
-        self.left = None
-        self.right = None
-    def __lt__(self, other):
-        return self.freq < other.freq
-
-class HuffmanEncoder:
-    def __init__(self):
-        self.code_table = {}
-
-    def build_tree(self, freq_dict: Dict[int, int]) -> HuffmanNode:
-        import heapq
-        heap = [HuffmanNode(sym, fr) for sym, fr in freq_dict.items()]
-        heapq.heapify(heap)
-        while len(heap) > 1:
-            left = heapq.heappop(heap)
-            right = heapq.heappop(heap)
-            merged = HuffmanNode(freq=left.freq + right.freq)
-            merged.left = left
-            merged.right = right
-            heapq.heappush(heap, merged)
-        return heap[0] if heap else None
-
-    def build_code_table(self, node, current_code=""):
-        if node is None:
-            return
-        if node.symbol is not None:
-            self.code_table[node.symbol] = current_code
-            return
-        self.build_code_table(node.left, current_code + "0")
-        self.build_code_table(node.right, current_code + "1")
-
-    def encode(self, data: List[int]) -> (bytes, int):
-        encoded_bits = ''.join(self.code_table[sym] for sym in data)
-        padding = 8 - (len(encoded_bits) % 8)
-        if padding == 8:
-            padding = 0
-        encoded_bits += '0' * padding
-        out_bytes = bytearray()
-        for i in range(0, len(encoded_bits), 8):
-            segment = encoded_bits[i:i+8]
-            val = int(segment, 2)
-            out_bytes.append(val)
-        return bytes(out_bytes), padding
-
-class HuffmanDecoder:
-    def __init__(self, code_table: Dict[int, str]):
-        self.root = HuffmanNode()
-        for sym, code in code_table.items():
-            node = self.root
-            for bit in code:
-                if bit == '0':
-                    if not node.left:
-                        node.left = HuffmanNode()
-                    node = node.left
-                else:
-                    if not node.right:
-                        node.right = HuffmanNode()
-                    node = node.right
-            node.symbol = sym
-
-    def decode(self, encoded_data: bytes, padding: int) -> List[int]:
-        bit_str = ''.join(f"{byte:08b}" for byte in encoded_data)
-        if padding > 0:
-            bit_str = bit_str[:-padding]
-        decoded_symbols = []
-        node = self.root
-        for bit in bit_str:
-            node = node.left if (bit == '0') else node.right
-            if node.symbol is not None:
-                decoded_symbols.append(node.symbol)
-                node = self.root
-        return decoded_symbols
+@njit
+def _child_center(center: np.ndarray, oct_idx: int, quarter: float) -> np.ndarray:
+    newc= center.copy()
+    if (oct_idx&1):
+        newc[0]+= quarter
+    else:
+        newc[0]-= quarter
+    if (oct_idx&2):
+        newc[1]+= quarter
+    else:
+        newc[1]-= quarter
+    if (oct_idx&4):
+        newc[2]+= quarter
+    else:
+        newc[2]-= quarter
+    return newc
+
+OCTREE_SPLIT_ROW = 17   # 每層分割暫存: [0:9] 子範圍起點 (starts)、[9:17] 分派指標
 
 @njit
-def subdivide_axis_jit(points: np.ndarray, center: np.ndarray, size: float,
-                       error_bound: float, max_depth: int, depth: int,
-                       symbol_stream):
+def octree_split_scratch(max_depth: int) -> np.ndarray:
     """
-    EB-HC-3D(Axis) => 3D Octree + Axis bound
+    EB-HC-3D 分割暫存 (每層一列，遞迴時父節點那列保持不變)，整棵樹只配置一次
     """
-    N = points.shape[0]
-    if N == 0:
-        return
+    return np.empty((max_depth+ 1, OCTREE_SPLIT_ROW), dtype=np.int64)
 
+@njit
+def _node_axis_error_counts(points: np.ndarray, idx: np.ndarray, lo: int, hi: int,
+                            center: np.ndarray, row: np.ndarray) -> float:
+    """
+    idx[lo:hi] 各點到 center 的最大單軸誤差；同一趟把各 octant 的點數寫入 row[1:9]
+    """
+    for c in range(9):
+        row[c]= 0
     max1d_err = 0.0
-    for i in range(N):
-        dx = abs(points[i,0] - center[0])
-        dy = abs(points[i,1] - center[1])
-        dz = abs(points[i,2] - center[2])
+    for i in range(lo, hi):
+        p = idx[i]
+        px = points[p,0]
+        py = points[p,1]
+        pz = points[p,2]
+        dx = abs(px - center[0])
+        dy = abs(py - center[1])
+        dz = abs(pz - center[2])
         local_max = dx
         if dy> local_max:
             local_max= dy
@@ -889,483 +2093,1066 @@ def subdivide_axis_jit(points: np.ndarray, center: np.ndarray, size: float,
             local_max= dz
         if local_max> max1d_err:
             max1d_err= local_max
+        o= 0
+        if px>= center[0]: o|= 1
+        if py>= center[1]: o|= 2
+        if pz>= center[2]: o|= 4
+        row[o+1]+= 1
+    return max1d_err
 
-    if max1d_err <= error_bound or depth>= max_depth:
-        symbol_stream.append(76) # 'L'
-        n3 = (N>>24)&0xFF
-        n2 = (N>>16)&0xFF
-        n1 = (N>>8)&0xFF
-        n0 = N &0xFF
-        symbol_stream.append(n3)
-        symbol_stream.append(n2)
-        symbol_stream.append(n1)
-        symbol_stream.append(n0)
-        for i in range(N):
-            qx = int(round((points[i,0] - center[0]) / error_bound))
-            qy = int(round((points[i,1] - center[1]) / error_bound))
-            qz = int(round((points[i,2] - center[2]) / error_bound))
-            symbol_stream.append(qx+128)
-            symbol_stream.append(qy+128)
-            symbol_stream.append(qz+128)
-        return
+@njit
+def _node_l2_error_counts(points: np.ndarray, idx: np.ndarray, lo: int, hi: int,
+                          center: np.ndarray, row: np.ndarray) -> float:
+    """
+    idx[lo:hi] 各點到 center 的最大 L2 距離；同一趟把各 octant 的點數寫入 row[1:9]
+    """
+    for c in range(9):
+        row[c]= 0
+    max_l2= 0.0
+    for i in range(lo, hi):
+        p= idx[i]
+        px= points[p,0]
+        py= points[p,1]
+        pz= points[p,2]
+        dx= px- center[0]
+        dy= py- center[1]
+        dz= pz- center[2]
+        dist= math.sqrt(dx*dx+ dy*dy+ dz*dz)
+        if dist> max_l2:
+            max_l2= dist
+        o= 0
+        if px>= center[0]: o|= 1
+        if py>= center[1]: o|= 2
+        if pz>= center[2]: o|= 4
+        row[o+1]+= 1
+    return max_l2
+
+@njit
+def _scatter_octants(points: np.ndarray, src: np.ndarray, dst: np.ndarray, lo: int, hi: int,
+                     center: np.ndarray, row: np.ndarray):
+    """
+    row[1:9] 為各 octant 點數 (見 _node_*_error_counts) => 一趟穩定地把 src[lo:hi] 分派到 dst[lo:hi]，
+    子節點 c 的範圍為 dst[row[c]:row[c+1]]；不寫回 src (下一層改由 dst 讀，src 當暫存)
+    """
+    row[0]= lo
+    for c in range(8):
+        row[c+1]+= row[c]
+        row[9+c]= row[c]
+    for i in range(lo, hi):
+        p= src[i]
+        o= 0
+        if points[p,0]>= center[0]: o|= 1
+        if points[p,1]>= center[1]: o|= 2
+        if points[p,2]>= center[2]: o|= 4
+        dst[row[9+o]]= p
+        row[9+o]+= 1
+
+@njit(nogil=True)
+def subdivide_axis_jit(points: np.ndarray, idx: np.ndarray, tmp: np.ndarray, lo: int, hi: int,
+                       center: np.ndarray, size: float,
+                       error_bound: float, max_depth: int, depth: int,
+                       symbol_stream: np.ndarray, n_sym: int, scratch: np.ndarray):
+    """
+    EB-HC-3D(Axis) => 3D Octree + Axis bound
+    節點 = idx[lo:hi] (指向呼叫端原始點陣列)；誤差檢查同一趟計數 octant，
+    分割時一趟 counting sort 分派到 tmp[lo:hi]，子節點改以 (tmp, idx) 互換角色遞迴 (不寫回、不複製點)
+    symbol_stream 為預先配置的 int32 緩衝 (已寫入 n_sym 個)，回傳 (緩衝, 新長度)
+    """
+    N = hi - lo
+    if N == 0:
+        return symbol_stream, n_sym
 
-    i_pos= len(symbol_stream)
-    symbol_stream.append(78)  # 'N'
-    symbol_stream.append(0)   # child_mask
+    row = scratch[depth]
+    max1d_err = _node_axis_error_counts(points, idx, lo, hi, center, row)
+
+    if max1d_err <= error_bound or depth>= max_depth:
+        symbol_stream = grow_int_buffer(symbol_stream, n_sym, 5+ 3*N)
+        symbol_stream[n_sym] = 76 # 'L'
+        symbol_stream[n_sym+1] = (N>>24)&0xFF
+        symbol_stream[n_sym+2] = (N>>16)&0xFF
+        symbol_stream[n_sym+3] = (N>>8)&0xFF
+        symbol_stream[n_sym+4] = N &0xFF
+        n_sym += 5
+        for i in range(lo, hi):
+            p = idx[i]
+            qx = int(round((points[p,0] - center[0]) / error_bound))
+            qy = int(round((points[p,1] - center[1]) / error_bound))
+            qz = int(round((points[p,2] - center[2]) / error_bound))
+            symbol_stream[n_sym] = qx+128
+            symbol_stream[n_sym+1] = qy+128
+            symbol_stream[n_sym+2] = qz+128
+            n_sym += 3
+        return symbol_stream, n_sym
+
+    symbol_stream= grow_int_buffer(symbol_stream, n_sym, 2)
+    i_pos= n_sym
+    symbol_stream[i_pos]= 78    # 'N'
+    symbol_stream[i_pos+1]= 0   # child_mask
+    n_sym+= 2
 
     half= size*0.5
     quarter= size*0.25
 
-    idx_array= np.zeros(N, dtype=np.uint8)
-    for i in range(N):
-        px= points[i,0]
-        py= points[i,1]
-        pz= points[i,2]
-        mask= 0
-        if px>= center[0]:
-            mask|=1
-        if py>= center[1]:
-            mask|=2
-        if pz>= center[2]:
-            mask|=4
-        idx_array[i]= mask
+    _scatter_octants(points, idx, tmp, lo, hi, center, row)
 
     child_mask= 0
     for oct_idx in range(8):
-        sel= (idx_array== oct_idx)
-        if not np.any(sel):
+        if row[oct_idx+1]== row[oct_idx]:
             continue
-        sub_pts= points[sel]
-        newc= center.copy()
-        if (oct_idx&1):
-            newc[0]+= quarter
-        else:
-            newc[0]-= quarter
-        if (oct_idx&2):
-            newc[1]+= quarter
-        else:
-            newc[1]-= quarter
-        if (oct_idx&4):
-            newc[2]+= quarter
-        else:
-            newc[2]-= quarter
         child_mask|= (1<<oct_idx)
-        subdivide_axis_jit(sub_pts, newc, half, error_bound,
-                           max_depth, depth+1, symbol_stream)
+        symbol_stream, n_sym= subdivide_axis_jit(points, tmp, idx, row[oct_idx], row[oct_idx+1],
+                                                 _child_center(center, oct_idx, quarter), half,
+                                                 error_bound, max_depth, depth+1,
+                                                 symbol_stream, n_sym, scratch)
 
     symbol_stream[i_pos+1] = child_mask
+    return symbol_stream, n_sym
 
-@njit
-def subdivide_l2_jit(points: np.ndarray, center: np.ndarray, size: float,
+@njit(nogil=True)
+def subdivide_l2_jit(points: np.ndarray, idx: np.ndarray, tmp: np.ndarray, lo: int, hi: int,
+                     center: np.ndarray, size: float,
                      error_bound: float, max_depth: int, depth: int,
-                     symbol_stream):
+                     symbol_stream: np.ndarray, n_sym: int, scratch: np.ndarray):
     """
     EB-HC-3D(L2) => 3D Octree + L2 bound
+    節點 = idx[lo:hi] (指向呼叫端原始點陣列)；誤差檢查同一趟計數 octant，
+    分割時一趟 counting sort 分派到 tmp[lo:hi]，子節點改以 (tmp, idx) 互換角色遞迴 (不寫回、不複製點)
+    symbol_stream 為預先配置的 int32 緩衝 (已寫入 n_sym 個)，回傳 (緩衝, 新長度)
     """
-    N= points.shape[0]
+    N= hi- lo
     if N==0:
-        return
-    max_l2= 0.0
-    for i in range(N):
-        dx= points[i,0]- center[0]
-        dy= points[i,1]- center[1]
-        dz= points[i,2]- center[2]
-        dist= math.sqrt(dx*dx+ dy*dy+ dz*dz)
-        if dist> max_l2:
-            max_l2= dist
+        return symbol_stream, n_sym
+    row= scratch[depth]
+    max_l2= _node_l2_error_counts(points, idx, lo, hi, center, row)
 
     if max_l2<= error_bound or depth>= max_depth:
-        symbol_stream.append(76) # 'L'
-        n3= (N>>24)&0xFF
-        n2= (N>>16)&0xFF
-        n1= (N>>8)&0xFF
-        n0= N &0xFF
-        symbol_stream.append(n3)
-        symbol_stream.append(n2)
-        symbol_stream.append(n1)
-        symbol_stream.append(n0)
-        for i in range(N):
-            dx= (points[i,0]- center[0])/ error_bound
-            dy= (points[i,1]- center[1])/ error_bound
-            dz= (points[i,2]- center[2])/ error_bound
+        symbol_stream= grow_int_buffer(symbol_stream, n_sym, 5+ 3*N)
+        symbol_stream[n_sym]= 76 # 'L'
+        symbol_stream[n_sym+1]= (N>>24)&0xFF
+        symbol_stream[n_sym+2]= (N>>16)&0xFF
+        symbol_stream[n_sym+3]= (N>>8)&0xFF
+        symbol_stream[n_sym+4]= N &0xFF
+        n_sym+= 5
+        for i in range(lo, hi):
+            p= idx[i]
+            dx= (points[p,0]- center[0])/ error_bound
+            dy= (points[p,1]- center[1])/ error_bound
+            dz= (points[p,2]- center[2])/ error_bound
             qx= int(round(dx))
             qy= int(round(dy))
             qz= int(round(dz))
-            symbol_stream.append(qx+128)
-            symbol_stream.append(qy+128)
-            symbol_stream.append(qz+128)
-        return
-
-    i_pos= len(symbol_stream)
-    symbol_stream.append(78) # 'N'
-    symbol_stream.append(0)
+            symbol_stream[n_sym]= qx+128
+            symbol_stream[n_sym+1]= qy+128
+            symbol_stream[n_sym+2]= qz+128
+            n_sym+= 3
+        return symbol_stream, n_sym
+
+    symbol_stream= grow_int_buffer(symbol_stream, n_sym, 2)
+    i_pos= n_sym
+    symbol_stream[i_pos]= 78 # 'N'
+    symbol_stream[i_pos+1]= 0
+    n_sym+= 2
     half= size*0.5
     quarter= size*0.25
 
-    idx_array= np.zeros(N, dtype=np.uint8)
-    for i in range(N):
-        px= points[i,0]
-        py= points[i,1]
-        pz= points[i,2]
-        mask= 0
-        if px>= center[0]:
-            mask|=1
-        if py>= center[1]:
-            mask|=2
-        if pz>= center[2]:
-            mask|=4
-        idx_array[i]= mask
+    _scatter_octants(points, idx, tmp, lo, hi, center, row)
 
     child_mask= 0
     for oct_idx in range(8):
-        sel= (idx_array== oct_idx)
-        if not np.any(sel):
+        if row[oct_idx+1]== row[oct_idx]:
             continue
-        sub_pts= points[sel]
-        newc= center.copy()
-        if (oct_idx&1):
-            newc[0]+= quarter
-        else:
-            newc[0]-= quarter
-        if (oct_idx&2):
-            newc[1]+= quarter
-        else:
-            newc[1]-= quarter
-        if (oct_idx&4):
-            newc[2]+= quarter
-        else:
-            newc[2]-= quarter
         child_mask|= (1<<oct_idx)
-        subdivide_l2_jit(sub_pts, newc, half, error_bound,
-                         max_depth, depth+1, symbol_stream)
+        symbol_stream, n_sym= subdivide_l2_jit(points, tmp, idx, row[oct_idx], row[oct_idx+1],
+                                               _child_center(center, oct_idx, quarter), half,
+                                               error_bound, max_depth, depth+1,
+                                               symbol_stream, n_sym, scratch)
 
     symbol_stream[i_pos+1]= child_mask
+    return symbol_stream, n_sym
+
+@njit
+def _points_bbox(pts: np.ndarray):
+    """
+    一趟取得各軸 min/max (比 pts.min(axis=0) / pts.max(axis=0) 兩次 strided 掃描快)
+    """
+    mn= np.empty(3, dtype=np.float64)
+    mx= np.empty(3, dtype=np.float64)
+    for k in range(3):
+        mn[k]= pts[0,k]
+        mx[k]= pts[0,k]
+    for i in range(1, pts.shape[0]):
+        for k in range(3):
+            v= pts[i,k]
+            if v< mn[k]:
+                mn[k]= v
+            if v> mx[k]:
+                mx[k]= v
+    return mn, mx
+
+def octree_root_cell(pts: np.ndarray):
+    """
+    根節點 bounding cube => (center float64, size)；min/max 在原 dtype 上取，結果以 float64 計算
+    """
+    mn, mx= _points_bbox(pts)
+    center= (mn+ mx)*0.5
+    return center, float(np.max(mx- mn))
+
+def octree_symbol_buffer(n: int, max_depth: int) -> np.ndarray:
+    """
+    EB-HC-3D symbol 緩衝初始容量: 每點 3 個殘差 + 葉標頭 / 分割節點約每點 1 個，
+    另留 max_depth 層路徑的 'N' 節點；不足時 subdivide_* 以 grow_int_buffer 擴充
+    """
+    return np.empty(4*n+ 2*max_depth+ 16, dtype=np.int32)
+
+def build_octree_parallel(pts: np.ndarray, subdivide, error_counts, error_bound: float,
+                          max_depth: int, workers: Optional[int] = None,
+                          split_levels: int = OCTREE_SPLIT_LEVELS) -> np.ndarray:
+    """
+    平行建 EB-HC-3D Octree (subdivide = subdivide_axis_jit / subdivide_l2_jit):
+      - 前 split_levels 層在主執行緒判斷是否為葉、分割並輸出 'N' + child_mask
+      - 其下每棵子樹 (以及頂層的葉) 為一個 job，在 thread pool 上以 nogil kernel 建
+      - 依前序把各段 symbol 串起 => 與單執行緒 build_octree 逐位元相同
+    """
+    center, size= octree_root_cell(pts)
+    idx, _, tmp= octree_index_buffers(pts.shape[0])
+    segments= []   # np.ndarray (頂層 'N' 節點) 或 job tuple
+    st= [(idx, tmp, 0, pts.shape[0], center, size, 0)]
+    while st:
+        src, dst, lo, hi, c, sz, depth= st.pop()
+        row= np.empty(OCTREE_SPLIT_ROW, dtype=np.int64)
+        if (depth>= split_levels or depth>= max_depth
+                or error_counts(pts, src, lo, hi, c, row)<= error_bound):
+            segments.append((src, dst, lo, hi, c, sz, depth))
+            continue
+        _scatter_octants(pts, src, dst, lo, hi, c, row)
+        child_mask= 0
+        children= []
+        for oct_idx in range(8):
+            if row[oct_idx+1]== row[oct_idx]:
+                continue
+            child_mask|= (1<<oct_idx)
+            children.append((dst, src, int(row[oct_idx]), int(row[oct_idx+1]),
+                             _child_center(c, oct_idx, sz*0.25), sz*0.5, depth+1))
+        segments.append(np.array([78, child_mask], dtype=np.int32))
+        st.extend(reversed(children))
+
+    def build(job):
+        src, dst, lo, hi, c, sz, depth= job
+        buf, n_sym= subdivide(pts, src, dst, lo, hi, c, sz, error_bound, max_depth, depth,
+                              octree_symbol_buffer(hi- lo, max_depth), 0,
+                              octree_split_scratch(max_depth))
+        return buf[:n_sym]
+
+    jobs= [sg for sg in segments if isinstance(sg, tuple)]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        built= iter(list(ex.map(build, jobs)))
+    return np.concatenate([next(built) if isinstance(sg, tuple) else sg for sg in segments])
 
 class OctreeEncoderAxisNumba:
-    def __init__(self, max_depth=10, error_bound=0.20):
-        from numba.typed import List as NumbaList
+    def __init__(self, max_depth=10, error_bound=0.20, workers: Optional[int] = 1):
         self.max_depth= max_depth
         self.error_bound= error_bound
         self.root_center= None
         self.root_size= 0.0
-        self.symbol_stream= NumbaList.empty_list(numba.int32)
+        self.symbol_stream= np.empty(0, dtype=np.int32)
+        self.workers= workers   # != 1 => 依頂層子樹平行建樹 (見 build_octree_parallel)
 
     def build_octree(self, pts: np.ndarray):
+        """
+        直接在呼叫端的點陣列 (float32 亦可) 上建樹，不轉型、不複製
+        """
         if pts.shape[0]==0:
             return
-        pts= pts.astype(np.float64, copy=False)
-        mn= pts.min(axis=0)
-        mx= pts.max(axis=0)
-        center= (mn+ mx)*0.5
-        size= float(np.max(mx- mn))
+        center, size= octree_root_cell(pts)
         self.root_center= center
         self.root_size= size
-        subdivide_axis_jit(pts, center, size,
-                           self.error_bound, self.max_depth, 0,
-                           self.symbol_stream)
+        if self.workers!= 1:
+            self.symbol_stream= build_octree_parallel(pts, subdivide_axis_jit, _node_axis_error_counts,
+                                                      self.error_bound, self.max_depth,
+                                                      self.workers)
+            return
+        idx, _, tmp= octree_index_buffers(pts.shape[0])
+        buf, n_sym= subdivide_axis_jit(pts, idx, tmp, 0, pts.shape[0], center, size,
+                                       self.error_bound, self.max_depth, 0,
+                                       octree_symbol_buffer(pts.shape[0], self.max_depth), 0,
+                                       octree_split_scratch(self.max_depth))
+        self.symbol_stream= buf[:n_sym]
 
 class OctreeEncoderL2Numba:
-    def __init__(self, max_depth=10, error_bound=0.20):
-        from numba.typed import List as NumbaList
+    def __init__(self, max_depth=10, error_bound=0.20, workers: Optional[int] = 1):
         self.max_depth= max_depth
         self.error_bound= error_bound
         self.root_center= None
         self.root_size= 0.0
-        self.symbol_stream= NumbaList.empty_list(numba.int32)
+        self.symbol_stream= np.empty(0, dtype=np.int32)
+        self.workers= workers   # != 1 => 依頂層子樹平行建樹 (見 build_octree_parallel)
 
     def build_octree(self, pts: np.ndarray):
-        pts= pts.astype(np.float64, copy=False)
+        """
+        直接在呼叫端的點陣列 (float32 亦可) 上建樹，不轉型、不複製
+        """
         if pts.shape[0]==0:
             return
-        mn= pts.min(axis=0)
-        mx= pts.max(axis=0)
-        center= (mn+ mx)*0.5
-        size= float(np.max(mx- mn))
+        center, size= octree_root_cell(pts)
         self.root_center= center
         self.root_size= size
-        subdivide_l2_jit(pts, center, size,
-                         self.error_bound, self.max_depth, 0,
-                         self.symbol_stream)
+        if self.workers!= 1:
+            self.symbol_stream= build_octree_parallel(pts, subdivide_l2_jit, _node_l2_error_counts,
+                                                      self.error_bound, self.max_depth,
+                                                      self.workers)
+            return
+        idx, _, tmp= octree_index_buffers(pts.shape[0])
+        buf, n_sym= subdivide_l2_jit(pts, idx, tmp, 0, pts.shape[0], center, size,
+                                     self.error_bound, self.max_depth, 0,
+                                     octree_symbol_buffer(pts.shape[0], self.max_depth), 0,
+                                     octree_split_scratch(self.max_depth))
+        self.symbol_stream= buf[:n_sym]
+
+###############################################################################
+# (5a) EB-HC-3D 分流熵編碼: 結構 / 遮罩 / 點數 / 各軸殘差各自建模
+###############################################################################
+EBHC3D_LAYOUT_FLAT = 0   # 單一 symbol stream + 單一碼表 (舊格式)
+EBHC3D_LAYOUT_SPLIT = 1  # 依 symbol 種類分成獨立子串流
+EBHC3D_LAYOUT_LOD = 2    # 依層 (BFS) 排列的分段串流，前綴即可解出粗略點雲 (見 (5b))
+EBHC3D_LAYOUT_ROI = 3    # 上層 + 各子樹獨立區塊 (offset 索引)，可只解查詢框內的子樹 (見 (5c))
+EBHC3D_LAYOUTS = {"flat": EBHC3D_LAYOUT_FLAT, "split": EBHC3D_LAYOUT_SPLIT, "lod": EBHC3D_LAYOUT_LOD,
+                  "roi": EBHC3D_LAYOUT_ROI}
+# 各 layout 的子串流名稱 (CodebookCache 的 stream key，順序即串流順序)
+EBHC3D_STREAMS = {
+    "flat": ("symbols",),
+    "split": ("kinds", "masks0", "masks1", "counts", "rx", "ry", "rz"),
+    "lod": (),   # 逐層各自建表，不使用共用 codebook
+    "roi": (),   # 整幀碼表存於串流內，不使用共用 codebook
+}
+
+@njit
+def _split_octree_symbols(sym: np.ndarray, max_depth: int):
+    """
+    依前序走訪把 'N'/'L' symbol stream 拆成:
+      kinds  : 節點種類 (1='N', 0='L')；depth == max_depth 必為葉 => 省略
+      masks  : child mask，mask_ctx = 1 表示其子節點位於 max_depth (最後一層分割)
+      counts : 葉點數 (完整整數，不再拆 4 bytes)
+      rx/ry/rz : 各軸量化殘差 (+128)
+    """
+    n = sym.shape[0]
+    kinds = np.empty(n, dtype=np.int64)
+    masks = np.empty(n, dtype=np.int64)
+    mask_ctx = np.empty(n, dtype=np.int64)
+    counts = np.empty(n, dtype=np.int64)
+    rx = np.empty(n, dtype=np.int64)
+    ry = np.empty(n, dtype=np.int64)
+    rz = np.empty(n, dtype=np.int64)
+    nk = 0
+    nm = 0
+    nc = 0
+    nr = 0
+    stack = np.empty(8*max_depth + 8, dtype=np.int64)
+    stack[0] = 0
+    sp = 1
+    i = 0
+    while sp > 0 and i < n:
+        sp -= 1
+        d = stack[sp]
+        t = sym[i]
+        i += 1
+        if d < max_depth:
+            kinds[nk] = 1 if t == 78 else 0
+            nk += 1
+        if t == 78:
+            m = sym[i]
+            i += 1
+            masks[nm] = m
+            mask_ctx[nm] = 1 if d + 1 >= max_depth else 0
+            nm += 1
+            for c in range(8):
+                if (m >> c) & 1:
+                    stack[sp] = d + 1
+                    sp += 1
+        else:
+            cnt = (sym[i] << 24) | (sym[i+1] << 16) | (sym[i+2] << 8) | sym[i+3]
+            i += 4
+            counts[nc] = cnt
+            nc += 1
+            for j in range(cnt):
+                rx[nr] = sym[i]
+                ry[nr] = sym[i+1]
+                rz[nr] = sym[i+2]
+                i += 3
+                nr += 1
+    return (kinds[:nk], masks[:nm], mask_ctx[:nm], counts[:nc],
+            rx[:nr], ry[:nr], rz[:nr])
+
+@njit
+def _merge_octree_symbols(kinds: np.ndarray, masks0: np.ndarray, masks1: np.ndarray,
+                          counts: np.ndarray, rx: np.ndarray, ry: np.ndarray, rz: np.ndarray,
+                          max_depth: int) -> np.ndarray:
+    """
+    _split_octree_symbols 的反向操作：依相同前序走訪重組單一 symbol stream
+    """
+    nm = masks0.shape[0] + masks1.shape[0]
+    total = 2*nm + 5*counts.shape[0] + 3*rx.shape[0]
+    out = np.empty(total, dtype=np.int64)
+    stack = np.empty(8*max_depth + 8, dtype=np.int64)
+    stack[0] = 0
+    sp = 1
+    o = 0
+    ik = 0
+    im0 = 0
+    im1 = 0
+    ic = 0
+    ir = 0
+    while sp > 0 and o < total:
+        sp -= 1
+        d = stack[sp]
+        is_node = False
+        if d < max_depth:
+            is_node = kinds[ik] == 1
+            ik += 1
+        if is_node:
+            if d + 1 >= max_depth:
+                m = masks1[im1]
+                im1 += 1
+            else:
+                m = masks0[im0]
+                im0 += 1
+            out[o] = 78
+            out[o+1] = m
+            o += 2
+            for c in range(8):
+                if (m >> c) & 1:
+                    stack[sp] = d + 1
+                    sp += 1
+        else:
+            cnt = counts[ic]
+            ic += 1
+            out[o] = 76
+            out[o+1] = (cnt >> 24) & 0xFF
+            out[o+2] = (cnt >> 16) & 0xFF
+            out[o+3] = (cnt >> 8) & 0xFF
+            out[o+4] = cnt & 0xFF
+            o += 5
+            for j in range(cnt):
+                out[o] = rx[ir]
+                out[o+1] = ry[ir]
+                out[o+2] = rz[ir]
+                o += 3
+                ir += 1
+    return out[:o]
+
+def ebhc3d_substreams(symbols: np.ndarray, max_depth: int, layout: str = "split"):
+    """
+    依 layout 切出各子串流 (順序同 EBHC3D_STREAMS[layout])
+    """
+    if layout not in ("flat", "split"):
+        raise ValueError(f"unknown EB-HC-3D layout: {layout}")
+    symbols = np.asarray(symbols, dtype=np.int64)
+    if EBHC3D_LAYOUTS[layout] == EBHC3D_LAYOUT_FLAT:
+        return (symbols,)
+    kinds, masks, mask_ctx, counts, rx, ry, rz = _split_octree_symbols(symbols, max_depth)
+    return (kinds, masks[mask_ctx == 0], masks[mask_ctx == 1], counts, rx, ry, rz)
+
+def pack_ebhc3d_symbols(symbols: np.ndarray, max_depth: int,
+                        entropy: str = "huffman", layout: str = "split",
+                        codebooks: Optional[List[HuffmanCodebook]] = None) -> bytes:
+    """
+    EB-HC-3D symbol stream 熵編碼:
+      flat  : 'B' layout + 單一 pack_symbol_stream
+      split : 'BB' (layout, max_depth) + kinds / masks(2 個深度 context) / counts / rx / ry / rz
+              七個獨立子串流，各自建模、可分開 (平行) 編解碼
+      lod   : 依層排列的分段串流 (見 pack_ebhc3d_lod)
+      roi   : 上層 + 各子樹區塊 (見 pack_ebhc3d_roi)
+    codebooks 給定時 (依子串流順序) 改用共用碼表
+    """
+    if layout == "lod":
+        return pack_ebhc3d_lod(symbols, max_depth, entropy)
+    if layout == "roi":
+        return pack_ebhc3d_roi(symbols, max_depth, entropy)
+    parts = ebhc3d_substreams(symbols, max_depth, layout)
+    cbs = codebooks if codebooks is not None else [None]*len(parts)
+    if EBHC3D_LAYOUTS[layout] == EBHC3D_LAYOUT_FLAT:
+        return struct.pack('B', EBHC3D_LAYOUT_FLAT) + pack_symbol_stream(
+            parts[0], entropy, codebook=cbs[0])
+    out = bytearray(struct.pack('BB', EBHC3D_LAYOUT_SPLIT, max_depth))
+    for part, cb in zip(parts, cbs):
+        out.extend(pack_symbol_stream(part, entropy, codebook=cb))
+    return bytes(out)
+
+def unpack_ebhc3d_symbols(data: bytes, pos: int = 0,
+                          codebooks: Optional[CodebookCache] = None):
+    """
+    解析 pack_ebhc3d_symbols，回傳 (單一 symbol stream, 新 pos)
+    """
+    layout = data[pos]
+    pos += 1
+    if layout == EBHC3D_LAYOUT_FLAT:
+        return unpack_symbol_stream(data, pos, codebooks=codebooks)
+    if layout == EBHC3D_LAYOUT_LOD:
+        raise ValueError("LOD EB-HC-3D stream has no pre-order symbols; use decode_ebhc3d_lod")
+    if layout == EBHC3D_LAYOUT_ROI:
+        return unpack_ebhc3d_roi(data, pos - 1)
+    max_depth = data[pos]
+    pos += 1
+    parts = []
+    for _ in range(7):
+        part, pos = unpack_symbol_stream(data, pos, codebooks=codebooks)
+        parts.append(part)
+    return _merge_octree_symbols(*parts, max_depth), pos
+
+def ebhc3d_build_symbols(pts: np.ndarray, be_cm: float, bound: str = "axis", max_depth: int = 10,
+                         workers: Optional[int] = 1):
+    """
+    建 EB-HC-3D Octree => (symbol stream, root_center, root_size)
+    bound: "axis" 或 "l2"；workers != 1 時依頂層子樹平行建樹 (串流不變)
+    """
+    error_bound= be_cm/100.0
+    if bound=="axis":
+        enc= OctreeEncoderAxisNumba(max_depth, error_bound, workers)
+    else:
+        enc= OctreeEncoderL2Numba(max_depth, error_bound, workers)
+    enc.build_octree(pts)
+    symbols= enc.symbol_stream.astype(np.int64)
+    return symbols, enc.root_center, enc.root_size
 
-def ebhc3d_axis_compress(pts: np.ndarray, be_cm: float) -> bytes:
+def ebhc3d_axis_compress(pts: np.ndarray, be_cm: float, entropy: str = "huffman",
+                        layout: str = "split", codebooks: Optional[CodebookCache] = None,
+                        workers: Optional[int] = 1) -> bytes:
     """
-    EB-HC-3D(Axis) => 3D Octree + Axis bound + Huffman
+    EB-HC-3D(Axis) => 3D Octree + Axis bound + 熵編碼
+    entropy: "huffman" (預設) 或 "rans"，編碼器 ID 存於串流標頭
+    layout : "split" (預設，結構/殘差分流)、"flat" (單一 symbol stream)、
+             "lod" (漸進式) 或 "roi" (子樹區塊索引，見 ebhc3d_decompress_region；只支援 huffman)
+    codebooks 內有 ("EB-HC-3D(Axis)", be_cm) 的共用碼表時改為只帶 codebook ID
+    workers != 1 時平行建樹 (輸出 bytes 與單執行緒相同)
     """
     if len(pts)==0:
         return b""
-    error_bound= be_cm/100.0
     max_depth= 10
-    enc= OctreeEncoderAxisNumba(max_depth, error_bound)
-    enc.build_octree(pts)
-    symbol_stream_py= list(enc.symbol_stream)
-    if len(symbol_stream_py)==0:
+    symbols, mn, ms= ebhc3d_build_symbols(pts, be_cm, "axis", max_depth, workers)
+    if len(symbols)==0:
         return b""
 
-    from collections import defaultdict
-    freq= defaultdict(int)
-    for s in symbol_stream_py:
-        freq[s]+=1
-
-    henc= HuffmanEncoder()
-    root= henc.build_tree(freq)
-    henc.build_code_table(root)
-    encoded_data, real_padding= henc.encode(symbol_stream_py)
-
-    mn= enc.root_center
-    ms= enc.root_size
     meta= struct.pack("dddd", mn[0], mn[1], mn[2], ms)
+    cbs= codebooks.get_streams("EB-HC-3D(Axis)", be_cm, EBHC3D_STREAMS[layout]) if codebooks else None
+    # layout 與熵編碼器 ID 隨串流送出，解碼端自動選擇
+    return meta+ pack_ebhc3d_symbols(symbols, max_depth, entropy, layout, cbs)
 
-    code_bytes= bytearray()
-    for sym, code in henc.code_table.items():
-        code_bytes.append(sym)
-        code_bytes.append(len(code))
-        code_bytes.extend(code.encode('ascii'))
-
-    out= bytearray()
-    out.extend(meta)
-    out.extend(struct.pack('B', real_padding))
-    out.extend(struct.pack('I', len(code_bytes)))
-    out.extend(code_bytes)
-    out.extend(struct.pack('I', len(encoded_data)))
-    out.extend(encoded_data)
-    return bytes(out)
-
-def ebhc3d_l2_compress(pts: np.ndarray, be_cm: float) -> bytes:
+def ebhc3d_l2_compress(pts: np.ndarray, be_cm: float, entropy: str = "huffman",
+                        layout: str = "split", codebooks: Optional[CodebookCache] = None,
+                        workers: Optional[int] = 1) -> bytes:
     """
-    EB-HC-3D(L2) => 3D Octree + L2 bound + Huffman
+    EB-HC-3D(L2) => 3D Octree + L2 bound + 熵編碼
+    entropy: "huffman" (預設) 或 "rans"，編碼器 ID 存於串流標頭
+    layout : "split" (預設，結構/殘差分流)、"flat" (單一 symbol stream)、
+             "lod" (漸進式) 或 "roi" (子樹區塊索引，見 ebhc3d_decompress_region；只支援 huffman)
+    codebooks 內有 ("EB-HC-3D(L2)", be_cm) 的共用碼表時改為只帶 codebook ID
+    workers != 1 時平行建樹 (輸出 bytes 與單執行緒相同)
     """
     if len(pts)==0:
         return b""
-    error_bound= be_cm/100.0
     max_depth= 10
-    enc= OctreeEncoderL2Numba(max_depth, error_bound)
-    enc.build_octree(pts)
-    symbol_stream_py= list(enc.symbol_stream)
-    if len(symbol_stream_py)==0:
+    symbols, mn, ms= ebhc3d_build_symbols(pts, be_cm, "l2", max_depth, workers)
+    if len(symbols)==0:
         return b""
 
-    from collections import defaultdict
-    freq= defaultdict(int)
-    for s in symbol_stream_py:
-        freq[s]+=1
+    meta= struct.pack("dddd", mn[0], mn[1], mn[2], ms)
+    cbs= codebooks.get_streams("EB-HC-3D(L2)", be_cm, EBHC3D_STREAMS[layout]) if codebooks else None
+    # layout 與熵編碼器 ID 隨串流送出，解碼端自動選擇
+    return meta+ pack_ebhc3d_symbols(symbols, max_depth, entropy, layout, cbs)
 
-    henc= HuffmanEncoder()
-    root= henc.build_tree(freq)
-    henc.build_code_table(root)
-    encoded_data, real_padding= henc.encode(symbol_stream_py)
+@njit(nogil=True)
+def _octree_decode_count(sym: np.ndarray):
+    """
+    解碼第一趟: 只走訪 'N'/'L' 結構 (停止條件與原 Python 解碼器相同)，
+    回傳 (可還原的點數, stack 最大深度)；葉內點數直接由剩餘 symbol 數截斷，不逐點迴圈
+    """
+    n= sym.shape[0]
+    pending= 1
+    max_pending= 1
+    total= 0
+    i= 0
+    while pending> 0 and i< n:
+        pending-= 1
+        s= sym[i]
+        i+= 1
+        if s== 78:   # 'N'
+            if i>= n:
+                break
+            child_mask= sym[i]
+            i+= 1
+            for cidx in range(8):
+                if (child_mask>>cidx)&1:
+                    pending+= 1
+            if pending> max_pending:
+                max_pending= pending
+        elif s== 76: # 'L'
+            if i+3>= n:
+                break
+            leaf_count= (sym[i]<<24)|(sym[i+1]<<16)|(sym[i+2]<<8)|sym[i+3]
+            i+= 4
+            k= min(leaf_count, (n- i)//3)
+            total+= k
+            i+= 3*k
+        else:
+            break
+    return total, max_pending
 
-    mn= enc.root_center
-    ms= enc.root_size
-    meta= struct.pack("dddd", mn[0], mn[1], mn[2], ms)
+@njit(nogil=True)
+def _octree_decode_fill(sym: np.ndarray, center: np.ndarray, size: float, quant_step: float,
+                        total: int, max_pending: int) -> np.ndarray:
+    """
+    解碼第二趟: 以陣列 stack (center/size) 前序走訪，把各點直接寫入預先配置的 (total,3) float32
+    """
+    out= np.empty((total, 3), dtype=np.float32)
+    st_c= np.empty((max_pending, 3), dtype=np.float64)
+    st_s= np.empty(max_pending, dtype=np.float64)
+    st_c[0,0]= center[0]
+    st_c[0,1]= center[1]
+    st_c[0,2]= center[2]
+    st_s[0]= size
+    sp= 1
+    n= sym.shape[0]
+    k= 0
+    i= 0
+    while sp> 0 and i< n:
+        sp-= 1
+        cx= st_c[sp,0]
+        cy= st_c[sp,1]
+        cz= st_c[sp,2]
+        cS= st_s[sp]
+        s= sym[i]
+        i+= 1
+        if s== 78:   # 'N'
+            if i>= n:
+                break
+            child_mask= sym[i]
+            i+= 1
+            quarter= cS/4
+            half= cS/2
+            for cidx in range(7, -1, -1):
+                if (child_mask>>cidx)&1:
+                    st_c[sp,0]= cx+ quarter if (cidx&1) else cx- quarter
+                    st_c[sp,1]= cy+ quarter if (cidx&2) else cy- quarter
+                    st_c[sp,2]= cz+ quarter if (cidx&4) else cz- quarter
+                    st_s[sp]= half
+                    sp+= 1
+        elif s== 76: # 'L'
+            if i+3>= n:
+                break
+            leaf_count= (sym[i]<<24)|(sym[i+1]<<16)|(sym[i+2]<<8)|sym[i+3]
+            i+= 4
+            m= min(leaf_count, (n- i)//3)
+            for _ in range(m):
+                out[k,0]= cx+ (sym[i]-128)* quant_step
+                out[k,1]= cy+ (sym[i+1]-128)* quant_step
+                out[k,2]= cz+ (sym[i+2]-128)* quant_step
+                i+= 3
+                k+= 1
+        else:
+            break
+    return out
 
-    code_bytes= bytearray()
-    for sym, code in henc.code_table.items():
-        code_bytes.append(sym)
-        code_bytes.append(len(code))
-        code_bytes.extend(code.encode('ascii'))
-
-    out= bytearray()
-    out.extend(meta)
-    out.extend(struct.pack('B', real_padding))
-    out.extend(struct.pack('I', len(code_bytes)))
-    out.extend(code_bytes)
-    out.extend(struct.pack('I', len(encoded_data)))
-    out.extend(encoded_data)
-    return bytes(out)
+def decode_octree_symbols(symbols: np.ndarray, center: np.ndarray, size: float,
+                          quant_step: float) -> np.ndarray:
+    """
+    EB-HC-3D symbol stream => (N,3) float32 (Axis/L2 共用)
+    第一趟由葉標頭算出總點數，第二趟寫入預先配置的陣列
+    """
+    sym= np.ascontiguousarray(symbols, dtype=np.int64)
+    total, max_pending= _octree_decode_count(sym)
+    return _octree_decode_fill(sym, np.asarray(center, dtype=np.float64), float(size),
+                               float(quant_step), total, max_pending)
 
 class OctreeDecoderAxis:
     def __init__(self, error_bound=0.20):
         self.error_bound= error_bound
         self.quant_step= error_bound
-        self.decoded_points: List[List[float]]= []
-
-    def decode(self, symbol_stream: List[int], center: np.ndarray, size: float):
-        stack= [(center.copy(), size)]
-        i=0
-        n= len(symbol_stream)
-        while stack and i<n:
-            cC, cS= stack.pop()
-            sym= symbol_stream[i]
-            i+=1
-            if sym==78: # 'N'
-                child_mask= symbol_stream[i]
-                i+=1
-                quarter= cS/4
-                half= cS/2
-                for cidx in reversed(range(8)):
-                    if (child_mask>>cidx)&1:
-                        newc= cC.copy()
-                        if (cidx&1):
-                            newc[0]+= quarter
-                        else:
-                            newc[0]-= quarter
-                        if (cidx&2):
-                            newc[1]+= quarter
-                        else:
-                            newc[1]-= quarter
-                        if (cidx&4):
-                            newc[2]+= quarter
-                        else:
-                            newc[2]-= quarter
-                        stack.append((newc, half))
-            elif sym==76: # 'L'
-                if i+3>= n:
-                    break
-                n3= symbol_stream[i]
-                n2= symbol_stream[i+1]
-                n1= symbol_stream[i+2]
-                n0= symbol_stream[i+3]
-                i+=4
-                leaf_count= (n3<<24)|(n2<<16)|(n1<<8)|n0
-                for _ in range(leaf_count):
-                    if i+2>= n:
-                        break
-                    x= symbol_stream[i]
-                    y= symbol_stream[i+1]
-                    z= symbol_stream[i+2]
-                    i+=3
-                    rx= cC[0]+ (x-128)* self.quant_step
-                    ry= cC[1]+ (y-128)* self.quant_step
-                    rz= cC[2]+ (z-128)* self.quant_step
-                    self.decoded_points.append([rx, ry, rz])
-            else:
-                break
+        self.decoded_points= np.empty((0,3), dtype=np.float32)
 
-def ebhc3d_axis_decompress(data: bytes, be_cm: float) -> np.ndarray:
-    if not data:
+    def decode(self, symbol_stream: np.ndarray, center: np.ndarray, size: float):
+        """
+        compiled 兩趟解碼 (見 decode_octree_symbols)，結果為 (N,3) float32 陣列
+        """
+        self.decoded_points= decode_octree_symbols(symbol_stream, center, size, self.quant_step)
+
+def ebhc3d_axis_decompress(data: bytes, be_cm: float,
+                           codebooks: Optional[CodebookCache] = None,
+                           max_level: Optional[int] = None) -> np.ndarray:
+    """
+    max_level 給定時只解到該深度 (該層佔用格的中心 + 較淺的葉)；
+    LOD layout 的串流可被截斷，解出完整收到的各層
+    """
+    if len(data)< 33:
         return np.empty((0,3), dtype=np.float32)
     pos=0
     meta= data[:32]
     cx, cy, cz, size= struct.unpack("dddd", meta)
     center= np.array([cx,cy,cz], dtype=np.float64)
     pos+=32
+    error_bound= be_cm/100.0
+    if data[pos]== EBHC3D_LAYOUT_LOD:
+        return decode_ebhc3d_lod(data, pos, center, size, error_bound, max_level)
 
-    real_padding= data[pos]
-    pos+=1
-
-    code_size= struct.unpack('I', data[pos:pos+4])[0]
-    pos+=4
-    code_bytes= data[pos:pos+code_size]
-    pos+= code_size
-
-    code_table={}
-    i=0
-    while i< len(code_bytes):
-        sym= code_bytes[i]
-        code_len= code_bytes[i+1]
-        code_str= code_bytes[i+2:i+2+code_len].decode('ascii')
-        code_table[sym]= code_str
-        i+= (2+ code_len)
-
-    data_size= struct.unpack('I', data[pos:pos+4])[0]
-    pos+=4
-    encoded_data= data[pos:pos+ data_size]
-    pos+= data_size
-
-    hdec= HuffmanDecoder(code_table)
-    symbol_stream= hdec.decode(encoded_data, real_padding)
+    symbols, pos= unpack_ebhc3d_symbols(data, pos, codebooks)
+    if max_level is not None:
+        return octree_lod_points(ebhc3d_lod_levels(symbols)[:max_level+1],
+                                 center, size, error_bound)
 
-    error_bound= be_cm/100.0
     dec= OctreeDecoderAxis(error_bound)
-    dec.decode(symbol_stream, center, size)
-    return np.array(dec.decoded_points, dtype=np.float32)
+    dec.decode(symbols, center, size)
+    return dec.decoded_points
 
 class OctreeDecoderL2:
     def __init__(self, error_bound=0.20):
         self.error_bound= error_bound
         self.quant_step= error_bound
-        self.decoded_points: List[List[float]]= []
-
-    def decode(self, symbol_stream: List[int], center: np.ndarray, size: float):
-        stack= [(center.copy(), size)]
-        i=0
-        n= len(symbol_stream)
-        while stack and i<n:
-            cC, cS= stack.pop()
-            sym= symbol_stream[i]
-            i+=1
-            if sym==78: # 'N'
-                child_mask= symbol_stream[i]
-                i+=1
-                quarter= cS/4
-                half= cS/2
-                for cidx in reversed(range(8)):
-                    if (child_mask>>cidx)&1:
-                        newc= cC.copy()
-                        if (cidx&1):
-                            newc[0]+= quarter
-                        else:
-                            newc[0]-= quarter
-                        if (cidx&2):
-                            newc[1]+= quarter
-                        else:
-                            newc[1]-= quarter
-                        if (cidx&4):
-                            newc[2]+= quarter
-                        else:
-                            newc[2]-= quarter
-                        stack.append((newc, half))
-            elif sym==76: # 'L'
-                if i+3>=n:
-                    break
-                n3= symbol_stream[i]
-                n2= symbol_stream[i+1]
-                n1= symbol_stream[i+2]
-                n0= symbol_stream[i+3]
-                i+=4
-                leaf_count= (n3<<24)|(n2<<16)|(n1<<8)|n0
-                for _ in range(leaf_count):
-                    if i+2>= n:
-                        break
-                    x= symbol_stream[i]
-                    y= symbol_stream[i+1]
-                    z= symbol_stream[i+2]
-                    i+=3
-                    rx= cC[0]+ (x-128)* self.quant_step
-                    ry= cC[1]+ (y-128)* self.quant_step
-                    rz= cC[2]+ (z-128)* self.quant_step
-                    self.decoded_points.append([rx, ry, rz])
-            else:
-                break
+        self.decoded_points= np.empty((0,3), dtype=np.float32)
 
-def ebhc3d_l2_decompress(data: bytes, be_cm: float) -> np.ndarray:
-    if not data:
+    def decode(self, symbol_stream: np.ndarray, center: np.ndarray, size: float):
+        """
+        compiled 兩趟解碼 (見 decode_octree_symbols)，結果為 (N,3) float32 陣列
+        """
+        self.decoded_points= decode_octree_symbols(symbol_stream, center, size, self.quant_step)
+
+def ebhc3d_l2_decompress(data: bytes, be_cm: float,
+                         codebooks: Optional[CodebookCache] = None,
+                         max_level: Optional[int] = None) -> np.ndarray:
+    """
+    max_level 給定時只解到該深度 (該層佔用格的中心 + 較淺的葉)；
+    LOD layout 的串流可被截斷，解出完整收到的各層
+    """
+    if len(data)< 33:
         return np.empty((0,3), dtype=np.float32)
     pos=0
     meta= data[:32]
     cx, cy, cz, size= struct.unpack("dddd", meta)
     center= np.array([cx,cy,cz], dtype=np.float64)
     pos+=32
+    error_bound= be_cm/100.0
+    if data[pos]== EBHC3D_LAYOUT_LOD:
+        return decode_ebhc3d_lod(data, pos, center, size, error_bound, max_level)
+
+    symbols, pos= unpack_ebhc3d_symbols(data, pos, codebooks)
+    if max_level is not None:
+        return octree_lod_points(ebhc3d_lod_levels(symbols)[:max_level+1],
+                                 center, size, error_bound)
+
+    dec= OctreeDecoderL2(error_bound)
+    dec.decode(symbols, center, size)
+    return dec.decoded_points
+
+
+###############################################################################
+# (5b) EB-HC-3D 漸進式 (LOD) 串流: 依層排列，可截斷 / 指定 max_level 解碼
+###############################################################################
+@njit
+def _octree_symbol_nodes(sym: np.ndarray):
+    """
+    前序 'N'/'L' symbol stream => 各節點 (depth, mask (葉為 0), 葉點數, 殘差起點)
+    停止條件同 _octree_decode_count；被截斷的葉只計入串流內完整的點
+    """
+    n= sym.shape[0]
+    cap= n//2+ 1
+    depth= np.empty(cap, dtype=np.int64)
+    mask= np.empty(cap, dtype=np.int64)
+    count= np.empty(cap, dtype=np.int64)
+    roff= np.empty(cap, dtype=np.int64)
+    st= np.empty(64, dtype=np.int64)
+    st[0]= 0
+    sp= 1
+    m= 0
+    i= 0
+    while sp> 0 and i< n:
+        sp-= 1
+        d= st[sp]
+        s= sym[i]
+        i+= 1
+        if s== 78:   # 'N'
+            if i>= n:
+                break
+            child_mask= sym[i]& 0xFF
+            i+= 1
+            depth[m]= d
+            mask[m]= child_mask
+            count[m]= 0
+            roff[m]= i
+            m+= 1
+            st= grow_int_buffer(st, sp, 8)
+            for cidx in range(8):
+                if (child_mask>>cidx)&1:
+                    st[sp]= d+ 1
+                    sp+= 1
+        elif s== 76: # 'L'
+            if i+3>= n:
+                break
+            leaf_count= (sym[i]<<24)|(sym[i+1]<<16)|(sym[i+2]<<8)|sym[i+3]
+            i+= 4
+            k= min(leaf_count, (n- i)//3)
+            depth[m]= d
+            mask[m]= 0
+            count[m]= k
+            roff[m]= i
+            m+= 1
+            i+= 3*k
+        else:
+            break
+    return depth[:m], mask[:m], count[:m], roff[:m]
+
+def _gather_leaf_residuals(sym: np.ndarray, roff: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    各葉的殘差 (從 sym[roff] 起 counts*3 個) 依序串起 => (sum(counts), 3)
+    """
+    total= int(counts.sum())
+    if total== 0:
+        return np.empty((0,3), dtype=np.int64)
+    first= np.cumsum(counts)- counts
+    rows= np.repeat(roff, counts)+ 3*(np.arange(total)- np.repeat(first, counts))
+    return sym[rows[:,None]+ np.arange(3)]
+
+def ebhc3d_lod_levels(symbols: np.ndarray):
+    """
+    前序 symbol stream => 逐層 [(masks, counts, residuals)]
+    同一層內前序的先後即為 BFS 順序 (皆為路徑的字典序)，故依 depth 穩定排序即可
+      masks     : 該層各節點 child mask (葉為 0)
+      counts    : 該層各葉的點數
+      residuals : 該層各葉的量化殘差 (+128)，(sum(counts), 3)
+    """
+    sym= np.ascontiguousarray(symbols, dtype=np.int64)
+    depth, mask, count, roff= _octree_symbol_nodes(sym)
+    if depth.size== 0:
+        return []
+    order= np.argsort(depth, kind="stable")
+    bounds= np.searchsorted(depth[order], np.arange(int(depth.max())+ 2))
+    levels= []
+    for d in range(bounds.size- 1):
+        ids= order[bounds[d]:bounds[d+1]]
+        masks= mask[ids]
+        leaves= ids[masks== 0]
+        levels.append((masks, count[leaves], _gather_leaf_residuals(sym, roff[leaves], count[leaves])))
+    return levels
+
+def octree_lod_points(levels, center: np.ndarray, size: float, quant_step: float) -> np.ndarray:
+    """
+    逐層重建點雲 (levels: [(masks, counts, residuals 或 None)]，第 0 層為根):
+      - 有殘差的葉 => 原精度點 (cell center + (r-128)*quant_step，與前序解碼器同一算式)
+      - 沒有殘差的葉、以及最後一層的分割節點 => 該格中心
+    子節點依 (父節點, child 編號) 順序展開，即下一層的 BFS 順序
+    """
+    cen= np.asarray(center, dtype=np.float64).reshape(1,3)
+    cS= float(size)
+    out= []
+    for d, (masks, counts, res) in enumerate(levels):
+        masks= np.asarray(masks, dtype=np.int64)
+        cen= cen[:masks.size]
+        masks= masks[:cen.shape[0]]
+        leaf= masks== 0
+        leaf_c= cen[leaf]
+        if res is not None:
+            counts= np.asarray(counts, dtype=np.int64)[:leaf_c.shape[0]]
+            base= np.repeat(leaf_c[:counts.size], counts, axis=0)
+            k= min(base.shape[0], res.shape[0])
+            out.append(base[:k]+ (np.asarray(res[:k], dtype=np.int64)- 128)* quant_step)
+        else:
+            out.append(leaf_c)
+        if d== len(levels)- 1:
+            out.append(cen[~leaf])
+            break
+        bits= (masks[~leaf, None]>> np.arange(8))& 1
+        parent, cidx= np.nonzero(bits)
+        quarter= cS/4
+        sign= np.stack([(cidx&1)>0, (cidx&2)>0, (cidx&4)>0], axis=1)
+        cen= cen[~leaf][parent]+ np.where(sign, quarter, -quarter)
+        cS= cS/2
+    if not out:
+        return np.empty((0,3), dtype=np.float32)
+    return np.concatenate(out).astype(np.float32)
+
+def pack_ebhc3d_lod(symbols: np.ndarray, max_depth: int, entropy: str = "huffman") -> bytes:
+    """
+    LOD 串流: 'BBB' (layout, max_depth, 層數)
+      + 各層結構區段 (先淺後深): '<I' 長度 + masks 串流 (depth == max_depth 必為葉 => 省略) + counts 串流
+      + 各層殘差區段 (先淺後深): '<I' 長度 + rx / ry / rz 串流
+    結構遠小於殘差 => 前段 bytes 即含多層佔用格；截斷只會丟掉完整性不足的區段
+    """
+    levels= ebhc3d_lod_levels(symbols)
+    out= bytearray(struct.pack('BBB', EBHC3D_LAYOUT_LOD, max_depth, len(levels)))
+    for d, (masks, counts, _) in enumerate(levels):
+        body= (pack_symbol_stream(masks, entropy) if d< max_depth else b"")+ pack_symbol_stream(counts, entropy)
+        out.extend(struct.pack('<I', len(body))+ body)
+    for _, _, res in levels:
+        body= b"".join(pack_symbol_stream(res[:,k], entropy) for k in range(3))
+        out.extend(struct.pack('<I', len(body))+ body)
+    return bytes(out)
 
-    real_padding= data[pos]
-    pos+=1
+def _lod_chunks(data: bytes, pos: int, count: int):
+    """
+    連續 count 個 '<I' 長度前綴區段 => (完整收到的各區段起點, 其後 pos)；遇到截斷即停止
+    """
+    starts= []
+    for _ in range(count):
+        if pos+ 4> len(data):
+            break
+        n= struct.unpack('<I', data[pos:pos+4])[0]
+        if pos+ 4+ n> len(data):
+            break
+        starts.append(pos+ 4)
+        pos+= 4+ n
+    return starts, pos
 
-    code_size= struct.unpack('I', data[pos:pos+4])[0]
-    pos+=4
-    code_bytes= data[pos:pos+code_size]
-    pos+= code_size
+def decode_ebhc3d_lod(data: bytes, pos: int, center: np.ndarray, size: float,
+                      quant_step: float, max_level: Optional[int] = None) -> np.ndarray:
+    """
+    解析 pack_ebhc3d_lod (data 可為截斷的前綴):
+      解到 L = min(max_level, 最後一個完整結構層)；殘差區段完整收到的層輸出原精度點，其餘輸出格中心
+    """
+    if pos+ 3> len(data):
+        return np.empty((0,3), dtype=np.float32)
+    _, max_depth, n_levels= struct.unpack('BBB', data[pos:pos+3])
+    pos+= 3
+    s_starts, pos= _lod_chunks(data, pos, n_levels)
+    r_starts= _lod_chunks(data, pos, n_levels)[0] if len(s_starts)== n_levels else []
+    last= len(s_starts)- 1 if max_level is None else min(max_level, len(s_starts)- 1)
+    levels= []
+    n_nodes= 1
+    for d in range(last+ 1):
+        p= s_starts[d]
+        if d< max_depth:
+            masks, p= unpack_symbol_stream(data, p)
+        else:
+            masks= np.zeros(n_nodes, dtype=np.int64)
+        counts, p= unpack_symbol_stream(data, p)
+        res= None
+        if d< len(r_starts):
+            p= r_starts[d]
+            axes= []
+            for _ in range(3):
+                a, p= unpack_symbol_stream(data, p)
+                axes.append(a)
+            res= np.stack(axes, axis=1)
+        levels.append((masks, counts, res))
+        n_nodes= int(((masks[:,None]>> np.arange(8))& 1).sum())
+    return octree_lod_points(levels, center, size, quant_step)
 
-    code_table={}
-    i=0
-    while i< len(code_bytes):
-        sym= code_bytes[i]
-        code_len= code_bytes[i+1]
-        code_str= code_bytes[i+2:i+2+code_len].decode('ascii')
-        code_table[sym]= code_str
-        i+= (2+ code_len)
 
-    data_size= struct.unpack('I', data[pos:pos+4])[0]
-    pos+=4
-    encoded_data= data[pos:pos+ data_size]
-    pos+= data_size
+###############################################################################
+# (5c) EB-HC-3D ROI 隨機存取: 子樹區塊 + offset 索引，只解查詢框內的子樹
+###############################################################################
+def _octree_subtree_spans(sym: np.ndarray, level: int):
+    """
+    前序 symbol stream 中深度 == level 的各子樹 => (起點, 終點) 陣列
+    子樹延伸到下一個深度 <= level 的節點 (或串流結尾)
+    """
+    depth, mask, _, roff= _octree_symbol_nodes(sym)
+    start= roff- np.where(mask> 0, 2, 5)
+    at= np.nonzero(depth== level)[0]
+    shallow= np.nonzero(depth<= level)[0]
+    nxt= np.searchsorted(shallow, at, side='right')
+    end= np.where(nxt< shallow.size, start[shallow[np.minimum(nxt, shallow.size- 1)]], sym.size)
+    return start[at], end
+
+# EB-HC-3D 根格為立方體、點雲多半扁平 => 切深一層 (格子多為空) 仍只多約 2% bytes
+EBHC3D_ROI_LEVELS = ROI_INDEX_LEVELS+ 1
+
+def pack_ebhc3d_roi(symbols: np.ndarray, max_depth: int, entropy: str = "huffman",
+                    levels: int = EBHC3D_ROI_LEVELS) -> bytes:
+    """
+    ROI 串流: 'BBB' (layout, max_depth, 切割深度 K)
+      + 上層 symbol stream (去掉深度 K 的子樹，pack_symbol_stream)
+      + pack_indexed_blocks: 每棵深度 K 子樹一個區塊，內含 split layout 的七個子串流
+    子樹的格子由上層結構即可算出 => 解碼端先解上層，再只解與查詢框相交的子樹
+    區塊固定為 canonical Huffman => entropy 只接受 "huffman" (見 check_indexed_entropy)
+    """
+    check_indexed_entropy(entropy)
+    sym= np.ascontiguousarray(symbols, dtype=np.int64)
+    K= min(levels, max_depth)
+    starts, ends= _octree_subtree_spans(sym, K)
+    keep= np.ones(sym.size, dtype=bool)
+    blocks= []
+    for a, b in zip(starts, ends):
+        keep[a:b]= False
+        blocks.append(ebhc3d_substreams(sym[a:b], max_depth- K, "split"))
+    return (struct.pack('BBB', EBHC3D_LAYOUT_ROI, max_depth, K)
+            + pack_symbol_stream(sym[keep], entropy)
+            + pack_indexed_blocks(blocks, len(EBHC3D_STREAMS["split"])))
+
+def _ebhc3d_roi_header(data: bytes, pos: int):
+    """
+    => (max_depth, K, 上層 symbols, IndexedBlockReader)
+    """
+    _, max_depth, K= struct.unpack('BBB', data[pos:pos+3])
+    top, pos= unpack_symbol_stream(data, pos+ 3)
+    return max_depth, K, top, IndexedBlockReader(data, pos)
 
-    hdec= HuffmanDecoder(code_table)
-    symbol_stream= hdec.decode(encoded_data, real_padding)
+def _ebhc3d_roi_walk(top: np.ndarray, center: np.ndarray, size: float, level: int):
+    """
+    前序走訪上層 symbols (深度 level 的節點已抽出):
+      => subtrees: 各子樹 (插回位置, center, size)；leaves: 上層各葉 (起點, 終點, center, size)
+    """
+    subtrees, leaves= [], []
+    st= [(np.asarray(center, dtype=np.float64), float(size), 0)]
+    n= top.shape[0]
+    i= 0
+    while st:
+        c, cS, d= st.pop()
+        if d== level:
+            subtrees.append((i, c, cS))
+            continue
+        if i>= n:
+            break
+        if top[i]== 78:   # 'N'
+            child_mask= int(top[i+1])
+            i+= 2
+            for cidx in range(7, -1, -1):
+                if (child_mask>>cidx)&1:
+                    st.append((_child_center(c, cidx, cS/4), cS/2, d+ 1))
+        else:             # 'L'
+            leaf_count= (int(top[i+1])<<24)|(int(top[i+2])<<16)|(int(top[i+3])<<8)|int(top[i+4])
+            hi= i+ 5+ 3*leaf_count
+            leaves.append((i, hi, c, cS))
+            i= hi
+    return subtrees, leaves
+
+def unpack_ebhc3d_roi(data: bytes, pos: int):
+    """
+    完整解 ROI 串流 => (前序 symbol stream, 串流結尾 pos)；子樹依序插回上層
+    """
+    max_depth, K, top, reader= _ebhc3d_roi_header(data, pos)
+    subtrees, _= _ebhc3d_roi_walk(top, np.zeros(3), 1.0, K)
+    parts= [_merge_octree_symbols(*reader.block(j), max_depth- K) for j in range(len(reader))]
+    k= min(len(subtrees), len(parts))
+    return splice_subtree_streams(top, [off for off, _, _ in subtrees[:k]], parts[:k]), reader.end
+
+def decode_ebhc3d_roi(data: bytes, pos: int, center: np.ndarray, size: float,
+                      quant_step: float, aabb) -> np.ndarray:
+    """
+    ROI 解碼: 上層的葉全部還原；子樹只在其格子 (外擴 quant_step) 與查詢框相交時才熵解碼
+    """
+    max_depth, K, top, reader= _ebhc3d_roi_header(data, pos)
+    subtrees, leaves= _ebhc3d_roi_walk(top, center, size, K)
+    lo, hi= aabb_bounds(aabb)
+    parts= [decode_octree_symbols(top[a:b], c, cS, quant_step) for a, b, c, cS in leaves]
+    for j, (_, c, cS) in enumerate(subtrees[:len(reader)]):
+        r= cS/2+ quant_step
+        if np.all(c- r<= hi) and np.all(c+ r>= lo):
+            sub= _merge_octree_symbols(*reader.block(j), max_depth- K)
+            parts.append(decode_octree_symbols(sub, c, cS, quant_step))
+    if not parts:
+        return np.empty((0,3), dtype=np.float32)
+    return crop_to_aabb(np.concatenate(parts), aabb)
 
+def ebhc3d_decompress_region(data: bytes, be_cm: float, aabb,
+                             codebooks: Optional[CodebookCache] = None) -> np.ndarray:
+    """
+    只還原查詢框 aabb ((xmin,ymin,zmin),(xmax,ymax,zmax)) 內的點 (Axis/L2 共用)；
+    layout="roi" 時跳過不相交子樹的熵解碼，其他 layout 完整解壓後裁切
+    """
+    if len(data)< 33:
+        return np.empty((0,3), dtype=np.float32)
+    cx, cy, cz, size= struct.unpack("dddd", data[:32])
+    center= np.array([cx,cy,cz], dtype=np.float64)
     error_bound= be_cm/100.0
-    dec= OctreeDecoderL2(error_bound)
-    dec.decode(symbol_stream, center, size)
-    return np.array(dec.decoded_points, dtype=np.float32)
+    if data[32]== EBHC3D_LAYOUT_ROI:
+        return decode_ebhc3d_roi(data, 32, center, size, error_bound, aabb)
+    return crop_to_aabb(ebhc3d_axis_decompress(data, be_cm, codebooks), aabb)
 
 
 ###############################################################################
@@ -1525,21 +3312,85 @@ def aggregate_single_results(scene_name: str, single_scene_results: List[dict])
     return aggregated_list
 
 
+###############################################################################
+# (6a) 共用 codebook 訓練: 以一組訓練幀對每個 (method, BE) 建靜態碼表
+###############################################################################
+CODEBOOK_TRAIN_FRAMES = 10   # main(): 每個場景用於訓練 codebook 的 held-out bin 數
+
+def train_codebooks(cache: CodebookCache, frames: List[np.ndarray], BE_list,
+                    scale_factor=1000) -> CodebookCache:
+    """
+    對 Huffman / EB-HC-3D (split layout) 的每個子串流訓練 codebook 並放入 cache。
+    EB-HC (value / dict) 不訓練: 各軸字母表 (絕對座標 / 每幀字典的索引) 換一幀就對不上，
+    大多數 symbol 會走 escape。
+    frames: 訓練用點雲 (每幀 Nx3 float)，須與評估的幀分開 (held-out)，否則碼表結果偏樂觀；
+    訓練完可呼叫 cache.save() 存檔。
+    """
+    qframes= [np.round(p* scale_factor).astype(np.int32) for p in frames]
+    cache.train("Huffman", 0, HUFFMAN_STREAMS,
+                [(np.frombuffer(q.tobytes(), dtype=np.uint8),) for q in qframes])
+    for be_cm in BE_list:
+        for method, bound in (("EB-HC-3D(Axis)", "axis"), ("EB-HC-3D(L2)", "l2")):
+            parts= []
+            for p in frames:
+                symbols, _, _= ebhc3d_build_symbols(p, be_cm, bound)
+                parts.append(ebhc3d_substreams(symbols, 10, "split"))
+            cache.train(method, be_cm, EBHC3D_STREAMS["split"], parts)
+    return cache
+
+
 ###############################################################################
 # (7) run_all_methods(pts, scene_label, filename="")
 ###############################################################################
-def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[dict]:
+CODEC_WARMUP_POINTS = 4096   # 暖機用的點數 (只為觸發 numba 編譯)
+
+def warm_up_codecs(pts: np.ndarray, huffman_block_size: int = 0,
+                   codebooks: Optional[CodebookCache] = None, be_cm: float = 1.0):
+    """
+    以前 CODEC_WARMUP_POINTS 個點把各方法的編碼 / 解碼各走一次 (與計時路徑相同的型別與分支)，
+    讓 numba kernel 先完成 JIT 編譯，避免第一幀 / 第一個 BE 的時間含編譯成本
+    """
+    sub= pts[:CODEC_WARMUP_POINTS]   # 保留原陣列的 dtype / layout，kernel 特化才會相同
+    if len(sub)== 0:
+        return
+    qsub= np.round(sub* 1000).astype(np.int32)
+    raw_bytes= qsub.tobytes()
+    huff_cb= codebooks.get("Huffman", 0, HUFFMAN_STREAMS[0]) if codebooks else None
+    if huffman_block_size>0 or huff_cb is not None:
+        huffman_decoding_stream(huffman_encoding_stream(raw_bytes, huffman_block_size, huff_cb),
+                                codebooks=codebooks)
+    else:
+        huffman_decoding(*huffman_encoding(raw_bytes))
+    for bound, decode_fn in (("axis", ebhc_decode_axis), ("l2", ebhc_decode_l2)):
+        for layout in EBHC_LAYOUTS:
+            for data in ebhc_encode_batch(qsub, [be_cm], 1000, bound, huffman_block_size,
+                                          layout=layout):
+                decode_fn(data, codebooks=codebooks)
+    for cls in (EBOctreeAxisCompressor, EBOctreeL2Compressor):
+        comp= cls(be_cm/100.0,1,1000.0,32)
+        comp.decompress(comp.compress(sub))
+    ebhc3d_axis_decompress(ebhc3d_axis_compress(sub, be_cm, codebooks=codebooks), be_cm, codebooks)
+    ebhc3d_l2_decompress(ebhc3d_l2_compress(sub, be_cm, codebooks=codebooks), be_cm, codebooks)
+
+def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="",
+                    huffman_block_size: int = 0,
+                    codebooks: Optional[CodebookCache] = None) -> List[dict]:
     """
-    同一批點做以下七種壓縮方法:
+    同一批點做以下九種壓縮方法:
       1. Huffman
       2. EB-HC(Axis)
       3. EB-HC(L2)
+      2b/3b. EB-HC-Dict(Axis)/(L2) (delta 字典 + 每點索引)
       4. EB-Octree(Axis)
       5. EB-Octree(L2)
       6. EB-HC-3D(Axis)
       7. EB-HC-3D(L2)
 
     如 filename!= ""，則在結果 dict 中加上 "Filename" 欄位。
+    huffman_block_size > 0 時 Huffman / EB-HC 串流分 block 編碼 (附 offset 索引)，
+    解碼端以 thread pool 平行解各 block，適合多幀合併的大點雲。
+    codebooks 給定時 Huffman / EB-HC-3D 改用其中已訓練的共用碼表 (EB-HC 一律逐幀建表)
+    (不再逐幀建表、串流不帶碼表)；缺少的 (method, BE) 仍逐幀建表。
     
     * 除了原先的 Axis/L2 誤差外，亦計算 Chamfer Distance 與 Occupancy IoU。
     """
@@ -1548,17 +3399,29 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
     qpts= np.round(pts* scale_factor).astype(np.int32)
     raw_bits= qpts.size * 32
 
+    # 計時前先暖機 (numba JIT 編譯不計入壓縮 / 解壓時間)
+    with contextlib.redirect_stdout(io.StringIO()):
+        warm_up_codecs(pts, huffman_block_size, codebooks)
+
     # (1) Huffman => 無誤差
     print(f"[Method 1] Huffman => 無誤差, Scene={scene_label}, Filename={filename}")
     st= time.time()
     raw_bytes= qpts.tobytes()
-    enc_bits, huff_tree= huffman_encoding(raw_bytes)
-    c_time= time.time()- st
-    c_bits= len(enc_bits)
-    ratio= c_bits/ raw_bits if raw_bits>0 else 0
-    st2= time.time()
-    dec_b= huffman_decoding(enc_bits, huff_tree)
+    huff_cb= codebooks.get("Huffman", 0, HUFFMAN_STREAMS[0]) if codebooks else None
+    if huffman_block_size>0 or huff_cb is not None:
+        enc_stream= huffman_encoding_stream(raw_bytes, huffman_block_size, huff_cb)
+        c_time= time.time()- st
+        c_bits= len(enc_stream)*8
+        st2= time.time()
+        dec_b= huffman_decoding_stream(enc_stream, codebooks=codebooks)
+    else:
+        enc_bits, huff_table= huffman_encoding(raw_bytes)
+        c_time= time.time()- st
+        c_bits= len(enc_bits)
+        st2= time.time()
+        dec_b= huffman_decoding(enc_bits, huff_table)
     dec_time= time.time()- st2
+    ratio= c_bits/ raw_bits if raw_bits>0 else 0
 
     if dec_b:
         dq= np.frombuffer(dec_b, dtype=np.int32).reshape(-1,3)
@@ -1588,18 +3451,25 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
 
     # 測試 BE=0.25...20.0 cm
     BE_list_cm = np.arange(0.25, 20.01, 0.25)
+
+    # EB-HC 每個 BE 各自編碼一次並計時 (單幀、單一 BE 的延遲，與 TSN 分析一致)，
+    # 計時的串流即為後續解碼 / 量測的串流
+    def ebhc_encode_time(bound: str, be_cm: float, layout: str = "value"):
+        st= time.time()
+        data= ebhc_encode_batch(qpts, [be_cm], scale_factor, bound, huffman_block_size,
+                                layout=layout)[0]
+        return data, time.time()- st
+
     for be_cm in BE_list_cm:
         print(f"\n=== Scene={scene_label}, BE={be_cm} cm, Filename={filename} ===")
 
         # (2) EB-HC(Axis)
         print("[Method 2] EB-HC(Axis)")
-        st= time.time()
-        eb_data_axis, trees_axis= ebhc_encode_axis(qpts, be_cm, scale_factor)
-        c_time= time.time()- st
+        eb_data_axis, c_time= ebhc_encode_time("axis", be_cm)
         c_bits= len(eb_data_axis)*8
         ratio= c_bits/ raw_bits if raw_bits>0 else 0
         st2= time.time()
-        dq_a= ebhc_decode_axis(eb_data_axis, trees_axis, len(qpts))
+        dq_a= ebhc_decode_axis(eb_data_axis, codebooks=codebooks)
         dec_time= time.time()- st2
         rec_a= dq_a.astype(np.float32)/ scale_factor
         ea= compute_error(pts, rec_a)
@@ -1624,13 +3494,11 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
 
         # (3) EB-HC(L2)
         print("[Method 3] EB-HC(L2)")
-        st= time.time()
-        eb_data_l2, trees_l2= ebhc_encode_l2(qpts, be_cm, scale_factor)
-        c_time= time.time()- st
+        eb_data_l2, c_time= ebhc_encode_time("l2", be_cm)
         c_bits= len(eb_data_l2)*8
         ratio= c_bits/ raw_bits if raw_bits>0 else 0
         st2= time.time()
-        dq_l2= ebhc_decode_l2(eb_data_l2, trees_l2, len(qpts))
+        dq_l2= ebhc_decode_l2(eb_data_l2, codebooks=codebooks)
         dec_time= time.time()- st2
         rec_l2= dq_l2.astype(np.float32)/ scale_factor
         el2= compute_error(pts, rec_l2)
@@ -1653,6 +3521,36 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
             row_l2["Filename"] = filename
         results.append(row_l2)
 
+        # (2b)/(3b) EB-HC-Dict(Axis)/(L2)
+        for bound, method_name, decode_fn in (("axis", "EB-HC-Dict(Axis)", ebhc_decode_axis),
+                                              ("l2", "EB-HC-Dict(L2)", ebhc_decode_l2)):
+            print(f"[Method {'2b' if bound=='axis' else '3b'}] {method_name}")
+            eb_data_dict, c_time= ebhc_encode_time(bound, be_cm, "dict")
+            c_bits= len(eb_data_dict)*8
+            ratio= c_bits/ raw_bits if raw_bits>0 else 0
+            st2= time.time()
+            dq_d= decode_fn(eb_data_dict, codebooks=codebooks)
+            dec_time= time.time()- st2
+            ed= compute_error(pts, dq_d.astype(np.float32)/ scale_factor)
+            row_dict = {
+                'Scene': scene_label,
+                'Method': method_name,
+                'BE (cm)': be_cm,
+                'Compression Ratio': ratio,
+                'Compression Time (s)': c_time,
+                'Decompression Time (s)': dec_time,
+                'Mean Error (Axis)': ed['mean_axis'],
+                'Max Error (Axis)': ed['max_axis'],
+                'Mean Error (L2)': ed['mean_l2'],
+                'Max Error (L2)': ed['max_l2'],
+                'Num Packets': math.ceil(c_bits/1000) if c_bits>0 else 0,
+                'Chamfer Distance': ed['chamfer_dist'],
+                'Occupancy IoU': ed['occupancy_iou']
+            }
+            if filename:
+                row_dict["Filename"] = filename
+            results.append(row_dict)
+
         # (4) EB-Octree(Axis)
         print("[Method 4] EB-Octree(Axis)")
         c_oct_a= EBOctreeAxisCompressor(be_cm/100.0,1,1000.0,32)
@@ -1718,12 +3616,12 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
         # (6) EB-HC-3D(Axis)
         print("[Method 6] EB-HC-3D(Axis)")
         st= time.time()
-        cmp_data_3a= ebhc3d_axis_compress(pts, be_cm)
+        cmp_data_3a= ebhc3d_axis_compress(pts, be_cm, codebooks=codebooks)
         c_time= time.time()- st
         c_bits= len(cmp_data_3a)*8
         ratio= c_bits/ raw_bits if raw_bits>0 else 0
         st2= time.time()
-        dec_3a= ebhc3d_axis_decompress(cmp_data_3a, be_cm)
+        dec_3a= ebhc3d_axis_decompress(cmp_data_3a, be_cm, codebooks)
         dec_time= time.time()- st2
         e3a= compute_error(pts, dec_3a)
         row_3a = {
@@ -1748,12 +3646,12 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
         # (7) EB-HC-3D(L2)
         print("[Method 7] EB-HC-3D(L2)")
         st= time.time()
-        cmp_data_3l2= ebhc3d_l2_compress(pts, be_cm)
+        cmp_data_3l2= ebhc3d_l2_compress(pts, be_cm, codebooks=codebooks)
         c_time= time.time()- st
         c_bits= len(cmp_data_3l2)*8
         ratio= c_bits/ raw_bits if raw_bits>0 else 0
         st2= time.time()
-        dec_3l2= ebhc3d_l2_decompress(cmp_data_3l2, be_cm)
+        dec_3l2= ebhc3d_l2_decompress(cmp_data_3l2, be_cm, codebooks)
         dec_time= time.time()- st2
         e3l2= compute_error(pts, dec_3l2)
         row_3l2 = {
@@ -1781,7 +3679,12 @@ def run_all_methods(pts: np.ndarray, scene_label: str, filename:str="") -> List[
 ###############################################################################
 # (8) 主程式
 ###############################################################################
-def main():
+def main(codebook_dir: Optional[str] = None):
+    """
+    codebook_dir 給定時，single-frame 測試改用各場景的共用 codebook
+    (<codebook_dir>/<scene>/；不存在則以該場景評估幀之後的 CODEBOOK_TRAIN_FRAMES 個 bin
+    訓練後存檔)。訓練幀與評估幀不重疊 (held-out)；沒有可用的訓練幀時該場景不用 codebook
+    """
     BASE_DIRS = {
         "campus": "KITTI/campus/2011_09_28/2011_09_28_drive_0016_sync/velodyne_points/data",
         # 可自行加入其他路徑:
@@ -1812,6 +3715,22 @@ def main():
             print(f"  => No bin files found in {folder}, skip.")
             continue
 
+        codebooks= None
+        if codebook_dir:
+            codebooks= CodebookCache(os.path.join(codebook_dir, scene_name))
+            if codebooks.get("Huffman", 0, HUFFMAN_STREAMS[0]) is None:
+                # 只用評估幀之後的 bin 訓練，避免 train/test 重疊
+                held_out= find_bin_files(folder, max_count=len(bin_files)+ CODEBOOK_TRAIN_FRAMES)
+                train_frames= [p for p in map(load_points_from_bin, held_out[len(bin_files):])
+                               if len(p)>0]
+                if train_frames:
+                    print(f"  Training codebooks on {len(train_frames)} held-out bins => {codebooks.directory}")
+                    train_codebooks(codebooks, train_frames, np.arange(0.25, 20.01, 0.25))
+                    codebooks.save()
+                else:
+                    print("  => No held-out bins for codebook training, skip codebooks.")
+                    codebooks= None
+
         # (A) Single: 對資料夾中「每一個 bin」都做壓縮測試
         single_scene_results = []
         for single_bin in bin_files:
@@ -1822,7 +3741,8 @@ def main():
                 print("    => Invalid or empty bin, skip single-frame test.")
                 continue
             # 在 run_all_methods 時指定 filename
-            r_single= run_all_methods(pts_single, f"{scene_name}_single", filename=bn)
+            r_single= run_all_methods(pts_single, f"{scene_name}_single", filename=bn,
+                                      codebooks=codebooks)
             single_scene_results.extend(r_single)
 
         # 把 single 結果累加到 all_results
@@ -1847,7 +3767,8 @@ def main():
         big_pts= np.concatenate(multi_pts, axis=0)
         print(f"    => big_pts shape = {big_pts.shape}")
         # Multi => 若想在 CSV 中標 filename，可用 "MULTI"
-        r_multi= run_all_methods(big_pts, f"{scene_name}_multi", filename="MULTI")
+        r_multi= run_all_methods(big_pts, f"{scene_name}_multi", filename="MULTI",
+                                 huffman_block_size=HUFF_BLOCK_SYMBOLS)
         all_results.extend(r_multi)
 
     # (C) 最後將 all_results 寫到主 CSV
@@ -1866,11 +3787,18 @@ def main_ebhc3d_demo():
     parser.add_argument("--input",  type=str, required=True)
     parser.add_argument("--method", type=str, default="axis", choices=["axis","l2"])
     parser.add_argument("--be_cm",  type=float, default=5.0)
+    parser.add_argument("--entropy", type=str, default="huffman", choices=list(ENTROPY_CODERS))
+    parser.add_argument("--layout", type=str, default="split", choices=list(EBHC3D_LAYOUTS))
+    parser.add_argument("--max_level", type=int, default=None,
+                        help="只解到此深度 (粗略點雲)；預設完整解碼")
     args= parser.parse_args()
 
     bin_path= args.input
     method= args.method
     be_cm= args.be_cm
+    entropy= args.entropy
+    layout= args.layout
+    max_level= args.max_level
 
     # 讀檔
     from pathlib import Path
@@ -1890,9 +3818,9 @@ def main_ebhc3d_demo():
 
     start_c= time.time()
     if method=="axis":
-        cmp_data= ebhc3d_axis_compress(pts, be_cm)
+        cmp_data= ebhc3d_axis_compress(pts, be_cm, entropy, layout)
     else:
-        cmp_data= ebhc3d_l2_compress(pts, be_cm)
+        cmp_data= ebhc3d_l2_compress(pts, be_cm, entropy, layout)
     c_time= time.time()- start_c
 
     orig_bytes= pts.nbytes
@@ -1903,9 +3831,9 @@ def main_ebhc3d_demo():
 
     start_d= time.time()
     if method=="axis":
-        dec_pts= ebhc3d_axis_decompress(cmp_data, be_cm)
+        dec_pts= ebhc3d_axis_decompress(cmp_data, be_cm, max_level=max_level)
     else:
-        dec_pts= ebhc3d_l2_decompress(cmp_data, be_cm)
+        dec_pts= ebhc3d_l2_decompress(cmp_data, be_cm, max_level=max_level)
     d_time= time.time()- start_d
     print(f"[INFO] 解壓後點數={len(dec_pts)}, 解壓時間={d_time:.4f} s")
 
@@ -1916,7 +3844,167 @@ def main_ebhc3d_demo():
     print(f"   chamfer_dist={errs['chamfer_dist']:.6f}, occupancy_iou={errs['occupancy_iou']:.4f}")
 
 
+###############################################################################
+# (10) 熵編碼階段 Benchmark: 各方法的中間整數串流 x 各種編碼器
+###############################################################################
+def _native_dtype(values: np.ndarray) -> np.dtype:
+    """
+    串流的原生整數 dtype (little-endian)，例如原始 bytes 為 uint8、座標為 int32
+    """
+    return np.asarray(values).dtype.newbyteorder('<')
+
+def _byte_stream(values: np.ndarray) -> np.ndarray:
+    """
+    值域本來就是 0..255 的串流 (mask、節點種類) => uint8；超出時報錯，不默默截斷
+    """
+    values= np.asarray(values)
+    if values.size and (values.min() < 0 or values.max() > 255):
+        raise ValueError(f"byte stream out of range: [{values.min()}, {values.max()}]")
+    return values.astype(np.uint8)
+
+def _int_array_bytes(values: np.ndarray) -> bytes:
+    """
+    通用位元組壓縮器的輸入: 以串流原生 dtype (little-endian) 排列的 bytes，不另外加寬
+    """
+    values= np.asarray(values)
+    return values.astype(_native_dtype(values), copy=False).tobytes()
+
+def _bytes_codec(compress_fn, decompress_fn):
+    def enc(values: np.ndarray) -> bytes:
+        values= np.asarray(values)
+        raw= _int_array_bytes(values)
+        return struct.pack('<I3s', values.size, _native_dtype(values).str.encode()) + compress_fn(raw)
+    def dec(data: bytes) -> np.ndarray:
+        count, dt= struct.unpack('<I3s', data[:7])
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.frombuffer(decompress_fn(data[7:]), dtype=dt.decode()).astype(np.int64)
+    return enc, dec
+
+def _symbol_codec(pack_fn, unpack_fn):
+    return (lambda values: pack_fn(np.asarray(values, dtype=np.int64)),
+            lambda data: unpack_fn(data, 0)[0])
+
+# 名稱 => (encode(int 陣列)->bytes, decode(bytes)->int 陣列)；新編碼器加在這裡即可納入比較
+ENTROPY_BENCH_CODERS = {
+    "zlib-1": _bytes_codec(lambda b: zlib.compress(b, 1), zlib.decompress),
+    "zlib-6": _bytes_codec(lambda b: zlib.compress(b, 6), zlib.decompress),
+    "zlib-9": _bytes_codec(lambda b: zlib.compress(b, 9), zlib.decompress),
+    "lzma": _bytes_codec(lzma.compress, lzma.decompress),
+    "bz2": _bytes_codec(bz2.compress, bz2.decompress),
+    "huffman": _symbol_codec(huffman_stream_pack, huffman_stream_unpack),
+    "rans": _symbol_codec(rans_stream_pack, rans_stream_unpack),
+}
+
+EBHC3D_BYTE_STREAMS = ("kinds", "masks0", "masks1")   # EB-HC-3D 中真正以 byte 為值域的子串流
+
+def capture_entropy_streams(pts: np.ndarray, be_cm: float, scale_factor=1000) -> Dict[str, np.ndarray]:
+    """
+    擷取各方法送進熵編碼前的整數串流 (保留各自的原生 dtype):
+      Huffman 原始 bytes (uint8)、EB-HC 各軸 symbols (int32)、
+      EB-Octree tree_list (uint8 mask) / center_list (int32)、
+      EB-HC-3D 單一 symbol stream 與 split 子串流 (kinds / masks 為 uint8；
+      counts 與殘差 (q+128，max_depth 強制成葉時可超出 0..255) 為 int32，同編碼器 buffer)
+    """
+    streams= {}
+    qpts= np.round(pts* scale_factor).astype(np.int32)
+    streams["Huffman/bytes"]= np.frombuffer(qpts.tobytes(), dtype=np.uint8)
+    for method, fn in (("EB-HC(Axis)", ebhc_axis_symbols), ("EB-HC(L2)", ebhc_l2_symbols)):
+        for name, syms in zip(EBHC_STREAMS, fn(qpts, be_cm, scale_factor)):
+            streams[f"{method}/{name}"]= np.asarray(syms, dtype=np.int32)
+    for method, cls in (("EB-Octree(Axis)", EBOctreeAxisCompressor),
+                        ("EB-Octree(L2)", EBOctreeL2Compressor)):
+        tb, cb= cls(be_cm/100.0, 1, float(scale_factor), 32).flatten(pts)
+        streams[f"{method}/tree_list"]= _byte_stream(tb)
+        streams[f"{method}/center_list"]= np.asarray(cb, dtype=np.int32)
+    for method, bound in (("EB-HC-3D(Axis)", "axis"), ("EB-HC-3D(L2)", "l2")):
+        symbols, _, _= ebhc3d_build_symbols(pts, be_cm, bound)
+        for layout in ("flat", "split"):
+            parts= ebhc3d_substreams(symbols, 10, layout)
+            for name, part in zip(EBHC3D_STREAMS[layout], parts):
+                streams[f"{method}/{name}"]= (_byte_stream(part) if name in EBHC3D_BYTE_STREAMS
+                                              else part.astype(np.int32))
+    return streams
+
+def _best_time(fn, arg, repeat: int):
+    best= float('inf')
+    out= None
+    for _ in range(max(1, repeat)):
+        st= time.perf_counter()
+        out= fn(arg)
+        best= min(best, time.perf_counter()- st)
+    return out, best
+
+def benchmark_entropy_coders(streams: Dict[str, np.ndarray], coders: Optional[List[str]] = None,
+                             repeat: int = 3, label: str = "") -> List[dict]:
+    """
+    每個串流 x 每個編碼器: 壓縮後 bytes、編/解碼 MB/s (以串流原生 dtype 的大小計，取 repeat 次最佳)。
+    解碼結果與輸入不一致時丟出 ValueError；編碼器不支援該串流 (如 rANS 字母表過大) 時略過。
+    """
+    rows= []
+    for sname, values in streams.items():
+        values= np.asarray(values)
+        raw_bytes= values.nbytes
+        for cname in (coders or list(ENTROPY_BENCH_CODERS)):
+            enc_fn, dec_fn= ENTROPY_BENCH_CODERS[cname]
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    data, t_enc= _best_time(enc_fn, values, repeat)
+                except ValueError as e:
+                    print(f"    skip {sname} / {cname}: {e}", file=sys.stderr)
+                    continue
+                dec, t_dec= _best_time(dec_fn, data, repeat)
+            if not np.array_equal(np.asarray(dec, dtype=np.int64), values):
+                raise ValueError(f"{cname} round-trip mismatch on {sname}")
+            mb= raw_bytes/ 1e6
+            rows.append({
+                'Label': label,
+                'Stream': sname,
+                'Coder': cname,
+                'Symbols': values.size,
+                'Raw Bytes': raw_bytes,
+                'Bytes': len(data),
+                'Ratio': len(data)/ raw_bytes if raw_bytes>0 else 0,
+                'Encode MB/s': mb/ t_enc if t_enc>0 else 0,
+                'Decode MB/s': mb/ t_dec if t_dec>0 else 0,
+            })
+    return rows
+
+ENTROPY_BENCH_COLUMNS= ['Label', 'Stream', 'Coder', 'Symbols', 'Raw Bytes', 'Bytes', 'Ratio',
+                        'Encode MB/s', 'Decode MB/s']
+
+def main_entropy_bench():
+    """
+    python EBpaper.py --input a.bin b.bin --be_cm 1 5 --out entropy_bench.csv
+    """
+    parser= argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, nargs="+", required=True)
+    parser.add_argument("--be_cm", type=float, nargs="+", default=[5.0])
+    parser.add_argument("--coders", type=str, nargs="+", default=None,
+                        choices=list(ENTROPY_BENCH_CODERS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=str, default="entropy_bench.csv")
+    args= parser.parse_args()
+
+    rows= []
+    for bin_path in args.input:
+        pts= load_points_from_bin(bin_path)
+        if len(pts)==0:
+            print(f"Empty/invalid bin, skip: {bin_path}")
+            continue
+        for be_cm in args.be_cm:
+            label= f"{os.path.basename(bin_path)}@{be_cm}cm"
+            print(f"[INFO] {label}: 擷取中間串流 ...")
+            with contextlib.redirect_stdout(io.StringIO()):
+                streams= capture_entropy_streams(pts, be_cm)
+            rows.extend(benchmark_entropy_coders(streams, args.coders, args.repeat, label))
+    write_results_to_csv(rows, args.out, ENTROPY_BENCH_COLUMNS)
+    print(f"[INFO] {len(rows)} rows => '{args.out}'")
+
+
 if __name__=="__main__":
     # 預設執行 main()，如需測試 EB-HC-3D Demo，請自行呼叫 main_ebhc3d_demo()
+    # 熵編碼階段 Benchmark 請呼叫 main_entropy_bench()
     main()
     # main_ebhc3d_demo()
+    # main_entropy_bench()
@@ -89,10 +89,10 @@ def run_subset_on_points(eb, pts: np.ndarray, scene_label: str, be_list_cm: List
 
     for be_cm in be_list_cm:
         # EB-HC(Axis)
-        eb_data_axis, trees_axis = eb.ebhc_encode_axis(qpts, be_cm, scale_factor)
+        eb_data_axis = eb.ebhc_encode_axis(qpts, be_cm, scale_factor)
         c_bits = len(eb_data_axis) * 8
         ratio = c_bits / raw_bits if raw_bits > 0 else 0
-        dq_a = eb.ebhc_decode_axis(eb_data_axis, trees_axis, len(qpts))
+        dq_a = eb.ebhc_decode_axis(eb_data_axis)
         rec_a = dq_a.astype(np.float32) / scale_factor
         ea = eb.compute_error(pts, rec_a)
         results.append({
@@ -112,10 +112,10 @@ def run_subset_on_points(eb, pts: np.ndarray, scene_label: str, be_list_cm: List
         })
 
         # EB-HC(L2)
-        eb_data_l2, trees_l2 = eb.ebhc_encode_l2(qpts, be_cm, scale_factor)
+        eb_data_l2 = eb.ebhc_encode_l2(qpts, be_cm, scale_factor)
         c_bits = len(eb_data_l2) * 8
         ratio = c_bits / raw_bits if raw_bits > 0 else 0
-        dq_l2 = eb.ebhc_decode_l2(eb_data_l2, trees_l2, len(qpts))
+        dq_l2 = eb.ebhc_decode_l2(eb_data_l2)
         rec_l2 = dq_l2.astype(np.float32) / scale_factor
         el2 = eb.compute_error(pts, rec_l2)
         results.append({